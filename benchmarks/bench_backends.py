@@ -0,0 +1,60 @@
+"""
+bqclass versus bqnode object models
+
+Times parsing, a full traversal (names, values and vertex coordinates) and
+serialization of a synthetic image document with both backends.
+
+    python benchmarks/bench_backends.py [gobjects]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lxml import etree
+from bqapi.types import get_backend
+
+
+def make_doc(count):
+    root = etree.Element('image', name='bench', uri='/data_service/00-bench')
+    for i in range(100):
+        etree.SubElement(root, 'tag', name='meta%d' % i, value=str(i))
+    layer = etree.SubElement(root, 'gobject', name='cells')
+    for i in range(count):
+        gob = etree.SubElement(layer, 'polygon', name='cell%d' % i)
+        etree.SubElement(gob, 'tag', name='label', value=str(i))
+        for k in range(8):
+            etree.SubElement(gob, 'vertex', x=str(i + k), y=str(i * 2 + k), index=str(k))
+    return etree.tostring(root)
+
+
+def walk(resource):
+    count = 0
+    stack = [ resource ]
+    while stack:
+        node = stack.pop()
+        count += 1
+        node.name, node.value
+        stack.extend(node.tags)
+        stack.extend(node.gobjects)
+        for v in getattr(node, 'vertices', ()):
+            v.x, v.y
+            count += 1
+    return count
+
+
+def main(count=20000, repeat=3):
+    xml = make_doc(count)
+    print("%d gobjects, %d bytes" % (count, len(xml)))
+    for name in ('bqclass', 'bqnode'):
+        factory = get_backend(name).BQFactory(None)
+        resource = factory.from_string(xml)
+        parse = min(timeit.repeat(lambda: factory.from_string(xml), number=1, repeat=repeat))
+        traverse = min(timeit.repeat(lambda: walk(resource), number=1, repeat=repeat))
+        serialize = min(timeit.repeat(lambda: factory.to_string(resource), number=1, repeat=repeat))
+        print("%-8s parse: %8.4fs  traverse: %8.4fs  serialize: %8.4fs" % (name, parse, traverse, serialize))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
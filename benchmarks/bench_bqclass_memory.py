@@ -0,0 +1,65 @@
+"""
+Memory footprint of the bqclass object model
+
+Reports the number of python heap bytes held per vertex and per tag
+after parsing a synthetic annotation document with BQFactory.
+
+    python benchmarks/bench_bqclass_memory.py [count]
+"""
+import os
+import sys
+import gc
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lxml import etree
+from bqapi.bqclass import BQFactory, BQVertex, BQTag
+
+
+def make_polygon_doc(count):
+    root = etree.Element('image', name='bench', uri='/data_service/00-bench')
+    gob = etree.SubElement(root, 'gobject', type='polygon', name='cell')
+    for i in range(count):
+        etree.SubElement(gob, 'vertex', x=str(i), y=str(i * 2), z='0', t='0', index=str(i))
+    return root
+
+
+def make_tag_doc(count):
+    root = etree.Element('image', name='bench', uri='/data_service/00-bench')
+    for i in range(count):
+        etree.SubElement(root, 'tag', name='tag%d' % i, value=str(i), type='number')
+    return root
+
+
+def measure(fn):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main(count=100000):
+    factory = BQFactory(None)
+
+    polygon = make_polygon_doc(count)
+    _, nbytes = measure(lambda: factory.from_etree(polygon))
+    print("parsed vertex: %8.1f bytes/vertex" % (float(nbytes) / count))
+
+    tagdoc = make_tag_doc(count)
+    _, nbytes = measure(lambda: factory.from_etree(tagdoc))
+    print("parsed tag:    %8.1f bytes/tag" % (float(nbytes) / count))
+
+    _, nbytes = measure(lambda: [BQVertex(x=i, y=i, z=0, t=0) for i in range(count)])
+    print("BQVertex():    %8.1f bytes/vertex" % (float(nbytes) / count))
+
+    _, nbytes = measure(lambda: [BQTag(name='tag', value=i) for i in range(count)])
+    print("BQTag():       %8.1f bytes/tag" % (float(nbytes) / count))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,64 @@
+"""
+Eager versus lazy parsing with BQFactory
+
+Parses a synthetic deep image document (nested tags and gobjects) and
+times building the model, looking up a few tags, and walking the whole tree.
+
+    python benchmarks/bench_lazy_parse.py [gobjects]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lxml import etree
+from bqapi.bqclass import BQFactory
+
+
+def make_doc(count):
+    root = etree.Element('image', name='bench', uri='/data_service/00-bench')
+    etree.SubElement(root, 'tag', name='filename', value='bench.tif')
+    meta = etree.SubElement(root, 'tag', name='image_meta')
+    for i in range(100):
+        etree.SubElement(meta, 'tag', name='meta%d' % i, value=str(i))
+    layer = etree.SubElement(root, 'gobject', name='cells')
+    for i in range(count):
+        gob = etree.SubElement(layer, 'polygon', name='cell%d' % i)
+        etree.SubElement(gob, 'tag', name='label', value=str(i))
+        for k in range(8):
+            etree.SubElement(gob, 'vertex', x=str(i + k), y=str(i * 2 + k), index=str(k))
+    return root
+
+
+def walk(resource):
+    count = 0
+    stack = [ resource ]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.tags)
+        stack.extend(node.gobjects)
+        if hasattr(node, 'vertices'):
+            count += len(node.vertices)
+    return count
+
+
+def lookup(resource):
+    return resource.find('filename').value, resource.find('image_meta/meta5').value
+
+
+def main(count=20000, repeat=3):
+    doc = make_doc(count)
+    print("%d gobjects" % count)
+    for lazy in (False, True):
+        factory = BQFactory(None, lazy=lazy)
+        mode = 'lazy ' if lazy else 'eager'
+        parse = min(timeit.repeat(lambda: factory.from_etree(doc), number=1, repeat=repeat))
+        find = min(timeit.repeat(lambda: lookup(factory.from_etree(doc)), number=1, repeat=repeat))
+        full = min(timeit.repeat(lambda: walk(factory.from_etree(doc)), number=1, repeat=repeat))
+        print("%s parse: %8.4fs  parse+find: %8.4fs  parse+walk: %8.4fs" % (mode, parse, find, full))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
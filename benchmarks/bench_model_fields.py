@@ -0,0 +1,67 @@
+"""
+Serialization throughput of bqclass objects
+
+Reports model_fields calls per second for the cached per class
+field getters against the generic field loop (extract_fields), and the nodes
+per second written by iter_xml and to_etree for a parsed annotation document.
+
+    python benchmarks/bench_model_fields.py [gobjects]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lxml import etree
+from bqapi.bqclass import BQFactory, BQTag, BQVertex, BQGObject, BQImage, model_fields, extract_fields, iter_xml
+
+
+def make_doc(count):
+    root = etree.Element('image', name='bench', uri='/data_service/00-bench')
+    for i in range(100):
+        etree.SubElement(root, 'tag', name='meta%d' % i, value=str(i), type='number')
+    layer = etree.SubElement(root, 'gobject', name='cells')
+    for i in range(count):
+        gob = etree.SubElement(layer, 'polygon', name='cell%d' % i)
+        etree.SubElement(gob, 'tag', name='label', value=str(i))
+        for k in range(8):
+            etree.SubElement(gob, 'vertex', x=str(i + k), y=str(i * 2 + k), index=str(k))
+    return root
+
+
+def count_nodes(resource):
+    count = 0
+    stack = [ resource ]
+    while stack:
+        node = stack.pop()
+        count += 1 + len(node.iterkids('vertices')) if hasattr(node, 'vertices') else 1
+        stack.extend(node.iterkids('tags'))
+        stack.extend(node.iterkids('gobjects'))
+    return count
+
+
+def rate(fn, number):
+    return number / min(timeit.repeat(fn, number=number, repeat=3))
+
+
+def main(count=20000):
+    samples = [ BQTag(name='tag', value='1', type='number'),
+                BQVertex(x=1.0, y=2.0, z=None, t=None, c=None, index=0),
+                BQGObject(name='cell', type='polygon'),
+                BQImage(name='image', uri='/data_service/00-1', ts='2016', resource_uniq='00-1') ]
+    for dbo in samples:
+        fields = list(dbo.xmlfields)
+        cached = rate(lambda: model_fields(dbo), 100000)
+        generic = rate(lambda: extract_fields(dbo, fields), 100000)
+        print("%-10s model_fields: %10.0f/s  generic: %10.0f/s" % (dbo.xmltag, cached, generic))
+
+    resource = BQFactory(None).from_etree(make_doc(count))
+    nodes = count_nodes(resource)
+    stream = rate(lambda: sum(len(c) for c in iter_xml(resource)), 1)
+    tree = rate(lambda: BQFactory.to_etree(resource), 1)
+    print("%d nodes  iter_xml: %10.0f nodes/s  to_etree: %10.0f nodes/s" % (nodes, stream * nodes, tree * nodes))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,64 @@
+"""
+Serialization of bqclass object graphs
+
+Compares building an element tree with to_etree + etree.tostring against
+the streaming serializer iter_xml (time and peak python heap).
+
+    python benchmarks/bench_serialize.py [gobjects]
+"""
+import os
+import sys
+import gc
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lxml import etree
+from bqapi.bqclass import BQFactory, BQImage, iter_xml
+
+
+def make_image(count):
+    image = BQImage(name='bench', uri='/data_service/00-bench')
+    for i in range(100):
+        image.addTag(name='meta%d' % i, value=str(i))
+    layer = image.addGObject(name='cells')
+    for i in range(count):
+        gob = layer.addGObject(name='cell%d' % i, type='polygon')
+        gob.addTag(name='label', value=str(i))
+        gob.verticesFromArray([ (i + k, i * 2 + k) for k in range(8) ])
+    return image
+
+
+def tree(image):
+    return len(etree.tostring(BQFactory.to_etree(image)))
+
+
+def stream(image):
+    return sum(len(chunk) for chunk in iter_xml(image))
+
+
+def measure(fn, image):
+    gc.collect()
+    t0 = time.time()
+    nbytes = fn(image)
+    elapsed = time.time() - t0
+    # tracing slows python down: measure memory in a second run
+    tracemalloc.start()
+    fn(image)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return nbytes, elapsed, peak
+
+
+def main(count=20000):
+    image = make_image(count)
+    print("%d gobjects" % count)
+    for name, fn in (('to_etree+tostring', tree), ('iter_xml', stream)):
+        nbytes, elapsed, peak = measure(fn, image)
+        # the lxml tree itself is not traced: only python allocations are reported
+        print("%-18s %10d bytes %8.3fs  peak python heap %8.1f MB" % (name, nbytes, elapsed, peak / 1e6))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
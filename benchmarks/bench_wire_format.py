@@ -0,0 +1,60 @@
+"""
+XML versus JSON documents for BQSession.load/query
+
+Builds a metadata heavy query response (images with many tags), renders it
+both as XML and as JSON in the xml2d layout, and times decoding the bytes
+into BQ objects with each backend, as BQSession does for each format.
+lxml parses xml in C while json is decoded and then turned into objects in
+python, so wire_format='json' is not expected to save client cpu.
+
+    python benchmarks/bench_wire_format.py [images]
+"""
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lxml import etree
+from bqapi import bqclass, bqnode
+from bqapi.xmldict import xml2d, DictElement
+
+
+def make_doc(count):
+    root = etree.Element('resource', uri='/data_service/image')
+    for i in range(count):
+        image = etree.SubElement(root, 'image', name='img%d.tif' % i, uri='/data_service/00-%d' % i,
+                                 resource_uniq='00-%d' % i, ts='2020-01-01T00:00:00')
+        meta = etree.SubElement(image, 'tag', name='image_meta', type='image_meta')
+        for k in range(20):
+            etree.SubElement(meta, 'tag', name='meta%d' % k, value=str(k * 0.5))
+        etree.SubElement(image, 'tag', name='filename', value='img%d.tif' % i)
+        notes = etree.SubElement(image, 'tag', name='notes')
+        etree.SubElement(notes, 'value').text = 'note %d' % i
+    return root
+
+
+def query_xml(factory, content):
+    return [ factory.from_etree(item) for item in factory.string2etree(content) ]
+
+
+def query_json(factory, content):
+    return [ factory.from_dict({ item.tag : item.d }) for item in DictElement.fromdict(json.loads(content)) ]
+
+
+def main(count=2000, repeat=5):
+    doc = make_doc(count)
+    xml = etree.tostring(doc)
+    js = json.dumps(xml2d(doc, text=True)).encode()
+    print("%d images  xml %d bytes  json %d bytes" % (count, len(xml), len(js)))
+    for mod in (bqclass, bqnode):
+        factory = mod.BQFactory(None)
+        assert len(query_xml(factory, xml)) == len(query_json(factory, js)) == count
+        for name, fct, content in (('xml ', query_xml, xml), ('json', query_json, js)):
+            t = min(timeit.repeat(lambda: fct(factory, content), number=1, repeat=repeat))
+            print("%-8s %s decode: %8.4fs" % (mod.__name__.split('.')[-1], name, t))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
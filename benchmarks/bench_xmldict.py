@@ -0,0 +1,96 @@
+"""
+Throughput of the xmldict conversions
+
+Times xml2d, d2xml and xml2nv (plain and typed) on a synthetic image
+metadata document against the former recursive implementations.
+
+    python benchmarks/bench_xmldict.py [tags]
+"""
+import os
+import sys
+import timeit
+from itertools import groupby
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lxml import etree
+from bqapi.xmldict import xml2d, d2xml, xml2nv
+
+
+# recursive reference implementations
+def xml2d_recursive(e):
+    def _xml2d(e):
+        kids = dict(e.attrib)
+        for k, g in groupby(e, lambda x: x.tag):
+            g = [ _xml2d(x) for x in g ]
+            kids[k]=  g
+        return kids
+    return { e.tag : _xml2d(e) }
+
+def d2xml_recursive(d):
+    def _d2xml(d, p):
+        for k,v in list(d.items()):
+            if v is None: continue
+            if isinstance(v,dict):
+                node = etree.SubElement(p, k)
+                _d2xml(v, node)
+            elif isinstance(v,list):
+                for item in v:
+                    if item is None: continue
+                    node = etree.SubElement(p, k)
+                    _d2xml(item, node)
+            else:
+                p.set(k, str(v))
+    k,v = list(d.items())[0]
+    node = etree.Element(k)
+    _d2xml(v, node)
+    return node
+
+def xml2nv_recursive(e):
+    def _xml2nv(e, a, path):
+        for g in e:
+            n = g.get('name') or g.get('type')
+            if n is None:
+                continue
+            a['%s%s'%(path, n)] = g.get('value')
+            for child in g:
+                _xml2nv(child, a, '%s%s/'%(path, n))
+        return
+    a = {}
+    _xml2nv(e, a, '')
+    return a
+
+
+def make_meta(count):
+    "image metadata: groups of tags with numeric, boolean and string values"
+    root = etree.Element('resource', uri='/image_service/00-bench?meta')
+    image = etree.SubElement(root, 'tag', name='image_meta')
+    values = ['512', '0.3225', 'true', 'uint8', 'micron', '1.5e-3']
+    for i in range(count):
+        group = etree.SubElement(image, 'tag', name='group%d' % (i // 50))
+        item = etree.SubElement(group, 'tag', name='item%d' % i, value=values[i % len(values)])
+        etree.SubElement(item, 'tag', name='unit', value='micron')
+    return root
+
+
+def rate(fn, number=3):
+    return min(timeit.repeat(fn, number=1, repeat=number))
+
+
+def main(count=50000):
+    meta = make_meta(count)
+    d = xml2d(meta)
+    print("%d tags" % count)
+    for name, new, old in (('xml2d', lambda: xml2d(meta), lambda: xml2d_recursive(meta)),
+                           ('xml2d typed', lambda: xml2d(meta, typed=True), None),
+                           ('d2xml', lambda: d2xml(d), lambda: d2xml_recursive(d)),
+                           ('xml2nv', lambda: xml2nv(meta), lambda: xml2nv_recursive(meta)),
+                           ('xml2nv typed', lambda: xml2nv(meta, typed=True), None)):
+        line = "%-13s %8.4fs" % (name, rate(new))
+        if old is not None:
+            line += "  recursive: %8.4fs" % rate(old)
+        print(line)
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
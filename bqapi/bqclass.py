@@ -60,12 +60,21 @@ import io
 import inspect
 import logging
 import tempfile
+import json
 import collections
+from concurrent.futures import ThreadPoolExecutor
 try:
     from lxml import etree
 except ImportError:
     import xml.etree.ElementTree as etree
-from .xmldict import xml2nv
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from .xmldict import xml2nv, DictElement
+from .exception import BQApiError
+from .cache import image_meta_cache
+from .util import ordered_map, create_output, yx_layout
 
 
 log = logging.getLogger('bqapi.class')
@@ -77,6 +86,9 @@ __all__ = [ 'BQFactory', 'BQNode', 'BQImage', 'BQResource', 'BQValue', 'BQTag',
 
 gobject_primitives = set(['point', 'label', 'polyline', 'polygon', 'circle', 'ellipse', 'rectangle', 'square', 'line'])
 
+# size of the byte strings yielded by iter_xml
+XML_CHUNK_SIZE = 64 * 1024
+
 
 ################################################################################
 # Base class for bisque resources
@@ -84,6 +96,7 @@ gobject_primitives = set(['point', 'label', 'polyline', 'polygon', 'circle', 'el
 
 class BQNode (object):
     '''Base class for parsing Bisque XML'''
+    __slots__ = ()
     xmltag = ''
     xmlfields = []
     xmlkids = []
@@ -91,9 +104,7 @@ class BQNode (object):
     def __init__(self, *args, **kw):
         for k,v in zip(self.xmlfields, args):
             setattr(self, k, v)
-        for k in self.xmlfields:
-            if k in self.__dict__:
-                continue
+        for k in self.xmlfields[len(args):]:
             setattr(self, k, kw.get(k, None))
 
     def initialize(self):
@@ -116,12 +127,17 @@ class BQNode (object):
     def toTuple (self):
         return tuple( [ x for x in self.xmlfields ] )
 
+    def xmlparts(self, baseuri):
+        "return (xmltag, attributes, text, kids) written by iter_xml"
+        return self.xmltag, model_fields(self, baseuri), None, [ x for kid_name in self.xmlkids for x in getattr(self, kid_name, None) or () ]
+
 ################################################################################
 # Value
 ################################################################################
 
 class BQValue (BQNode):
     '''tag value'''
+    __slots__ = ('value', 'type', 'index', 'session')
     xmltag = "value"
     xmlfields = ['value', 'type', 'index']
 
@@ -150,36 +166,127 @@ class BQValue (BQNode):
         if self.value is not None: n.text = str(self.value)
         return n
 
+    def xmlparts(self, baseuri):
+        attrs = {}
+        if self.type is not None: attrs['type'] = str(self.type)
+        if self.index is not None: attrs['index'] = str(self.index)
+        return 'value', attrs, None if self.value is None else str(self.value), ()
+
 ################################################################################
 # Base class for bisque resources
 ################################################################################
 
+class VersionedList(list):
+    """A child list counting its changes
+
+    Every mutating method increments version, so the name index of the
+    parent (see L{BQResource.named}) knows when it is stale.
+    """
+    __slots__ = ('version',)
+
+    def __init__(self, *args):
+        super(VersionedList, self).__init__(*args)
+        self.version = 0
+
+    def append(self, item):
+        # the parser appends every child: kept out of the generic wrapper
+        self.version += 1
+        list.append(self, item)
+
+def _changing(method):
+    def change(self, *args, **kw):
+        self.version += 1
+        return method(self, *args, **kw)
+    change.__name__ = method.__name__
+    change.__doc__ = method.__doc__
+    return change
+
+for _method in ('extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+                '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+    setattr(VersionedList, _method, _changing(getattr(list, _method)))
+del _method
+
+
+def lazylist(attr):
+    """A child list property that is only allocated when first used
+
+    Most nodes (leaf tags in particular) never have children so the list
+    is created on first access and stored in the slot C{attr}.  Children of
+    a node parsed lazily (see L{BQFactory}) are built before the list is returned.
+    Lists are kept as L{VersionedList}, an assigned list is copied into one.
+    """
+    def get_list(self):
+        if self._pending is not None:
+            self._pending.expand(self)
+        kids = getattr(self, attr)
+        if kids is None:
+            kids = VersionedList()
+            setattr(self, attr, kids)
+        return kids
+    def set_list(self, kids):
+        if kids is not None and not isinstance(kids, VersionedList):
+            kids = VersionedList(kids)
+        setattr(self, attr, kids)
+    return property(get_list, set_list)
+
+
 class BQResource (BQNode):
     '''Base class for Bisque resources'''
+    # __dict__ is only materialized when an attribute outside of the slots is set
+    __slots__ = ('_name', 'type', 'uri', 'ts', 'resource_uniq', 'parent', 'session', 'xmltree',
+                 '_tags', '_gobjects', '_kids', '_values', '_pending', '__dict__')
     xmltag = 'resource'
     xmlfields = ['name', 'type', 'uri', 'ts', 'resource_uniq']
     xmlkids = ['kids', 'tags', 'gobjects',] #  'values'] handled differently
 
+    tags = lazylist('_tags')
+    gobjects = lazylist('_gobjects')
+    kids = lazylist('_kids')
+    values = lazylist('_values')
+
     def __repr__(self):
         return '(%s:%s)'%(self.xmltag, self.uri) #pylint: disable=no-member
 
     def __init__(self, *args, **kw):
-        self.tags = []
-        self.gobjects = []
-        self.kids = []
-        self.values = []
+        self._tags = None
+        self._gobjects = None
+        self._kids = None
+        self._values = None
+        self._pending = None   # factory that builds the children from xmltree
         self.parent = None
         super(BQResource, self).__init__(*args, **kw)
 
+    def get_name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+        # the name index of the parent no longer matches
+        parent = getattr(self, 'parent', None)
+        if parent is not None and getattr(parent, '_name_index', None) is not None:
+            parent._name_index = None
+
+    name = property(get_name, set_name)
+
+    def iterkids(self, kid_name):
+        "iterate over a child list without allocating it"
+        if self._pending is not None:
+            self._pending.expand(self)
+        try:
+            return getattr(self, '_%s' % kid_name) or ()
+        except AttributeError:
+            return getattr(self, kid_name, None) or ()
+
     def toDict (self):
         objs = {}
-        objs.update ( [ (f.name, f) for f in self.tags if f.name ] )
-        objs.update ( [ (f.name, f) for f in self.gobjects if f.name ] )
+        objs.update ( [ (f.name, f) for f in self.iterkids('tags') if f.name ] )
+        objs.update ( [ (f.name, f) for f in self.iterkids('gobjects') if f.name ] )
         return objs
 
     def set_parent(self, parent):
         self.parent = parent
         parent.kids.append(self)
+        parent._index_child('kids', self)
 
     def addTag(self, name=None, value=None, type = None, tag=None):
         if tag is None:
@@ -190,44 +297,109 @@ class BQResource (BQNode):
 
     def addGObject(self, name=None, value=None, type = None, gob=None):
         if gob is None:
-            gob = BQGObject(name=name, value=value, type = type)
+            gob = BQFactory.resources.get(type, BQGObject) if type in gobject_primitives else BQGObject
+            gob = gob(name=name, value=value, type = type)
         gob.set_parent(self)
+        # spatial indexes of this node and its ancestors cover the new gobject
+        node = self
+        while node is not None:
+            if getattr(node, '_spatial_index', None) is not None:
+                node._spatial_index = None
+            node = getattr(node, 'parent', None)
+        return gob
     add_gob = addGObject
 
+    def spatialIndex(self):
+        """Return a spatial index over all nested gobjects (requires numpy)
+
+        The index is built on first use and rebuilt after gobjects are added
+        with addGObject. See L{bqapi.geometry.GObjectIndex}
+        """
+        index = getattr(self, '_spatial_index', None)
+        if index is None:
+            from .geometry import GObjectIndex
+            index = self._spatial_index = GObjectIndex(self)
+        return index
+    spatial_index = spatialIndex
+
+
+    # limit keyword -> child collection searched by find/findall
+    find_collections = (('tag', 'tags'), ('gobject', 'gobjects'), ('kid', 'kids'))
+
+    def named(self, collection, name):
+        """Return the children of collection ('tags', 'gobjects', 'kids') with name
+
+        Uses a name index built on first lookup and kept current by set_parent.
+        It is rebuilt when the child list is replaced or changed in any way
+        (see L{VersionedList}) and after a child is renamed.
+        """
+        kids = self.iterkids(collection)
+        if not kids:
+            return ()
+        indexes = getattr(self, '_name_index', None)
+        if indexes is None:
+            indexes = self._name_index = {}
+        entry = indexes.get(collection)
+        version = getattr(kids, 'version', None)
+        if entry is None or entry[0] is not kids or version is None or entry[1] != version:
+            names = {}
+            for kid in kids:
+                names.setdefault(kid.name, []).append(kid)
+            entry = indexes[collection] = [kids, version, names]
+        return entry[2].get(name, ())
+
+    def _index_child(self, collection, kid):
+        "add a just appended kid to the name index of collection if present"
+        indexes = getattr(self, '_name_index', None)
+        entry = indexes and indexes.get(collection)
+        if entry is not None and entry[0] is getattr(self, '_%s' % collection) and entry[1] + 1 == entry[0].version:
+            entry[1] += 1
+            entry[2].setdefault(kid.name, []).append(kid)
+
+    def reindex(self):
+        "drop the name index, i.e. after changing the children in place (done by every change of the child lists)"
+        if getattr(self, '_name_index', None) is not None:
+            self._name_index = None
 
     def findall (self, name, limit=None):
-        "find all name that match, options limit search tag, gobject or a kid"
+        """find all name that match, options limit search tag, gobject or a kid
+
+        name may be a path 'a/b/c' of names, each searched in the children
+        of the previous matches, when no child is named exactly name. Empty
+        names of a path are skipped and a path without names ('/') matches nothing.
+        """
         limit = limit or  ['tag', 'gobject', 'kid']
         results =[]
-        if 'tag' in limit:
-            for tg in self.tags:
-                if tg.name == name:
-                    results.append( tg )
-        if 'gobject' in limit:
-            for tg in self.gobjects:
-                if tg.name == name:
-                    results.append(  tg )
-        if 'kid' in limit:
-            for tg in self.kids:
-                if tg.name == name:
-                    results.append ( tg )
+        for kind, collection in self.find_collections:
+            if kind in limit:
+                results.extend(self.named(collection, name))
+        if not results and '/' in name:
+            results = self._find_path(name, limit)
         return results
 
+    def _find_path(self, name, limit):
+        parts = [ part for part in name.split('/') if part ]
+        if not parts:
+            return []
+        nodes = [ self ]
+        for part in parts:
+            nodes = [ found for node in nodes for found in node.findall(part, limit) ]
+        return nodes
+
     def find(self, name, limit=None):
-        "Find first element and return options limit search tag, gobject or a kid"
+        """Find first element and return options limit search tag, gobject or a kid
+
+        name may be a path 'a/b/c', the first match of findall is returned
+        """
         limit = limit or  ['tag', 'gobject', 'kid']
-        if 'tag' in limit:
-            for tg in self.tags:
-                if tg.name == name:
-                    return tg
-        if 'gobject' in limit:
-            for tg in self.gobjects:
-                if tg.name == name:
-                    return tg
-        if 'kid' in limit:
-            for tg in self.kids:
-                if tg.name == name:
+        for kind, collection in self.find_collections:
+            if kind in limit:
+                for tg in self.named(collection, name):
                     return tg
+        if '/' in name:
+            for tg in self._find_path(name, limit):
+                return tg
+        return None
 
 
     # def tag(self, name):
@@ -255,13 +427,20 @@ class BQResource (BQNode):
     #         return results
 
     def get_value(self):
-        if len(self.values)==0:
+        if self._pending is not None:
+            self._pending.expand(self)
+        values = self._values
+        if not values:
             return None
-        if len(self.values)==1:
-            return self.values[0].value
-        return [ x.value for x in self.values ]
+        if len(values)==1:
+            return values[0].value
+        return [ x.value for x in values ]
 
     def set_value(self, values):
+        if values is None:
+            # No value: do not allocate a BQValue(None) for every tag
+            self._values = None
+            return
         if not isinstance(values, list):
             values = [ values ]
         self.values = [ BQValue(*v) if isinstance(v, tuple) else BQValue(v) for v in values ]
@@ -271,7 +450,7 @@ class BQResource (BQNode):
 
     def toetree(self, parent, baseuri):
         xmlkids = list(self.xmlkids)
-        if len(self.values)<=1:
+        if len(self.iterkids('values'))<=1:
             n = create_element(self, parent, baseuri)
         else:
             n = create_element(self, parent, baseuri)
@@ -279,10 +458,22 @@ class BQResource (BQNode):
                 del n.attrib['value']
             xmlkids.append('values')
         for kid_name in xmlkids:
-            for x in getattr(self, kid_name, None):
+            for x in self.iterkids(kid_name):
                 toxmlnode (x, n, baseuri)
         return n
 
+    def xmlparts(self, baseuri):
+        xmlkids = self.xmlkids
+        attrs = model_fields(self, baseuri)
+        if len(self.iterkids('values'))>1:
+            attrs.pop('value', None)
+            xmlkids = xmlkids + ['values']
+        return self.xmltag, attrs, None, [ x for kid_name in xmlkids for x in self.xmlitems(kid_name) ]
+
+    def xmlitems(self, kid_name):
+        "children written by iter_xml: BQ objects or already serialized xml strings"
+        return self.iterkids(kid_name)
+
 
 ################################################################################
 # Image
@@ -303,7 +494,7 @@ class BQImage(BQResource):
     def meta(self):
         'return image meta as xml'
         if self._meta is None:
-            info = self.pixels().meta().fetch()
+            info = image_meta_cache.fetch(self)
             self._meta = etree.XML(info)
             self._info = xml2nv(self._meta)
         return self._meta
@@ -329,6 +520,10 @@ class BQImage(BQResource):
     def pixels(self):
         return BQImagePixels(self)
 
+    def tiles(self, tile=1024, **kw):
+        'iterate over the image in (region, ndarray) tiles, see BQImagePixels.tiles'
+        return self.pixels().tiles(tile, **kw)
+
 
 
 class BQImagePixels(object):
@@ -388,7 +583,29 @@ class BQImagePixels(object):
     def info(self):
         return self.command('info')
 
-    def asarray(self):
+    def _sliced(self, x='', y='', z='', t=''):
+        "a copy of these pixels with the slice operation replaced (or prepended)"
+        pixels = BQImagePixels(self.image)
+        arguments = '%s,%s,%s,%s' % (x,y,z,t)
+        pixels.ops = [ ('slice', arguments) if tp[0] == 'slice' else tp for tp in self.ops ]
+        if ('slice', arguments) not in pixels.ops:
+            pixels.ops.insert(0, ('slice', arguments))
+        return pixels
+
+    def _slice_args(self):
+        "x,y,z,t arguments of the current slice operation"
+        args = [ tp[1] for tp in self.ops if tp[0] == 'slice' ]
+        return (args[-1].split(',') + ['']*4)[:4] if args else ['']*4
+
+    def asarray(self, tile=None, workers=4, out=None):
+        """Fetch the pixels as a numpy array (requires tifffile)
+
+        @param tile: fetch the x,y plane in tiles of tile x tile pixels with
+        concurrent requests, by default the array is fetched in a single request
+        @param workers: number of concurrent tile requests
+        @param out: array filled with the tiles, an ndarray, 'memmap' or a
+        filename for a np.memmap (default: a new ndarray)
+        """
         try:
             import tifffile
         except ImportError:
@@ -397,12 +614,102 @@ class BQImagePixels(object):
         # Force format to be tiff by removing any format and append format tiff
         self.ops = [ tp for tp in self.ops if tp[0] != 'format' ]
         self.format ('tiff')
+        if tile is not None:
+            return self._tiled_array(tifffile, tile, workers, out)
         url = self._construct_url()
         image_service = self.image.session.service ('image_service')
         with  image_service.fetch (url, stream=True) as response:
             #response.raw.decode_content = True
             return tifffile.imread (io.BytesIO (response.content))
 
+    def _tiled_array(self, tifffile, tile, workers, out):
+        "fetch the x,y plane (or the sliced x,y range) of the image in concurrent tile requests"
+        x, y, z, t = self._slice_args()
+        width, height, _, _, channels = self.image.geometry()
+        x0, x1 = _span(x, width)
+        y0, y1 = _span(y, height)
+        regions = [ (ya, min(ya+tile, y1), xa, min(xa+tile, x1))
+                    for ya in range(y0, y1, tile) for xa in range(x0, x1, tile) ]
+        # the first tile is a full one: the layout and type of the array are the ones it has,
+        # without tiles (an empty range) they are the ones of the first pixel
+        first = regions[0] if regions else (0, 1, 0, 1)
+        ya, yb, xa, xb = first
+        data = self._fetch_region(tifffile, first, z, t)
+        after = yx_layout(data.shape, yb-ya, xb-xa, channels)
+        shape = list(data.shape)
+        shape[data.ndim-after-2:data.ndim-after] = [ max(y1-y0, 0), max(x1-x0, 0) ]
+        result = create_output(out, shape, data.dtype)
+        if not regions:
+            return result
+
+        def store(region, data):
+            ya, yb, xa, xb = region
+            axis = data.ndim - after - 2
+            if data.ndim != len(shape) or data.shape[axis:axis+2] != (yb-ya, xb-xa):
+                raise BQApiError("tile shape %s does not hold a %dx%d plane" % (data.shape, yb-ya, xb-xa))
+            index = [ slice(None) ] * data.ndim
+            index[axis:axis+2] = [ slice(ya-y0, yb-y0), slice(xa-x0, xb-x0) ]
+            result[tuple(index)] = data
+
+        def fetch_tile(region):
+            store(region, self._fetch_region(tifffile, region, z, t))
+
+        store(regions[0], data)
+        data = None
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(fetch_tile, regions[1:]):
+                pass
+        return result
+
+    def _fetch_region(self, tifffile, region, z='', t='', scale=1, size=None, interpolation=''):
+        """fetch and decode the y,x region (0 based [start, stop) of the image
+        downscaled by scale)
+        """
+        ya, yb, xa, xb = region
+        if scale == 1:
+            pixels = self._sliced('%d-%d' % (xa+1, xb), '%d-%d' % (ya+1, yb), z, t)
+        else:
+            width, height = size
+            pixels = self._sliced('%d-%d' % (xa*scale+1, min(xb*scale, width)),
+                                  '%d-%d' % (ya*scale+1, min(yb*scale, height)), z, t)
+            pixels.ops = [ tp for tp in pixels.ops if tp[0] != 'format' ]
+            pixels.resize(xb-xa, yb-ya, interpolation).format('tiff')
+        return tifffile.imread(io.BytesIO(pixels.fetch()))
+
+    def tiles(self, tile=1024, overlap=0, level=0, prefetch=4, interpolation='BL'):
+        """Iterate over the x,y plane (or the sliced x,y range) of the image in tiles (requires tifffile)
+
+        Tiles are fetched in concurrent requests ahead of the consumer, at most
+        prefetch tiles are held in memory.
+
+        @param tile: tile size in pixels of the pyramid level
+        @param overlap: halo added on each side of the tiles, clipped at the image border
+        @param level: pyramid level, the image downscaled by 2**level (with resize)
+        @param prefetch: number of tiles fetched ahead of the consumer
+        @param interpolation: resize interpolation of levels above 0
+        @return: a generator of (region, ndarray) where region is the (y, x)
+        tuple of slices of the tile, halo included, in the level image
+        """
+        try:
+            import tifffile
+        except ImportError:
+            log.error ("Please install Tifffile (Optional)")
+            return
+        self.ops = [ tp for tp in self.ops if tp[0] != 'format' ]
+        self.format ('tiff')
+        x, y, z, t = self._slice_args()
+        size = self.image.geometry()[:2]
+        scale = 2 ** level
+        (x0, x1), (y0, y1) = [ (start // scale, -(-stop // scale)) for start, stop in (_span(x, size[0]), _span(y, size[1])) ]
+        regions = [ (max(ya-overlap, y0), min(ya+tile+overlap, y1), max(xa-overlap, x0), min(xa+tile+overlap, x1))
+                    for ya in range(y0, y1, tile) for xa in range(x0, x1, tile) ]
+
+        def fetch_tile(region):
+            ya, yb, xa, xb = region
+            return (slice(ya, yb), slice(xa, xb)), self._fetch_region(tifffile, region, z, t, scale, size, interpolation)
+        for tile in ordered_map(fetch_tile, regions, workers=prefetch, ahead=prefetch):
+            yield tile
+
     def savearray (self, fname, imdata=None, imshape=None, dtype=None, **kwargs):
         try:
             import tifffile
@@ -419,12 +726,20 @@ class BQImagePixels(object):
 
 
 
+def _span(arg, size):
+    "0 based [start, stop) of a 1 based image service range 'a-b' (all when empty)"
+    if not arg:
+        return 0, size
+    start, _, stop = arg.partition('-')
+    return int(start) - 1, int(stop or start)
+
 ################################################################################
 # Tag
 ################################################################################
 
 class BQTag (BQResource):
     '''tag resource'''
+    __slots__ = ()
     xmltag = "tag"
     xmlfields = ['name',  'value', 'type', 'uri', 'ts']
     xmlkids = ['tags', 'gobjects', ] # handle values  specially
@@ -432,6 +747,7 @@ class BQTag (BQResource):
     def set_parent(self, parent):
         self.parent = parent
         parent.tags.append(self)
+        parent._index_child('tags', self)
 
 #     def get_value(self):
 #         if len(self.values)==0:
@@ -469,6 +785,7 @@ class BQTag (BQResource):
 
 class BQVertex (BQNode):
     '''gobject vertex'''
+    __slots__ = ('x', 'y', 'z', 't', 'c', 'index', 'parent', 'session')
     type = 'vertex'
     xmltag = "vertex"
     xmlfields = ['x', 'y', 'z', 't', 'c', 'index']
@@ -495,28 +812,146 @@ class BQVertex (BQNode):
             if k in self.xmlfields:
                 setattr(self,k,v)
 
+VERTEX_ARRAY_ATTRIBUTES = ('x', 'y', 'z', 't', 'index')
+
 class BQGObject(BQResource):
-    '''Gobject resource: A grpahical annotation'''
+    '''Gobject resource: A grpahical annotation
+
+    Vertices are either a list of BQVertex or, when parsed with
+    BQFactory(vertex_array=True) or set with verticesFromArray, an
+    N x 4 float array of x,y,z,t (missing coordinates are NaN).
+    The BQVertex list is only built from the array when accessed.
+    Parsed arrays keep the coordinate text of the document, which is written
+    back unchanged; vertices with other attributes (c) or indices out of
+    order are parsed as BQVertex.
+    '''
     type = 'gobject'
     xmltag = "gobject"
     xmlfields = ['name', 'value', 'type', 'uri']
     xmlkids = ['tags', 'gobjects', 'vertices']
 
     def __init__(self, *args, **kw):
+        self._vertices = None
+        self._coords = None
+        self._coord_text = None
         super(BQGObject, self).__init__(*args, **kw)
         self.name = None
-        self.vertices = []
         self.type= self.type or self.xmltag
 
     def __str__(self):
-        return '(type: %s, name: %s, %s)'%(self.type, self.name, self.vertices)
+        return '(type: %s, name: %s, %s)'%(self.type, self.name, list(self.iterkids('vertices')))
+
+    def get_vertices(self):
+        if self._pending is not None:
+            self._pending.expand(self)
+        if self._vertices is None:
+            self._vertices = self._array_vertices()
+            # the list may now be modified: it becomes the only vertex store
+            self._coords = self._coord_text = None
+        return self._vertices
+
+    def set_vertices(self, vertices):
+        self._vertices = vertices
+        self._coords = self._coord_text = None
+
+    vertices = property(get_vertices, set_vertices)
+
+    def iterkids(self, kid_name):
+        if kid_name == 'vertices' and self._coords is not None:
+            return self._array_vertices()
+        return super(BQGObject, self).iterkids(kid_name)
+
+    def xmlitems(self, kid_name):
+        if kid_name == 'vertices' and self._coords is not None:
+            # write the vertex array without building BQVertex objects
+            if self._coord_text is not None:
+                rows = self._coord_text
+            else:
+                rows = [ [ None if v != v else v for v in row ] for row in self._coords.tolist() ]
+            return [ '<vertex%s index="%d"/>' % (''.join([ ' %s="%s"' % (c, str(v).translate(_attr_escapes)) for c, v in zip('xyzt', row) if v is not None ]), index)
+                     for index, row in enumerate(rows) ]
+        return self.iterkids(kid_name)
+
+    def _array_vertices(self):
+        "build BQVertex objects for the vertex array"
+        if self._coords is None:
+            return []
+        vertices = []
+        if self._coord_text is not None: # parsed: the same strings as BQVertex parsing
+            rows = [ (row, str(index)) for index, row in enumerate(self._coord_text) ]
+        else:
+            rows = [ ([ None if c != c else c for c in row ], index) for index, row in enumerate(self._coords.tolist()) ] # NaN -> None
+        for (x,y,z,t), index in rows:
+            v = BQVertex(x=x, y=y, z=z, t=t, c=None, index=index)
+            v.parent = self
+            vertices.append(v)
+        return vertices
 
     def set_parent(self, parent):
         self.parent = parent
         parent.gobjects.append(self)
+        parent._index_child('gobjects', self)
+
+    def initializeVertices(self, xmlnode):
+        """Read the vertex children of xmlnode directly into the vertex array
+
+        @return: True if the vertices were read, False if they must be parsed as BQVertex
+        """
+        if np is None:
+            return False
+        vertices = xmlnode.findall('vertex')
+        text = []
+        for position, v in enumerate(vertices):
+            attrib = v.attrib
+            index = attrib.get('index')
+            # the array only stores x,y,z,t in document order
+            if len(v) or (index is not None and index != str(position)) \
+               or any(k not in VERTEX_ARRAY_ATTRIBUTES for k in attrib.keys()):
+                return False
+            text.append([ attrib.get(c) for c in 'xyzt' ])
+        try:
+            coords = np.array([ 'nan' if c is None else c for row in text for c in row ], dtype=float)
+        except ValueError:
+            return False
+        self._coords = coords.reshape(-1, 4)
+        self._coord_text = text
+        self._vertices = None
+        return True
 
     def verticesAsTuples(self):
-        return [v.toTuple() for v in self.vertices ]
+        if self._coords is not None:
+            return [ tuple(None if c != c else c for c in row) for row in self._coords.tolist() ]
+        return [v.toTuple() for v in self.iterkids('vertices') ]
+
+    def _vertexFloats(self):
+        "vertex tuples with numeric coordinates (parsed vertices hold strings)"
+        if np is not None:
+            return [ tuple(row) for row in self.verticesAsArray().tolist() ]
+        return [ tuple(None if c is None else float(c) for c in v) for v in self.verticesAsTuples() ]
+
+    def verticesAsArray(self):
+        """Return the vertices as an N x 4 float array of x,y,z,t
+
+        The array is the vertex store for array backed gobjects, otherwise
+        it is built from the BQVertex list. Missing coordinates are NaN.
+        """
+        if np is None:
+            raise ImportError("numpy is required for vertex arrays")
+        if self._coords is not None:
+            return self._coords
+        vx = self.verticesAsTuples()
+        return np.array(vx, dtype=float).reshape(len(vx), 4)
+
+    def verticesFromArray(self, coords):
+        """Use an N x 2, N x 3 or N x 4 array of x,y[,z[,t]] as vertex store"""
+        if np is None:
+            raise ImportError("numpy is required for vertex arrays")
+        coords = np.asarray(coords, dtype=float)
+        store = np.full((coords.shape[0], 4), np.nan)
+        store[:, :coords.shape[1]] = coords
+        self._coords = store
+        self._coord_text = None
+        self._vertices = None
 
     def perimeter(self):
         return -1
@@ -524,6 +959,21 @@ class BQGObject(BQResource):
     def area(self):
         return -1
 
+    # only does 2D version right now
+    def centroid(self):
+        "return the (x, y) center of the object"
+        xy = self.verticesAsArray()[:, :2]
+        if len(xy) == 0:
+            return None
+        return tuple(xy.mean(axis=0).tolist())
+
+    def bbox(self):
+        "return the (xmin, ymin, xmax, ymax) bounds of the object"
+        xy = self.verticesAsArray()[:, :2]
+        if len(xy) == 0:
+            return None
+        return tuple(xy.min(axis=0).tolist() + xy.max(axis=0).tolist())
+
 
 class BQPoint (BQGObject):
     '''point gobject resource'''
@@ -537,7 +987,10 @@ class BQPolyline (BQGObject):
     '''polyline gobject resource'''
     xmltag = "polyline"
     def perimeter(self):
-        vx = self.verticesAsTuples()
+        if np is not None:
+            xy = self.verticesAsArray()[:, :2]
+            return float(np.hypot(*np.diff(xy, axis=0).T).sum())
+        vx = self._vertexFloats()
         d = 0
         for i in range(0, len(vx)-1):
             x1,y1,z1,t1 = vx[i]
@@ -553,7 +1006,10 @@ class BQPolygon (BQGObject):
     xmltag = "polygon"
     # only does 2D version right now
     def perimeter(self):
-        vx = self.verticesAsTuples()
+        if np is not None:
+            xy = self.verticesAsArray()[:, :2]
+            return float(np.hypot(*(np.roll(xy, -1, axis=0) - xy).T).sum())
+        vx = self._vertexFloats()
         vx.append(vx[0])
         d = 0
         for i in range(0, len(vx)-1):
@@ -565,7 +1021,9 @@ class BQPolygon (BQGObject):
     # only does 2D version right now
     # area is flawed if the edges are intersecting implement better algorithm based on triangles
     def area(self):
-        vx = self.verticesAsTuples()
+        if np is not None:
+            return math.fabs(self._signed_area(self.verticesAsArray()[:, :2]))
+        vx = self._vertexFloats()
         vx.append(vx[0])
         d = 0
         for i in range(0, len(vx)-1):
@@ -574,28 +1032,55 @@ class BQPolygon (BQGObject):
             d += x1*y2 - y1*x2
         return 0.5 * math.fabs(d)
 
+    @staticmethod
+    def _signed_area(xy):
+        x, y = xy.T
+        return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+    def centroid(self):
+        xy = self.verticesAsArray()[:, :2]
+        a = self._signed_area(xy) if len(xy) else 0.0
+        if a == 0.0:
+            # degenerate polygon: use the vertex mean
+            return BQGObject.centroid(self)
+        x, y = xy.T
+        x2, y2 = np.roll(x, -1), np.roll(y, -1)
+        cross = x*y2 - x2*y
+        return (float(np.dot(x+x2, cross)) / (6.0*a), float(np.dot(y+y2, cross)) / (6.0*a))
+
 class BQCircle (BQGObject):
     '''circle gobject resource'''
     xmltag = "circle"
     def perimeter(self):
-        vx = self.verticesAsTuples()
+        vx = self._vertexFloats()
         x1,y1,z1,t1 = vx[0]
         x2,y2,z2,t2 = vx[1]
         return 2.0 * math.pi * max(math.fabs(x1-x2), math.fabs(y1-y2))
 
     def area(self):
-        vx = self.verticesAsTuples()
+        vx = self._vertexFloats()
         x1,y1,z1,t1 = vx[0]
         x2,y2,z2,t2 = vx[1]
         return math.pi * pow( max(math.fabs(x1-x2), math.fabs(y1-y2)), 2.0)
 
+    def centroid(self):
+        x1,y1,z1,t1 = self._vertexFloats()[0]
+        return (float(x1), float(y1))
+
+    def bbox(self):
+        vx = self._vertexFloats()
+        x1,y1,z1,t1 = vx[0]
+        x2,y2,z2,t2 = vx[1]
+        r = max(math.fabs(x1-x2), math.fabs(y1-y2))
+        return (x1-r, y1-r, x1+r, y1+r)
+
 class BQEllipse (BQGObject):
     '''ellipse gobject resource'''
     xmltag = "ellipse"
     type = 'ellipse'
 
     def perimeter(self):
-        vx = self.verticesAsTuples()
+        vx = self._vertexFloats()
         x1,y1,z1,t1 = vx[0]
         x2,y2,z2,t2 = vx[1]
         x3,y3,z3,t3 = vx[2]
@@ -604,7 +1089,7 @@ class BQEllipse (BQGObject):
         return math.pi * ( 3.0*(a+b) - math.sqrt( 10.0*a*b + 3.0*(a*a + b*b)) )
 
     def area(self):
-        vx = self.verticesAsTuples()
+        vx = self._vertexFloats()
         x1,y1,z1,t1 = vx[0]
         x2,y2,z2,t2 = vx[1]
         x3,y3,z3,t3 = vx[2]
@@ -612,17 +1097,31 @@ class BQEllipse (BQGObject):
         b = max(math.fabs(x1-x3), math.fabs(y1-y3))
         return math.pi * a * b
 
+    def centroid(self):
+        x1,y1,z1,t1 = self._vertexFloats()[0]
+        return (float(x1), float(y1))
+
+    def bbox(self):
+        vx = self._vertexFloats()
+        x1,y1,z1,t1 = vx[0]
+        x2,y2,z2,t2 = vx[1]
+        x3,y3,z3,t3 = vx[2]
+        # half extents of an ellipse with axis vectors (v2-v1) and (v3-v1)
+        w = math.hypot(x2-x1, x3-x1)
+        h = math.hypot(y2-y1, y3-y1)
+        return (x1-w, y1-h, x1+w, y1+h)
+
 class BQRectangle (BQGObject):
     '''rectangle gobject resource'''
     xmltag = "rectangle"
     def perimeter(self):
-        vx = self.verticesAsTuples()
+        vx = self._vertexFloats()
         x1,y1,z1,t1 = vx[0]
         x2,y2,z2,t2 = vx[1]
         return math.fabs(x1-x2)*2.0 + math.fabs(y1-y2)*2.0
 
     def area(self):
-        vx = self.verticesAsTuples()
+        vx = self._vertexFloats()
         x1,y1,z1,t1 = vx[0]
         x2,y2,z2,t2 = vx[1]
         return math.fabs(x1-x2) * math.fabs(y1-y2)
@@ -658,8 +1157,17 @@ class BQFactory (object):
     '''Factory for Bisque resources'''
     resources = dict([ (x[1].xmltag, x[1]) for x in inspect.getmembers(sys.modules[__name__]) if inspect.isclass(x[1]) and hasattr(x[1], 'xmltag') ])
 
-    def __init__(self, session):
+    def __init__(self, session, vertex_array=False, lazy=False):
+        """
+            @param session: the session attached to created resources
+            @param vertex_array: parse gobject vertices into a numpy array
+            instead of BQVertex objects (requires numpy)
+            @param lazy: only build the top resource when parsing, the children
+            of each resource are built from its xml node on first access
+        """
         self.session = session
+        self.vertex_array = vertex_array and np is not None
+        self.lazy = lazy
 
     @classmethod
     def make(cls, xmltag, type_attr):
@@ -676,7 +1184,7 @@ class BQFactory (object):
             objarr =  getattr(parent, array)
             objarr.extend ([ ctor() for x in range(((indx+1)-len(objarr)))])
             v = objarr[indx]
-            v.indx = indx
+            v.index = indx
             #log.debug ('fetching %s %s[%d]:%s' %(parent , array, indx, v))
             return v
 
@@ -686,7 +1194,12 @@ class BQFactory (object):
 
     def from_etree (self, xmlResource, resource=None, parent=None ):
         """ Convert an etree to a python structure"""
-        stack = [];
+        if self.lazy:
+            resource = self._from_node(xmlResource, resource, parent)
+            resource.initialize()
+            resource.xmltree = xmlResource
+            return resource
+        stack = collections.deque()
         resources = [];
         #  Initialize stack with a tuple of
         #    1. The XML node being parsed
@@ -694,7 +1207,7 @@ class BQFactory (object):
         #    3. The parent resource if any
         stack.append ( (xmlResource, resource, parent ) )
         while stack:
-            node, resource, parent = stack.pop(0);
+            node, resource, parent = stack.popleft()
             xmltag = node.tag;
             if resource is None:
                 type_ = node.get( 'type', '')
@@ -706,16 +1219,56 @@ class BQFactory (object):
             if parent:
                 resource.set_parent(parent)
                 #resource.doc = parent.doc;
+            skip = None
+            if self.vertex_array and isinstance(resource, BQGObject) and resource.initializeVertices(node):
+                skip = 'vertex'
             for k in node:
-                stack.append( (k, None, resource) )
+                if k.tag != skip:
+                    stack.append( (k, None, resource) )
 
         resources[0].initialize()
         resources[0].xmltree = xmlResource
         return resources[0];
+
+    def _from_node(self, node, resource=None, parent=None):
+        "build a single resource from node leaving its children to expand()"
+        if resource is None:
+            resource = self.make(node.tag, node.get('type', ''))
+        resource.session = self.session
+        resource.initializeXml(node)
+        if parent:
+            resource.set_parent(parent)
+        if isinstance(resource, BQResource) and len(node):
+            if self.vertex_array and isinstance(resource, BQGObject):
+                resource.initializeVertices(node)
+            resource.xmltree = node
+            resource._pending = self
+        return resource
+
+    def expand(self, resource):
+        "build the children of a lazily parsed resource from its xml node"
+        resource._pending = None
+        skip = None
+        if getattr(resource, '_coords', None) is not None:
+            skip = 'vertex'
+        for k in resource.xmltree:
+            if k.tag != skip:
+                self._from_node(k, None, resource)
+
     def from_string (self, xmlstring):
         et = etree.XML (xmlstring)
         return self.from_etree(et)
 
+    def from_dict(self, d, resource=None, parent=None):
+        """Convert a document dict {tag: {...}} in the xml2d layout to a python structure
+
+        No element tree is built, the xmltree of the resource is a DictElement view of d
+        """
+        return self.from_etree(DictElement.fromdict(d), resource, parent)
+
+    def from_json(self, jsonstring):
+        return self.from_dict(json.loads(jsonstring))
+
     # Generation
 
     @classmethod
@@ -728,9 +1281,14 @@ class BQFactory (object):
     @classmethod
     def to_string (self, node):
         if isinstance (node, BQNode):
-            node = self.to_etree(node)
+            return b''.join(iter_xml(node))
         return etree.tostring(node)
 
+    @classmethod
+    def to_chunks(self, node, baseuri='', chunk_size=XML_CHUNK_SIZE):
+        """Serialize a BQObject incrementally, see L{iter_xml}"""
+        return iter_xml(node, baseuri, chunk_size)
+
     @classmethod
     def string2etree(self, xmlstring):
         return etree.XML (xmlstring)
@@ -755,11 +1313,66 @@ def toxmlnode (dbo, parent, baseuri, view=None):
     else:
         node = create_element (dbo, parent, baseuri)
         for kid_name in dbo.xmlkids:
-            for x in getattr(dbo, kid_name, None):
+            for x in getattr(dbo, kid_name, None) or ():
                 toxmlnode (x, node, baseuri, view)
     return node
 
 
+# escapes of lxml serialization (ascii output, other characters as references)
+_attr_escapes = str.maketrans({ '&':'&amp;', '<':'&lt;', '>':'&gt;', '"':'&quot;', '\n':'&#10;', '\r':'&#13;', '\t':'&#9;' })
+_text_escapes = str.maketrans({ '&':'&amp;', '<':'&lt;', '>':'&gt;', '\r':'&#13;' })
+
+def iter_xml(dbo, baseuri='', chunk_size=XML_CHUNK_SIZE):
+    """Serialize a BQObject to XML incrementally
+
+    The object graph is walked iteratively (no recursion limit) and written
+    without building an element tree.  The output is the same as
+    etree.tostring(BQFactory.to_etree(dbo))
+
+    @param chunk_size: approximate size of the yielded byte strings
+    @return: a generator of byte strings
+    """
+    out = []
+    size = 0
+    stack = [ iter((dbo,)) ]
+    closing = [ None ]
+    while stack:
+        for x in stack[-1]:
+            if x.__class__ is str:
+                # already serialized
+                part = x
+            else:
+                xmltag, attrs, text, kids = x.xmlparts(baseuri)
+                part = '<' + xmltag + ''.join([ ' %s="%s"' % (k, v.translate(_attr_escapes)) for k, v in attrs.items() ])
+                if text is None and not kids:
+                    part += '/>'
+                else:
+                    part += '>'
+                    if text is not None:
+                        part += text.translate(_text_escapes)
+                    if kids:
+                        stack.append(iter(kids))
+                        closing.append('</%s>' % xmltag)
+                        out.append(part)
+                        size += len(part)
+                        break
+                    part += '</%s>' % xmltag
+            out.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield ''.join(out).encode('ascii', 'xmlcharrefreplace')
+                out = []
+                size = 0
+        else:
+            stack.pop()
+            part = closing.pop()
+            if part is not None:
+                out.append(part)
+                size += len(part)
+    if out:
+        yield ''.join(out).encode('ascii', 'xmlcharrefreplace')
+
+
 def make_owner (dbo, fn, baseuri):
     return ('owner', baseuri + str(dbo.owner))
 
@@ -769,7 +1382,26 @@ def make_uri(dbo, fn, baseuri):
 def get_email (dbo, fn, baseuri):
     return ('email', dbo.user.email_address)
 
-mapping_fields = {
+class FieldMapping(dict):
+    "a dict counting its changes (version) so cached field lookups can be resolved again"
+    version = 0
+
+    def _changed(method):
+        def changed(self, *args, **kw):
+            self.version += 1
+            return method(self, *args, **kw)
+        return changed
+
+    __setitem__ = _changed(dict.__setitem__)
+    __delitem__ = _changed(dict.__delitem__)
+    update = _changed(dict.update)
+    pop = _changed(dict.pop)
+    popitem = _changed(dict.popitem)
+    setdefault = _changed(dict.setdefault)
+    clear = _changed(dict.clear)
+    del _changed
+
+mapping_fields = FieldMapping({
     'mex' : None,
     'acl' : None,
     # Auth
@@ -777,29 +1409,41 @@ mapping_fields = {
     'taggable_id': None,
     'permission': 'action',
     'resource': None,
-    }
+    })
 
 def model_fields(dbo, baseuri=None):
     """Extract known fields from a BQ object, while removing any known
     from C{excluded_fields}
 
+    The fields of a class are resolved once (see L{field_getters})
+
     @rtype: dict
     @return fields to be rendered in XML
     """
-    attrs = {}
-    try:
-        dbo_fields = dbo.xmlfields
-    except AttributeError:
+    if not hasattr(dbo, 'xmlfields'):
         # This occurs when the object is a fake DB objects
         # The dictionary is sufficient
-        dbo_fields= dbo.__dict__
+        return extract_fields(dbo, list(dbo.__dict__), baseuri)
+    attrs = {}
+    for fn, mapper in field_getters(dbo.__class__):
+        if mapper is None:
+            attr_val = getattr(dbo, fn, None)
+        else:
+            fn, attr_val = mapper(dbo, mapper, baseuri)
+        if attr_val is not None and attr_val != '':
+            attrs[fn] = attr_val if attr_val.__class__ is str else str(attr_val)
+    return attrs
+
+def extract_fields(dbo, dbo_fields, baseuri=None):
+    "extract the fields named in dbo_fields from dbo (see model_fields)"
+    attrs = {}
     for fn in dbo_fields:
         fn = mapping_fields.get(fn, fn)
         # Skip when map is None
         if fn is None:
             continue
         # Map is callable, then call
-        if isinstance(fn, collections.Callable):
+        if callable(fn):
             fn, attr_val = fn(dbo, fn, baseuri)
         else:
             attr_val = getattr(dbo, fn, None)
@@ -811,3 +1455,25 @@ def model_fields(dbo, baseuri=None):
             else:
                 attrs[fn] = str(attr_val) #unicode(attr_val,'utf-8')
     return attrs
+
+def field_getters(cls):
+    """Return the (field, mapper) pairs of a BQ class read by model_fields
+
+    The xmlfields of the class are resolved through mapping_fields: mapper is
+    None for fields read as attributes, the mapping function otherwise.  The
+    pairs are cached on the class (as _field_getters) and resolved again
+    when the xmlfields of the class or mapping_fields change.
+    """
+    cached = cls.__dict__.get('_field_getters')
+    if cached is not None and cached[0] == mapping_fields.version and cached[1] == cls.xmlfields:
+        return cached[2]
+    getters = []
+    for fn in cls.xmlfields:
+        fn = mapping_fields.get(fn, fn)
+        # Skip when map is None
+        if fn is None:
+            continue
+        getters.append((None, fn) if callable(fn) else (fn, None))
+    getters = tuple(getters)
+    setattr(cls, '_field_getters', (mapping_fields.version, list(cls.xmlfields), getters))
+    return getters
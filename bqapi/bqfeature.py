@@ -1,18 +1,19 @@
 
 #import threading
-from threading import Thread
+from threading import Thread, Condition
+import os
 import socket
-import errno
+import atexit
 import tempfile
 import urllib.request, urllib.parse, urllib.error
-import os
 from math import ceil
 import queue
 import logging
+import time
 import warnings
-from collections import namedtuple
+from collections import namedtuple, OrderedDict, deque
 
-#import numpy as np
+import numpy as np
 
 from .exception import BQCommError
 
@@ -32,6 +33,12 @@ except ImportError:
 #max requests attemps if the connection is drop when making parallel requests
 MAX_ATTEMPTS = 5
 
+# first bytes of hdf5 files
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+# status table of the resources failing when no response of the feature server had one
+FAILED_STATUS_DTYPE = np.dtype([('status', '<i4'), ('error', 'S256'), ('image', 'S2000'), ('mask', 'S2000'), ('gobject', 'S2000')])
+
 FeatureResource = namedtuple('FeatureResource',['image','mask','gobject'])
 FeatureResource.__new__.__defaults__ = (None, None, None)
 
@@ -40,21 +47,115 @@ class FeatureError(Exception):
         Feature Communication Exception
     """
 
+def open_hdf_image(content, mode='r'):
+    """
+        Opens the content of a hdf5 file in memory
+
+        @param: content - the bytes of the hdf5 file
+        @return: pytables file handle
+    """
+    return tables.open_file('feature_%s.h5' % id(content), mode, driver='H5FD_CORE',
+                            driver_core_image=content, driver_core_backing_store=0)
+
+
+def create_hdf(path=None):
+    """
+        Creates the hdf5 feature file
+
+        @param: path - the location of the file, if None the file is a temporary file
+        removed once closed
+        @return: pytables file handle
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix='features_', suffix='.h5')
+        os.close(fd)
+        hdf5 = tables.open_file(path, 'w')
+        try: # the open file stays readable
+            os.remove(path)
+        except OSError: # open files cannot be removed on windows
+            atexit.register(_remove_file, path)
+        return hdf5
+    return tables.open_file(path, 'w')
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def resource_triple(row, names):
+    """
+        @return: the (image, mask, gobject) of a values or status table row
+    """
+    triple = []
+    for field in ('image', 'mask', 'gobject'):
+        value = row[field] if field in names else ''
+        triple.append(value.decode('utf-8') if isinstance(value, bytes) else value)
+    return tuple(triple)
+
+
+def failed_status(dtype, failed):
+    """
+        @param: dtype - the dtype of the status table
+        @param: failed - [(resource, (status, message))]
+        @return: the status table rows of failed
+    """
+    rows = np.zeros(len(failed), dtype=dtype)
+    names = rows.dtype.names
+    for row, (resource, (status, message)) in zip(rows, failed):
+        if 'status' in names:
+            row['status'] = status
+        if 'error' in names:
+            row['error'] = message.encode('utf-8')
+        for field, uri in zip(('image', 'mask', 'gobject'), resource):
+            if field in names and uri:
+                row[field] = uri.encode('utf-8')
+    return rows
+
+
+def response_rows(content, resources):
+    """
+        Reads the rows of a feature response by position: the status table has
+        a row per requested resource and the values table a row per resource
+        without error, both in the order of the request
+
+        @param: content - the hdf5 response
+        @param: resources - the requested resources
+        @return: (values dtype, status dtype, [(values row or None, status row)] in the order
+        of resources), the dtypes are None and the status rows (status, message) when the
+        response does not hold a row per resource
+    """
+    with open_hdf_image(content) as hdf5:
+        status = hdf5.root.status[:]
+        values = hdf5.root.values[:] if 'values' in hdf5.root else None
+    ok = status['status'] < 400
+    if len(status) != len(resources) or ok.sum() != (0 if values is None else len(values)):
+        log.warning('Feature response of %s status and %s values rows for %s resources',
+                    len(status), 0 if values is None else len(values), len(resources))
+        return None, None, [ (None, (500, 'feature response does not match the request')) ] * len(resources)
+    rows = []
+    computed = iter([] if values is None else values)
+    for row, good in zip(status, ok):
+        rows.append((next(computed) if good else None, row))
+    return None if values is None else values.dtype, status.dtype, rows
+
+
 class Feature(object):
 
-    def fetch(self, session, name, resource_list, path=None):
+    def request(self, session, name, resource_list, path=None):
         """
-            Requests the feature server to calculate features on provided resources.
+            Posts the feature request of resource_list to the feature server
 
             @param: session - the local session
             @param: name - the name of the feature one wishes to extract
             @param: resource_list - list of the resources to extract. format:
             [(image_url, mask_url, gobject_url),...] if a parameter is
             not required just provided None
-            @param: path - the location were the hdf5 file is stored. If None is set the file will be placed in a tempfile and the pytables
-            file handle will be returned. (default: None)
+            @param: path - the location were the hdf5 file is stored (default: None)
 
-            @return: returns either a pytables file handle or the file name when the path is provided
+            @return: the hdf5 response as bytes or the file name when the path is provided
         """
         url = '%s/features/%s/hdf'%(session.bisque_root,name)
 
@@ -69,18 +170,105 @@ class Feature(object):
             sub.attrib['uri'] = '%s?%s'%(url,query)
 
         log.debug('Fetch Feature %s for %s resources'%(name, len(resource_list)))
+        return session.c.push(url, content=etree.tostring(resource), headers={'Content-Type':'text/xml', 'Accept':'application/x-bag'}, path=path)
+
+    def fetch(self, session, name, resource_list, path=None, ts=None):
+        """
+            Requests the feature server to calculate features on provided resources.
+            When the session has a feature_cache the features found in it are not
+            requested again.
+
+            @param: session - the local session
+            @param: name - the name of the feature one wishes to extract
+            @param: resource_list - list of the resources to extract. format:
+            [(image_url, mask_url, gobject_url),...] if a parameter is
+            not required just provided None
+            @param: path - the location were the hdf5 file is stored. If None is set the file is kept in memory or in a temporary file and the pytables
+            file handle will be returned. (default: None)
+            @param: ts - the ts of the resources or a list of ts for each resource, features of resources
+            with a ts are kept in the disk cache (default: None)
 
+            @return: returns either a pytables file handle or the file name when the path is provided
+        """
+        cache = getattr(session, 'feature_cache', None)
+        if cache is None:
+            return self._fetch(session, name, resource_list, path)
+        return self._fetch_cached(cache, session, name, resource_list, path, ts)
+
+    def _fetch(self, session, name, resource_list, path=None):
+        """
+            Requests the features of resource_list to the feature server (see fetch)
+        """
         if path is None:
-            f = tempfile.NamedTemporaryFile(suffix='.h5', dir=tempfile.gettempdir(), delete=False)
-            f.close()
-            session.c.push(url, content=etree.tostring(resource), headers={'Content-Type':'text/xml', 'Accept':'application/x-bag'}, path=f.name)
-            return tables.open_file(f.name,'r')
+            return open_hdf_image(self.request(session, name, resource_list))
         log.debug('Returning feature response to %s' % path)
-        return session.c.push(url, content=etree.tostring(resource), headers={'Content-Type':'text/xml', 'Accept':'application/x-bag'}, path=path)
+        return self.request(session, name, resource_list, path=path)
+
+
+
+    def _fetch_cached(self, cache, session, name, resource_list, path, ts):
+        """
+            Serves the features of resource_list found in cache, requests the others
+            and writes the values and status rows in the order of resource_list
+        """
+        if len(resource_list) < 1:
+            log.warning('Warning no resources were provided')
+            return
+        version = cache.version(name, lambda: self.length(session, name))
+        if not isinstance(ts, (list, tuple)):
+            ts = [ts] * len(resource_list)
+        keys = [ cache.key(name, version, r, t) for r, t in zip(resource_list, ts) ]
+        found = cache.get_many(keys)
+
+        misses = OrderedDict()
+        for resource, key in zip(resource_list, keys):
+            if key not in found and key not in misses:
+                misses[key] = resource
+        log.debug('Feature %s: %s of %s resources served from the cache', name, len(resource_list)-len(misses), len(resource_list))
+
+        values_dtype = status_dtype = None
+        fetched = {}
+        if misses:
+            values_dtype, status_dtype, rows = self._fetch_rows(session, name, list(misses.values()))
+            fetched = dict(zip(misses, rows))
+            cache.put_many([ (key, rows) for key, rows in fetched.items() if rows[0] is not None ])
+        for v, s in found.values():
+            if values_dtype is None:
+                values_dtype = v.dtype
+            if status_dtype is None:
+                status_dtype = s.dtype
+            break
+        if status_dtype is None: # every request failed without response
+            status_dtype = FAILED_STATUS_DTYPE
+
+        values_rows = []
+        status = np.zeros(len(keys), dtype=status_dtype)
+        for i, (key, resource) in enumerate(zip(keys, resource_list)):
+            v, s = found.get(key) or fetched[key]
+            if v is not None:
+                values_rows.append(tuple(v))
+            if isinstance(s, tuple): # (status, message) of a resource without response
+                s = failed_status(status_dtype, [ (resource, s) ])[0]
+            status[i] = tuple(s)
+
+        hdf5 = create_hdf(path)
+        if values_dtype is not None: # none of the resources has features otherwise
+            hdf5.create_table('/', 'values', obj=np.array(values_rows, dtype=values_dtype))
+        hdf5.create_table('/', 'status', obj=status)
+        if path is None:
+            return hdf5
+        hdf5.close()
+        return path
 
+    def _fetch_rows(self, session, name, resource_list):
+        """
+            Requests the features of resource_list to the feature server
 
+            @return: (values dtype, status dtype, [(values row or None, status row)]) see response_rows
+        """
+        return response_rows(self.request(session, name, resource_list), resource_list)
 
-    def fetch_vector(self, session, name, resource_list):
+    def fetch_vector(self, session, name, resource_list, ts=None):
         """
             Requests the feature server to calculate features on provided resources. Designed more for
             requests of very view features.
@@ -90,6 +278,7 @@ class Feature(object):
             @param: resource_list - list of the resources to extract. format:
             [(image_url, mask_url, gobject_url),...] if a parameter is
             not required just provided None
+            @param: ts - the ts of the resources (see fetch)
 
             @return: a list of features as numpy array
 
@@ -98,19 +287,16 @@ class Feature(object):
             note: You can use fetch and read from the status table for the error.
             warning: fetch_vector will not return response if an error occurs within the request
         """
-        hdf5 = self.fetch(session, name, resource_list)
+        hdf5 = self.fetch(session, name, resource_list, ts=ts)
         status = hdf5.root.status
-        index = status.getWhereList('status>=400')
+        index = status.get_where_list('status>=400')
         if index.size>0: #returns the first error that occurs
             status = status[index[0]][0]
             hdf5.close()
-            os.remove(hdf5.filename) #remove file from temp directory
             raise FeatureError('%s:Error occured during feature calculations' % status)
         table = hdf5.root.values
-        status_table = hdf5.root.status
         feature_vector = table[:]['feature']
         hdf5.close()
-        os.remove(hdf5.filename) #remove file from temp directory
         return feature_vector
 
     @staticmethod
@@ -126,11 +312,270 @@ class Feature(object):
         xml = session.fetchxml('/features/%s'%name)
         return int(xml.find('feature/tag[@name="feature_length"]').attrib.get('value'))
 
+class WriteHDF5Thread(Thread):
+    """
+        Appends the hdf5 feature tables of the chunk responses
+        into one open hdf5 feature file
+    """
+
+    def __init__(self, hdf5, chunk_queue):
+        """
+            @param: hdf5 - the open pytables output file
+            @param: chunk_queue - a queue of (group, resources, hdf5 response, error) of the chunks, None ends the thread.
+            The tables are written in the group (a path of hdf5). The status of the resources of chunks
+            without response are written from error (status, message)
+        """
+        self.hdf5 = hdf5
+        self.chunk_queue = chunk_queue
+        self.failed = OrderedDict()
+        self.error = None
+        super(WriteHDF5Thread, self).__init__()
+
+    def run(self):
+        try:
+            while True:
+                item = self.chunk_queue.get()
+                if item is None:
+                    self.write_failures()
+                    log.debug('Ending HDF5 write thread')
+                    break
+                self.write_chunk(*item)
+        except Exception as e:
+            log.exception('Could not write the hdf5 feature file')
+            self.error = e
+
+    def put(self, item):
+        """
+            Queues item for the writer, waits while the queue is full
+
+            @return: False when the writer stopped
+        """
+        while self.is_alive():
+            try:
+                self.chunk_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def write_chunk(self, group, resources, content, error):
+        """
+            Appends the tables of a chunk response to group, or records
+            the resources as failed with error when there is no response
+        """
+        if content is None:
+            self.failed.setdefault(group, []).extend((resource, error) for resource in resources)
+            return
+        hdf5 = self.hdf5
+        try:
+            node = hdf5.get_node(group)
+            with open_hdf_image(content) as hdf5temp:
+                # responses where every resource failed may have no values table
+                for table in ('values', 'status'):
+                    if table not in hdf5temp.root:
+                        continue
+                    temp_table = hdf5temp.get_node('/', table)
+                    if table not in node:
+                        temp_table.copy(node, table)
+                    else:
+                        hdf5.get_node(node, table).append(temp_table[:])
+            hdf5.flush()
+        except Exception:
+            log.exception('Could not read hdf5 response')
+
+    def write_failures(self):
+        """
+            Appends the status of the failed resources to the status table
+        """
+        for group, failed in self.failed.items():
+            self.write_status(group, failed)
+        self.hdf5.flush()
+
+    def write_status(self, group, failed):
+        """
+            Appends the status of failed [(resource, (status, message))] to the status table of group
+        """
+        node = self.hdf5.get_node(group)
+        if 'status' in node:
+            status_table = node.status
+        else:
+            status_table = self.hdf5.create_table(node, 'status', FAILED_STATUS_DTYPE)
+        status_table.append(failed_status(status_table.dtype, failed))
+        log.debug('%s resources failed in %s', len(failed), group)
+
+
+class RequestPlan(object):
+    """
+        Hands out the chunks of a resource list to the request threads and,
+        when adaptive, resizes the plan from the measured latency of the chunks
+        (additive increase, multiplicative decrease): the number of concurrent
+        requests grows while the latency per resource stays near the best
+        measured and is halved when it doubles or a request fails, the chunk
+        size grows while requests are faster than target_latency and is halved
+        when they are twice as slow.
+    """
+
+    def __init__(self, resource_list, thread_num, chunk_size, max_threads=None,
+                 min_chunk=1, max_chunk=None, adaptive=True, target_latency=30.0, key=None, window=None):
+        """
+            @param: resource_list - the list of resources
+            @param: key - chunks only hold consecutive resources with the same key(resource) (default: None)
+            @param: thread_num - the initial amount of concurrent requests
+            @param: chunk_size - the initial amount of resources for request
+            @param: max_threads, min_chunk, max_chunk - the limits of the plan
+            @param: adaptive - resize the plan during the run (default: True)
+            @param: target_latency - seconds a request should take (default: 30)
+            @param: window - chunks are only handed out up to window resources past the
+            index released by the consumer (see release), None for no limit (default: None)
+        """
+        self.resource_list = resource_list
+        self.thread_num = int(thread_num)
+        self.chunk_size = int(chunk_size)
+        self.max_threads = int(max_threads or thread_num)
+        self.min_chunk = int(min_chunk)
+        self.max_chunk = int(max_chunk or chunk_size)
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.key = key
+        self.window = window
+        self.released = 0
+        self.position = 0
+        self.retries = deque()
+        self.cancelled = False
+        self.active = 0
+        self.completed = 0
+        self.since_decrease = 0
+        self.best_latency = None
+        self.start = time.time()
+        self.condition = Condition()
+        log.info('Request plan: %s concurrent requests of %s resources (adaptive: %s)',
+                 self.thread_num, self.chunk_size, self.adaptive)
+
+    def next_chunk(self):
+        """
+            Waits for a free request slot
+
+            @return: the next chunk of resources or None when all were handed out
+        """
+        indexed = self.next_indexed_chunk()
+        return indexed and indexed[1]
+
+    def next_indexed_chunk(self):
+        """
+            Waits for a free request slot
+
+            @return: (index of the first resource, chunk) or None when all were handed out
+        """
+        with self.condition:
+            while True:
+                if self.cancelled:
+                    return None
+                pending = self.retries or self.position < len(self.resource_list)
+                if not pending and self.active == 0:
+                    return None
+                ready = self.retries or (pending and (self.window is None or self.position < self.released + self.window))
+                if ready and self.active < self.thread_num:
+                    break
+                self.condition.wait() # for a slot or the chunks retried by the active requests
+            if self.retries:
+                start, chunk = self.retries.popleft()
+            else:
+                start = self.position
+                chunk = self.resource_list[start:start+self.chunk_size]
+                if self.key is not None:
+                    key = self.key(chunk[0])
+                    chunk = chunk[:next((i for i, r in enumerate(chunk) if self.key(r) != key), len(chunk))]
+                self.position += len(chunk)
+            self.active += 1
+            return start, chunk
+
+    def retry(self, start, chunk):
+        """
+            Hands out chunk again before the remaining resources, must be called
+            before done of the failed request
+
+            @param: start - the index of the first resource of chunk
+            @param: chunk - the resources to request again
+        """
+        with self.condition:
+            self.retries.append((start, chunk))
+            # counted by done of the failed request and again when requested
+            self.completed -= len(chunk)
+            self.condition.notify_all()
+
+    def release(self, index):
+        """
+            Records that the consumer is done with the resources before index,
+            the chunks of the next window resources can be handed out
+
+            @param: index - the index of the first resource not consumed
+        """
+        with self.condition:
+            self.released = index
+            self.condition.notify_all()
+
+    def cancel(self):
+        """
+            Stops handing out chunks
+        """
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+    def done(self, size, seconds, failed=False):
+        """
+            Records a finished request and adjusts the plan
+
+            @param: size - the amount of resources of the request, the resources handed
+            out again with retry are only counted as completed by their last request
+            @param: seconds - the latency of the request
+            @param: failed - the request did not return features
+        """
+        with self.condition:
+            self.active -= 1
+            self.completed += size
+            self.since_decrease += 1
+            if self.adaptive:
+                self._adjust(size, seconds, failed)
+            self.condition.notify_all()
+
+    def _adjust(self, size, seconds, failed):
+        thread_num, chunk_size = self.thread_num, self.chunk_size
+        latency = seconds / max(size, 1)
+        if not failed and (self.best_latency is None or latency < self.best_latency):
+            self.best_latency = latency
+
+        # decrease at most once per round of concurrent requests
+        if failed or latency > 2*self.best_latency:
+            if self.since_decrease >= self.thread_num:
+                self.thread_num = max(1, self.thread_num//2)
+                self.since_decrease = 0
+        elif latency <= 1.25*self.best_latency:
+            self.thread_num = min(self.max_threads, self.thread_num+1)
+
+        if not failed:
+            if seconds > 2*self.target_latency:
+                self.chunk_size = max(self.min_chunk, self.chunk_size//2)
+            elif seconds < self.target_latency:
+                self.chunk_size = min(self.max_chunk, self.chunk_size+self.min_chunk)
+
+        if (thread_num, chunk_size) != (self.thread_num, self.chunk_size):
+            log.debug('Request plan: %s concurrent requests of %s resources (%.3fs per resource)',
+                      self.thread_num, self.chunk_size, latency)
+
+    def throughput(self):
+        """
+            @return: resources per second since the start of the plan
+        """
+        return self.completed / max(time.time() - self.start, 1e-9)
+
+
 class ParallelFeature(Feature):
 
     MaxThread = 8
     MaxChunk = 2000
     MinChunk = 25
+    TargetLatency = 30.0 #seconds a request should take when the plan is adaptive
 
     def __init__(self):
         super(ParallelFeature, self).__init__()
@@ -143,7 +588,7 @@ class ParallelFeature(Feature):
         def __init__(self, request_queue, errorcb=None):
             """
                 @param: requests_queue - a queue of requests functions
-                @param: errorcb - a call back that is called if a BQCommError is raised
+                @param: errorcb - a call back that is called if a BQCommError is raised, other exceptions are logged
             """
             self.request_queue = request_queue
 
@@ -165,14 +610,16 @@ class ParallelFeature(Feature):
 
         def run(self):
             while True:
-                if not self.request_queue.empty():
-                    request = self.request_queue.get()
-                    try:
-                        request()
-                    except BQCommError as e:
-                        self.errorcb(e)
-                else:
+                try:
+                    request = self.request_queue.get_nowait()
+                except queue.Empty:
                     break
+                try:
+                    request()
+                except BQCommError as e:
+                    self.errorcb(e)
+                except Exception:
+                    log.exception('Request failed')
 
 
     def request_thread_pool(self, request_queue, errorcb=None, thread_count = MaxThread):
@@ -216,6 +663,32 @@ class ParallelFeature(Feature):
         self.chunk_size = n
 
 
+    def request_plan(self, resource_list, key=None, window=None):
+        """
+            The plan of the requests, fixed when the thread num and chunk size
+            were set otherwise starting from calculate_request_plan and adapted
+            to the latency of the feature server
+
+            @param: resource_list - the list of resources
+            @param: key, window - see RequestPlan, a window of True is two rounds of the largest requests
+
+            @return: RequestPlan
+        """
+        if hasattr(self,'thread_num') and hasattr(self,'chunk_size'):
+            thread_num = max(ceil(self.thread_num), 1)
+            chunk_size = max(ceil(self.chunk_size), 1)
+            plan = RequestPlan(resource_list, thread_num, chunk_size, adaptive=False, key=key)
+        else:
+            thread_num, chunk_size = self.calculate_request_plan(resource_list)
+            plan = RequestPlan(resource_list, thread_num, chunk_size, max_threads=self.MaxThread,
+                               min_chunk=min(self.MinChunk, chunk_size), max_chunk=max(self.MaxChunk, chunk_size),
+                               target_latency=self.TargetLatency, key=key)
+        if window is True:
+            window = 2*plan.max_threads*plan.max_chunk
+        plan.window = window
+        return plan
+
+
     def calculate_request_plan(self, l):
         """
             Tries to figure out the best configuration
@@ -247,7 +720,7 @@ class ParallelFeature(Feature):
             yield l[i:i+chunk_size]
 
 
-    def fetch(self, session, name, resource_list, path=None):
+    def _fetch(self, session, name, resource_list, path=None):
         """
             Requests the feature server to calculate provided resources.
             The request will be boken up according to the chunk size
@@ -257,7 +730,7 @@ class ParallelFeature(Feature):
             @param: name - the name of the feature one wishes to extract
             @param: resource_list - list of the resources to extract. format: [(image_url, mask_url, gobject_url),...] if a parameter is
             not required just provided None
-            @param: path - the location were the hdf5 file is stored. If None is set the file will be placed in a tempfile and the pytables
+            @param: path - the location were the hdf5 file is stored. If None is set the file is a temporary file and the pytables
             file handle will be returned. (default: None)
 
             @return: returns either a pytables file handle or the file name when the path is provided
@@ -268,129 +741,302 @@ class ParallelFeature(Feature):
 
         log.debug('Exctracting %s on %s resources'%(name,len(resource_list)))
 
-        if path is None:
-            f = tempfile.TemporaryFile(suffix='.h5', dir=tempfile.gettempdir())
-            f.close()
-            table_path = f.name
-        else:
-            table_path = path
+        plan = self.request_plan(resource_list)
 
-        stop_write_thread = False #sets a flag to stop the write thread
-        # when the requests threads have finished
+        # chunks responses are passed in memory, the request threads wait when the writer is behind
+        write_queue = queue.Queue(maxsize=2*plan.max_threads)
+        hdf5 = create_hdf(path)
+        w = WriteHDF5Thread(hdf5, write_queue)
 
-        class WriteHDF5Thread(Thread):
-            """
-                Copies small hdf5 feature tables
-                into one large hdf5 feature table
-            """
+        def deliver(start, chunk, content, error):
+            if not w.put(('/', chunk, content, error)):
+                plan.cancel() # the writer failed
 
-            def __init__(self, h5_filename_queue):
-                """
-                    param h5_filename_queue: a queue of temporary hdf5 files
-                """
-                self.h5_filename_queue = h5_filename_queue
-                tables.open_file(table_path, 'w').close() #creates a new file
-                super(WriteHDF5Thread, self).__init__()
-
-            def run(self):
-                """
-                    While queue is not empty and stop_write_thread
-                    has not been set to true, the thread will open
-                    temporary hdf5 tables and copy them into the
-                    main hdf5 table and then delete the temporary file.
-                """
-                while True:
-                    if not self.h5_filename_queue.empty():
-                        temp_path = self.h5_filename_queue.get()
-                        log.debug('Writing %s to %s' % (temp_path, table_path))
-                        try:
-                            with tables.open_file(temp_path, 'a') as hdf5temp:
-                                with tables.open_file(table_path, 'a') as hdf5:
-                                    temp_table = hdf5temp.root.values
-                                    temp_status_table = hdf5temp.root.status
-                                    if not hasattr(hdf5.root, 'values'):
-                                        temp_table.copy(hdf5.root,'values')
-                                        temp_status_table.copy(hdf5.root,'status')
-                                    else:
-                                        table = hdf5.root.values
-                                        status_table = hdf5.root.status
-                                        table.append(temp_table[:])
-                                        status_table.append(temp_status_table[:])
-                                        table.flush()
-                                        status_table.flush()
-                        except Exception as e:
-                            log.exception('Could not read hdf5 file')
-                        finally:
-                            log.debug('Clean up: removing %s' % temp_path)
-                            if os.path.exists(temp_path):
-                                os.remove(temp_path)
-
-                    if stop_write_thread is True:
-                        log.debug('Ending HDF5 write thread')
-                        break
-
-        write_queue = queue.Queue()
-        request_queue = queue.Queue()
+        log.debug('Starting HDF5 write thread')
+        w.daemon = True
+        w.start()
 
-        def request_factory(partial_resource_list):
-            def request():
-                f = tempfile.NamedTemporaryFile(suffix='.h5', dir=tempfile.gettempdir(), delete=False)
-                f.close()
-                attempts = 0
-                while True:
-                    try:
-                        path = super(ParallelFeature, self).fetch(session, name, partial_resource_list, path=f.name)
-                    except socket.error as e: #if connection fails
-                        if attempts>MAX_ATTEMPTS:
-                            log.debug('Connection fail: Reached max attempts')
-                            break
-                        if e.errno == errno.WSAECONNRESET: #pylint: disable=no-member
-                            attempts+=1
-                            log.debug('Connection fail: Attempting to reconnect (try: %s)' % attempts)
-                    try:
-                        tables.is_pytables_file(path)
-                    except tables.HDF5ExtError: #if fail gets corrupts during download
-                        if attempts>MAX_ATTEMPTS:
-                            log.debug('Failed to open hdf5 file: Reached max attempts')
-                            break
-                        attempts+=1
-                        log.debug('HDF5 file may be corrupted: Attempted to redownload (try: %s)' % attempts)
-                        if os.path.exists(path):
-                            os.remove(path)
-
-                    write_queue.put(path)
-                    break
+        try:
+            self.request_chunks(session, name, plan, deliver)
+        finally:
+            w.put(None) # stops the writer once the queued chunks are written
+            w.join()
+        self.check_writer(w, hdf5)
+        log.info('Extracted %s on %s resources at %.1f resources/s', name, len(resource_list), plan.throughput())
 
-            return request
+        if path is None:
+            log.debug('Returning parallel feature response in a temporary file')
+            return hdf5
+        hdf5.close()
+        log.debug('Returning parallel feature response to %s' % path)
+        return path
 
-        if hasattr(self,'thread_num') and hasattr(self,'chunk_size'):
-            thread_num = ceil(self.thread_num)
-            chunk_size = ceil(self.chunk_size)
+    def _fetch_rows(self, session, name, resource_list):
+        """
+            Requests the features of resource_list on the request threads (see Feature._fetch_rows),
+            the status rows of the resources failing without response are (status, message)
+        """
+        plan = self.request_plan(resource_list)
+        rows = [None] * len(resource_list)
+        dtypes = [None, None]
 
-            if thread_num <= 0: thread_num = 1
-            if chunk_size <= 0: chunk_size = 1
+        def deliver(start, chunk, content, error):
+            if content is None:
+                chunk_rows = [ (None, error) ] * len(chunk)
+            else:
+                values_dtype, status_dtype, chunk_rows = response_rows(content, chunk)
+                if dtypes[0] is None:
+                    dtypes[0] = values_dtype
+                if dtypes[1] is None:
+                    dtypes[1] = status_dtype
+            rows[start:start+len(chunk)] = chunk_rows
 
-        else:
-            thread_num, chunk_size = self.calculate_request_plan(resource_list)
+        self.request_chunks(session, name, plan, deliver)
+        return dtypes[0], dtypes[1], rows
 
-        for partial_resource_list in self.chunk(resource_list, int(chunk_size)):
-            request_queue.put(request_factory(partial_resource_list))
+    def fetch_many(self, session, names, resource_list, path=None):
+        """
+            Requests the feature server to calculate several features of provided resources.
+            The chunks of all features are requested by the same threads and the
+            tables of each feature are written in the group of its name.
+            Repeated resources are requested once.
+
+            @param: session - the local session
+            @param: names - the names of the features one wishes to extract
+            @param: resource_list - list of the resources to extract. format: [(image_url, mask_url, gobject_url),...] if a parameter is
+            not required just provided None
+            @param: path - the location were the hdf5 file is stored. If None is set the file is a temporary file and the pytables
+            file handle will be returned. (default: None)
+
+            @return: returns either a pytables file handle or the file name when the path is provided,
+            the tables of feature name are /name/values and /name/status
+        """
+        resources = list(OrderedDict.fromkeys(tuple(r) for r in resource_list))
+        if len(resources) < 1 or len(names) < 1:
+            log.warning('Warning no resources were provided')
+            return
+        log.debug('Exctracting %s on %s resources (%s repeated)', ', '.join(names), len(resources), len(resource_list)-len(resources))
+
+        plan = self.request_plan([ (name, r) for name in names for r in resources ], key=lambda item: item[0])
+        write_queue = queue.Queue(maxsize=2*plan.max_threads)
+        hdf5 = create_hdf(path)
+        for name in names:
+            hdf5.create_group('/', name)
+        w = WriteHDF5Thread(hdf5, write_queue)
+
+        def deliver(start, chunk, content, error):
+            if not w.put(('/%s' % chunk[0][0], [ r for _, r in chunk ], content, error)):
+                plan.cancel()
 
-        w = WriteHDF5Thread(write_queue)
-        log.debug('Starting HDF5 write thread')
         w.daemon = True
         w.start()
 
-        self.request_thread_pool(request_queue, errorcb=self.errorcb, thread_count=int(thread_num))
-        stop_write_thread = True
-        w.join()
-
-        log.debug('Returning parallel feature response to %s' % table_path)
+        try:
+            self.request_chunks(session, None, plan, deliver)
+        finally:
+            w.put(None)
+            w.join()
+        self.check_writer(w, hdf5)
+        log.info('Extracted %s on %s resources at %.1f features/s', ', '.join(names), len(resources), plan.throughput())
 
         if path is None:
-            return tables.open_file(table_path, 'r')
+            return hdf5
+        hdf5.close()
+        return path
+
+    @staticmethod
+    def check_writer(writer, hdf5):
+        """
+            Raises the failure of a WriteHDF5Thread
+
+            @exception: FeatureError - when the writer failed, hdf5 is closed
+        """
+        if writer.error is not None:
+            hdf5.close()
+            raise FeatureError('Could not write the features: %s' % writer.error)
+
+    def request_chunks(self, session, name, plan, deliver):
+        """
+            Requests the features of the chunks of plan on the request threads
+
+            @param: session - the local session
+            @param: name - the name of the feature one wishes to extract, None when the resources
+            of plan are (name, resource) pairs of a single name per chunk (see fetch_many)
+            @param: plan - the RequestPlan of the resources
+            @param: deliver - called on the request threads with (index of the first resource, chunk, hdf5 response, error)
+            of every chunk, the response is None and error is (status, message) when the request failed.
+            Chunks failing on a resource (a 5xx status or a corrupted response) are bisected and requested
+            again, so those failures are delivered for single resources. Chunks refused by the server (4xx)
+            or failing to connect are delivered failed as a whole.
+
+            @exception: FeatureError - when deliver raised, the remaining chunks are not requested
+        """
+        request_queue = queue.Queue()
+        errors = []
+
+        def request_chunk(partial_resource_list):
+            """
+                @return: (hdf5 response, None, False) or (None, (status, error), bisect) when the request failed,
+                bisect is True when the failure may come from some of the resources
+            """
+            feature = name
+            if feature is None:
+                feature = partial_resource_list[0][0]
+                partial_resource_list = [ r for _, r in partial_resource_list ]
+            attempts = 0
+            while True:
+                try:
+                    content = super(ParallelFeature, self).request(session, feature, partial_resource_list)
+                except BQCommError as e: # the server failed on the chunk
+                    self.errorcb(e)
+                    status = e.response.status_code
+                    return None, (status, 'feature request failed with status %s' % status), status >= 500
+                except socket.error as e: # connection failures (also requests ConnectionError)
+                    if attempts>=MAX_ATTEMPTS:
+                        log.warning('Connection fail: Reached max attempts, %s resources failed', len(partial_resource_list))
+                        return None, (503, 'connection failed: %s' % e), False
+                    attempts+=1
+                    log.debug('Connection fail: Attempting to reconnect (try: %s)' % attempts)
+                    time.sleep(min(2**attempts * 0.1, 5))
+                    continue
+                if not content.startswith(HDF5_SIGNATURE): #if fail gets corrupts during download
+                    if attempts>=1 or len(partial_resource_list)>1: # chunks are bisected rather than requested again
+                        log.debug('Failed to open hdf5 file')
+                        return None, (500, 'corrupted feature response'), True
+                    attempts+=1
+                    log.debug('HDF5 file may be corrupted: Attempted to redownload (try: %s)' % attempts)
+                    continue
+                return content, None, False
+
+        def request():
+            while True:
+                indexed = plan.next_indexed_chunk()
+                if indexed is None:
+                    break
+                start, partial_resource_list = indexed
+                began = time.time()
+                try:
+                    content, error, bisect = request_chunk(partial_resource_list)
+                except Exception as e:
+                    log.exception('Feature request of %s resources failed', len(partial_resource_list))
+                    content, error, bisect = None, (500, 'feature request failed: %s' % e), False
+                try:
+                    if bisect and len(partial_resource_list) > 1:
+                        # bisect the failed chunk to isolate the failing resources
+                        half = len(partial_resource_list)//2
+                        log.debug('Feature request of %s resources failed: retrying in halves', len(partial_resource_list))
+                        plan.retry(start, partial_resource_list[:half])
+                        plan.retry(start+half, partial_resource_list[half:])
+                    else:
+                        deliver(start, partial_resource_list, content, error)
+                except Exception as e:
+                    errors.append(e)
+                    plan.cancel()
+                    raise
+                finally:
+                    plan.done(len(partial_resource_list), time.time() - began, failed=content is None)
+
+        # every thread asks the plan for chunks, the plan limits how many requests are made at once
+        for _ in range(plan.max_threads):
+            request_queue.put(request)
+        self.request_thread_pool(request_queue, errorcb=self.errorcb, thread_count=plan.max_threads)
+        if errors:
+            raise FeatureError('Could not deliver the features: %s' % errors[0])
+
+    def iter_features(self, session, name, resource_list, ordered=True, failures=None):
+        """
+            Requests the feature server to calculate provided resources
+            and yields the features of each chunk as soon as it arrives,
+            so they can be consumed while the extraction runs.
+            Resources failing on the feature server are left out of the blocks
+            and appended to failures.
+
+            @param: session - the local session
+            @param: name - the name of the feature one wishes to extract
+            @param: resource_list - list of the resources to extract. format:
+            [(image_url, mask_url, gobject_url),...] if a parameter is
+            not required just provided None
+            @param: ordered - yield the chunks in the order of resource_list, otherwise
+            as they arrive (default: True). The requests run at most two rounds of
+            requests ahead of the chunk to yield next, so a slow chunk holds back the others.
+            @param: failures - a list receiving the (index in resource_list, status, message)
+            of the failed resources, the failures of a chunk are appended before its block is yielded
+
+            @return: a generator of (indices in resource_list, features as numpy array)
+        """
+        if len(resource_list) < 1:
+            return
+        plan = self.request_plan(resource_list, window=True if ordered else None)
+        # the request threads wait when the consumer is behind
+        chunk_queue = queue.Queue(maxsize=2*plan.max_threads)
+
+        def run():
+            try:
+                self.request_chunks(session, name, plan, lambda *chunk: chunk_queue.put(chunk))
+            finally:
+                chunk_queue.put(None)
+        pool = Thread(target=run)
+        pool.daemon = True
+        pool.start()
+
+        pending = {}
+        next_start = 0
+        try:
+            while True:
+                item = chunk_queue.get()
+                if item is None:
+                    break
+                if not ordered:
+                    block = self.feature_block(*item, failures=failures)
+                    if block is not None:
+                        yield block
+                    continue
+                pending[item[0]] = item
+                while next_start in pending:
+                    start, chunk, content, error = pending.pop(next_start)
+                    next_start += len(chunk)
+                    block = self.feature_block(start, chunk, content, error, failures=failures)
+                    if block is not None:
+                        yield block
+                    plan.release(next_start)
+        finally:
+            plan.cancel() # the consumer stopped early, unblock the request threads
+            while pool.is_alive():
+                try:
+                    chunk_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    @staticmethod
+    def feature_block(start, chunk, content, error=None, failures=None):
+        """
+            Reads the features of a chunk response
+
+            @param: start - the index of the first resource of chunk
+            @param: chunk - the resources of the request
+            @param: content - the hdf5 response or None
+            @param: error - the (status, message) of a failed request
+            @param: failures - a list receiving the (index, status, message) of the failed resources
+
+            @return: (indices, features) of the resources without error or None
+        """
+        if content is None:
+            rows = [ (None, error) ] * len(chunk)
         else:
-            return table_path
+            rows = response_rows(content, chunk)[2]
+        indices, features = [], []
+        for i, (v, s) in enumerate(rows):
+            if v is not None:
+                indices.append(start+i)
+                features.append(v['feature'])
+            elif failures is not None:
+                if not isinstance(s, tuple):
+                    message = s['error'] if 'error' in s.dtype.names else b''
+                    s = (int(s['status']), message.decode('utf-8') if isinstance(message, bytes) else message)
+                failures.append((start+i, s[0], s[1]))
+        if not indices:
+            return None
+        return np.array(indices, dtype=np.int64), np.array(features)
 
     def errorcb(self, e):
         """
@@ -399,7 +1045,7 @@ class ParallelFeature(Feature):
         log.warning('%s'%str(e))
 
 
-    def fetch_vector(self, session, name, resource_list):
+    def fetch_vector(self, session, name, resource_list, ts=None):
         """
             Requests the feature server to calculate provided resources.
             The request will be boken up according to the chunk size
@@ -413,4 +1059,4 @@ class ParallelFeature(Feature):
 
             @return: a list of features as numpy array
         """
-        return super(ParallelFeature, self).fetch_vector(session, name, resource_list)
+        return super(ParallelFeature, self).fetch_vector(session, name, resource_list, ts=ts)
@@ -42,7 +42,8 @@
 ##                                                                           ##
 ###############################################################################
 """
-BQ API - a set of classes that represent Bisque objects
+BQ API - a set of classes that represent Bisque objects as views over
+lxml elements (select with BQAPI_BACKEND=bqnode, see bqapi.types)
 
 """
 
@@ -54,12 +55,21 @@ __date__      = "$Date$"
 __copyright__ = "Center for BioImage Informatics, University California, Santa Barbara"
 
 import sys
-import math
+import copy
+import json
 import inspect
 import logging
-from urllib.parse import quote
+from collections.abc import MutableSequence
 from lxml import etree
-import collections
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import bqclass
+from .bqclass import BQImagePixels, gobject_primitives
+from .xmldict import xml2nv, d2xml
+from .cache import image_meta_cache
 
 log = logging.getLogger('bqapi.bqnode')
 
@@ -68,31 +78,118 @@ __all__ = [ 'BQFactory', 'BQNode', 'BQImage', 'BQResource', 'BQValue', 'BQTag',
             'gobject_primitives',
             'BQPoint', 'BQLabel', 'BQPolyline', 'BQPolygon', 'BQCircle', 'BQEllipse', 'BQRectangle', 'BQSquare']
 
-gobject_primitives = set(['point', 'label', 'polyline', 'polygon', 'circle', 'ellipse', 'rectangle', 'square'])
-
 
 ################################################################################
 # Base class for bisque resources
 ################################################################################
 
+class ChildList(MutableSequence):
+    """List of the children of an element with one of tags (all children
+    when tags is None) selected by match
+
+    Changes write through to the element: inserted nodes are placed
+    after the selected children, removed nodes are removed from the element.
+    """
+    __slots__ = ('node', 'tags', 'match')
+
+    def __init__(self, node, tags, match=None):
+        self.node = node
+        self.tags = tags
+        self.match = match
+
+    def _items(self):
+        kids = self.node.iterchildren(*self.tags) if self.tags else self.node.iterchildren()
+        if self.match is None:
+            return list(kids)
+        return [ x for x in kids if self.match(x) ]
+
+    def __getitem__(self, i):
+        return self._items()[i]
+
+    def __len__(self):
+        return len(self._items())
+
+    def __iter__(self):
+        return iter(self._items())
+
+    def __delitem__(self, i):
+        items = self._items()
+        for x in (items[i] if isinstance(i, slice) else [ items[i] ]):
+            self.node.remove(x)
+
+    def __setitem__(self, i, value):
+        items = self._items()
+        if not isinstance(i, slice):
+            self.node.replace(items[i], value)
+            return
+        old = items[i]
+        position = self.node.index(old[0]) if old else self._position(items, i.start or 0)
+        for x in old:
+            self.node.remove(x)
+        for offset, x in enumerate(value):
+            self.node.insert(position + offset, x)
+
+    def insert(self, i, value):
+        items = self._items()
+        self.node.insert(self._position(items, i), value)
+
+    def _position(self, items, i):
+        "position in the element of a node inserted before items[i]"
+        if i < 0:
+            i = max(len(items) + i, 0)
+        if i < len(items):
+            return self.node.index(items[i])
+        if items:
+            return self.node.index(items[-1]) + 1
+        return len(self.node)
+
+    def __eq__(self, other):
+        if isinstance(other, (ChildList, list, tuple)):
+            return self._items() == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return repr(self._items())
+
+
+def childlist(tags, match=None):
+    "a ChildList property over the children selected by tags and match(node) with a setter replacing them"
+    def get_list(self):
+        return ChildList(self, tags, match)
+    def set_list(self, kids):
+        kids = list(kids)
+        for x in ChildList(self, tags, match)._items():
+            self.remove(x)
+        self.extend(kids)
+    return property(get_list, set_list)
+
+
 class BQNode (etree.ElementBase):
-    '''Base class for parsing Bisque XML'''
+    '''Base class for parsing Bisque XML
+
+    Nodes are views over the lxml tree: xmlfields are properties over the
+    xml attributes (see xmlfield).  lxml may drop and recreate the python proxy of an
+    element at any time so no other state may be kept on a node.
+    '''
     TAG = xmltag = 'NODE'
     xmlfields = []
     xmlkids = []
+    session = None  # set on the node classes of a session factory
 
+    def __init__(self, *args, **kw):
+        super(BQNode, self).__init__()
+        kw.update(zip(self.xmlfields, args))
+        for k in self.xmlfields:
+            if kw.get(k) is not None:
+                setattr(self, k, kw[k])
 
-    def __getattr__(self, name):
-        if name in self.xmlfields:
-            return self.get (name)
-        ###return etree.ElementBase.__getattr__(self, name)
-        #super(etree.ElementBase, self).__getattr__(name)
-
-    def __setattr__(self, name, val):
-        if name in self.xmlfields:
-            return self.set (name, val)
-        print("SETTER")
-        object.__setattr__(self, name, val)
+    def __bool__(self):
+        # lxml elements without children are false
+        return True
 
     def initialize(self):
         'used for class post parsing initialization'
@@ -103,19 +200,51 @@ class BQNode (etree.ElementBase):
             setattr(self, x, xmlnode.get (x, None))
 
     def set_parent(self, parent):
-        pass
+        parent.append(self)
 
     def __repr__(self):
-        return '(%s#%s)' % (self.TAG, len(self))
+        return '(%s:%s)' % (self.xmltag, id(self) )
 
     def __str__(self):
-        return etree.tostring(self)
-    #    return '(%s:%s:%s)'%(self.TAG,','.join (['%s=%s' % (f, getattr(self,f,'')) for f in self.attrib]), [ str (q) for q in self ] )
+        return etree.tostring(self, encoding='unicode')
 
     def toTuple (self):
-        return tuple( [ x for x in self.attr ] )
+        return tuple( [ x for x in self.xmlfields ] )
 
+    def toetree(self, parent, baseuri):
+        "copy the node (and its subtree) below parent"
+        n = copy.deepcopy(self)
+        n.tail = None
+        if parent is not None:
+            parent.append(n)
+        return n
 
+################################################################################
+# Value
+################################################################################
+
+class BQValue (BQNode):
+    '''tag value'''
+    TAG = xmltag = "value"
+    xmlfields = ['value', 'type', 'index']
+
+    def get_value(self):
+        return self.text
+    def set_value(self, value):
+        self.text = None if value is None else str(value)
+    value = property(get_value, set_value)
+
+    def get_index(self):
+        try:
+            return int(self.get('index'))
+        except (TypeError, ValueError):
+            return None
+    def set_index(self, index):
+        if index is None:
+            self.attrib.pop('index', None)
+        else:
+            self.set('index', str(index))
+    index = property(get_index, set_index)
 
 
 ################################################################################
@@ -125,27 +254,34 @@ class BQNode (etree.ElementBase):
 class BQResource (BQNode):
     '''Base class for Bisque resources'''
     TAG = xmltag = 'resource'
-    xmlfields = ['name', 'values', 'type', 'uri', 'ts', 'resource_uniq']
+    xmlfields = ['name', 'type', 'uri', 'ts', 'resource_uniq']
     xmlkids = ['kids', 'tags', 'gobjects']
 
-    #def __repr__(self):
-    #    return '(%s:%s)'%(self.xmltag, self.uri)
+    def __repr__(self):
+        return '(%s:%s)'%(self.xmltag, self.uri)
+
+    # child lists are views: changes are written to the element
+    tags = childlist(('tag',))
+    gobjects = childlist(('gobject',) + tuple(gobject_primitives))
+    kids = childlist(None, lambda x: isinstance(x, BQResource) and not isinstance(x, (BQTag, BQGObject)))
 
+    def get_values(self):
+        "the BQValue children, a value attribute is returned as a detached first value"
+        values = list(self.iterchildren('value'))
+        if 'value' in self.attrib:
+            values.insert(0, BQValue(self.get('value')))
+        return values
+    values = property(get_values)
 
-    def get_tags(self):
-        return [ x for x in self.iter ('tag') ]
-    tags = property(get_tags)
-    def get_gobjects(self):
-        return [ x for x in self.iter ('gobject') ]
-    gobjects = property(get_gobjects)
-    def get_kids(self):
-        return [ x for x in self.iter () ]
-    kids = property(get_kids)
+    parent = property(lambda self: self.getparent())
+    xmltree = property(lambda self: self)
 
-    #def __init__(self):
-    #    self.tags = []
-    #    self.gobjects = []
-    #    self.kids = []
+    def iterkids(self, kid_name):
+        "iterate over a child list"
+        kids = getattr(self, kid_name, None)
+        if isinstance(kids, ChildList):
+            return kids._items()
+        return kids or ()
 
     def toDict (self):
         objs = {}
@@ -153,97 +289,75 @@ class BQResource (BQNode):
         objs.update ( [ (f.name, f) for f in self.gobjects if f.name ] )
         return objs
 
-    def set_parent(self, parent):
-        parent.kids.append(self)
-
-    def add_tag(self, name=None, value=None, type=None, tag=None):
+    def addTag(self, name=None, value=None, type=None, tag=None):
         if tag is None:
-            args = dict ( name=name, value=value, type=type)
-            tag = BQTag( **dict ((k, v)  for k,v in list(args.items()) if v is not None) )
+            tag = BQTag(name=name, value=value, type=type)
         self.append(tag)
         return tag
-    addTag = add_tag
+    add_tag = addTag
 
-    def add_gob(self, name=None, value=None, type=None, gob=None):
+    def addGObject(self, name=None, value=None, type=None, gob=None):
         if gob is None:
-            args = dict ( name=name, value=value, type=type)
-            gob = BQGObject( **dict ((k, v)  for k,v in list(args.items()) if v is not None) )
+            gob = BQFactory.find('gobject', type)(name=name, value=value, type=type)
         self.append(gob)
         return gob
-    addGObject = add_gob
-
-
-    # def findall (pathexpress)
-    #     Implemented by
-    # def tag(self, name):
-    #     results = []
-    #     for tg in self.tags:
-    #         if tg.name == name:
-    #             results.append(tg)
-    #     if len(results) == 0:
-    #         return None
-    #     elif len(results) == 1:
-    #         return results[0]
-    #     else:
-    #         return results
-
-    # def gob(self, name):
-    #     results = []
-    #     for tg in self.gobjects:
-    #         if tg.name == name:
-    #             results.append(tg)
-    #     if len(results) == 0:
-    #         return None
-    #     elif len(results) == 1:
-    #         return results[0]
-    #     else:
-    #         return results
+    add_gob = addGObject
 
+    def spatialIndex(self):
+        """Return a spatial index over all nested gobjects (requires numpy)
 
-    def set_parent(self, parent):
-        parent.tags.append(self)
+        The index is not kept on the node: it is rebuilt on every call.
+        See L{bqapi.geometry.GObjectIndex}
+        """
+        from .geometry import GObjectIndex
+        return GObjectIndex(self)
+    spatial_index = spatialIndex
 
-    def get_values(self):
+    # limit keyword -> child collection searched by find/findall
+    find_collections = (('tag', 'tags'), ('gobject', 'gobjects'), ('kid', 'kids'))
+
+    def named(self, collection, name):
+        "Return the children of collection ('tags', 'gobjects', 'kids') with name"
+        return [ x for x in self.iterkids(collection) if x.get('name') == name ]
+
+    def reindex(self):
+        "children are not indexed by name: nothing to do"
+        pass
+
+    # find and findall search children by name as in bqclass (not by ElementPath)
+    findall = bqclass.BQResource.findall
+    find = bqclass.BQResource.find
+    _find_path = bqclass.BQResource._find_path
+
+    def get_value(self):
+        values = [ x.text for x in self.iterchildren('value') ]
         if 'value' in self.attrib:
-            return self.attrib['value']
-        result = [str(v.text) for v in self.iter ('value')]
-        return result
+            values.insert(0, self.get('value'))
+        if not values:
+            return None
+        if len(values)==1:
+            return values[0]
+        return values
 
-    def set_values(self, values):
-        """Assign a list of values
+    def set_value(self, values):
+        """Assign a value or a list of values
            Maybe single value list or a list of (value, type) tuples where type is object, integer, float, number, string
         """
+        self.attrib.pop('value', None)
+        for x in list(self.iterchildren('value')):
+            self.remove(x)
+        if values is None:
+            return
         if not isinstance(values, list):
-            self.set('value', str(values))
-        else:
-            if 'value' in self.attrib:
-                del self.attrib['value']
-            for child in self:
-                self.remove (child)
-            for v in values:
-                if isinstance (v, tuple):
-                    val = etree.SubElement (self, 'value', type=v[1])
-                    v = v[0]
-                else:
-                    val = etree.SubElement (self, 'value')
-                val.text = str(v)
-
-    value = property(get_values, set_values)
-
-    def toetree(self, parent, baseuri):
-        xmlkids = list(self.xmlkids)
-        if len(self.values)<=1:
-            n = create_element(self, parent, baseuri)
-        else:
-            n = create_element(self, parent, baseuri)
-            del n.attrib['value']
-            xmlkids.append('values')
-        for kid_name in xmlkids:
-            for x in getattr(self, kid_name, None):
-                toxmlnode (x, n, baseuri)
-        return n
-
+            values = [ values ]
+        if len(values) == 1:
+            value = values[0][0] if isinstance(values[0], tuple) else values[0]
+            self.set('value', str(value))
+            return
+        for v in values:
+            self.append(BQValue(*v) if isinstance(v, tuple) else BQValue(v))
 
+    value = property(get_value, set_value)
 
 
 ################################################################################
@@ -252,147 +366,44 @@ class BQResource (BQNode):
 
 class BQImage(BQResource):
     TAG = xmltag = "image"
-    xmlfields = ['name', 'uri', 'ts' , "value", 'resource_uniq' ] #  "x", "y","z", "t", "ch"  ]
+    xmlfields = ['name', 'value', 'type', 'uri', 'ts', 'resource_uniq' ] #  "x", "y","z", "t", "ch"  ]
     xmlkids = ['tags', 'gobjects']
 
-    #def __init__(self):
-    #    super(BQImage, self).__init__()
-    #    self._geometry = None
+    # nodes do not keep state: image metadata comes from the shared image_meta_cache
+
+    def meta(self):
+        'return image meta as xml'
+        return etree.XML(image_meta_cache.fetch(self))
+
+    def info(self):
+        'return image meta as dict'
+        return xml2nv(self.meta())
 
     def geometry(self):
         'return x,y,z,t,ch of image'
-        if self._geometry is None:
-            info = self.pixels().meta().fetch()
-            info = etree.XML(info)
-            geom = []
-            for n in 'xyztc':
-                tn = info.xpath('//tag[@name="image_num_%s"]' % n)
-                geom.append(tn[0].get('value'))
-            self._geometry = tuple(map(int, geom))
-        return self._geometry
+        info = self.meta()
+        geom = []
+        for n in 'xyztc':
+            tn = info.xpath('//tag[@name="image_num_%s"]' % n)
+            geom.append(tn[0].get('value'))
+        return tuple(map(int, geom))
 
     def pixels(self):
         return BQImagePixels(self)
 
-class BQImagePixels(object):
-    """manage requests to the image pixels"""
-    def __init__(self, image):
-        self.image = image
-        self.ops = []
-
-    def _construct_url(self):
-        """build the final url based on the operation
-        """
-        image_service = self.image.session.service('image_service')
-        return image_service.construct (path = '%s?%s'%(self.image.resource_uniq,
-                                                        '&'.join ( "%s=%s" % tp for tp in self.ops )))
-
-    def fetch(self, path=None):
-        """resolve the current and fetch the pixel
-        """
-        url = self._construct_url()
-        session = self.image.session
-        return session.c.fetch (url, path=path)
-
-    def command(self, operation, arguments=''):
-        self.ops.append((operation, arguments))
-        return self
-
-    def slice(self, x='', y='',z='',t=''):
-        """Slice the current image"""
-        return self.command('slice', '%s,%s,%s,%s' % (x,y,z,t))
-
-    def format(self, fmt):
-        return self.command('format', fmt)
-
-    def resize(self, w='',h='', interpolation='NN'):
-        """ interpoaltion may be,[ NN|,BL|,BC][,AR]
-        """
-        return self.command('resize', '%s,%s,%s' % (w,h,interpolation))
-
-    def localpath(self):
-        return self.command('localpath')
-
-    def meta(self):
-        return self.command('meta')
-
-    def info(self):
-        return self.command('info')
-
-    def asarray(self):
-        try:
-            import tifffile
-        except ImportError:
-            log.error ("Please install Tifffile (Optional)")
-            return None
-        # Force format to be tiff by removing any format and append format tiff
-        self.ops = [ tp for tp in self.ops if tp[0] != 'format' ]
-        self.format ('tiff')
-        url = self._construct_url()
-        image_service = self.image.session.service ('image_service')
-        with  image_service.fetch (url, stream=True) as response:
-            #response.raw.decode_content = True
-            return tifffile.imread (io.BytesIO (response.content))
-
+    tiles = bqclass.BQImage.tiles
 
 
 ################################################################################
 # Tag
 ################################################################################
 
-class BQValue (BQNode):
-    '''tag value'''
-    TAG = xmltag = "value"
-    xmlfields = ['value', 'type', 'index']
-
-    #def __init__(self,  value=None, type=None, index=None):
-    #    self.value = value
-    #    self.type = type
-    #    self.index = index
-
-    def set_parent(self, parent):
-        if self.index is not None:
-            parent.values.extend([None for x in range((self.index+1)-len(parent.values))])
-            parent.values[self.index] = self
-        else:
-            parent.values.append(self)
-
-    def initializeXml(self, xmlnode):
-        super(BQValue, self).initializeXml(xmlnode)
-        try:
-            self.index = int(self.index)
-        except Exception:
-            self.index = None
-        self.value = xmlnode.text
-
-    def toetree(self, parent, baseuri):
-        n = etree.SubElement(parent, 'value', )
-        if self.type is not None: n.set('type', str(self.type))
-        if self.index is not None: n.set('index', str(self.index))
-        if self.value is not None: n.text = str(self.value)
-        return n
-
-    #def __call__(self):
-    #    if len(self.values<=0): return ''
-    #    elif len(self.values==1): return str(self.values[0])
-    #    def str_join(x,y): return '%s,%s'%(x,y)
-    #    return reduce(str_join, self.values)
-
 class BQTag (BQResource):
     '''tag resource'''
     TAG = xmltag = "tag"
-    xmlfields = ['name', 'type', 'uri', 'ts', 'value']
+    xmlfields = ['name', 'value', 'type', 'uri', 'ts']
     xmlkids = ['tags', 'gobjects',  ] # handle values  specially
 
-    #def __init__(self, name='', value=None, type=None):
-    #    super(BQTag, self).__init__()
-    #    self.name = name
-    #    self.values = (value and [BQValue(value)]) or []
-    #    if type is not None:
-    #        self.type=type
-
-
-
 
 ################################################################################
 # GObject
@@ -400,19 +411,12 @@ class BQTag (BQResource):
 
 class BQVertex (BQNode):
     '''gobject vertex'''
-    type = 'vertex'
     TAG = xmltag = "vertex"
     xmlfields = ['x', 'y', 'z', 't', 'c', 'index']
 
-    #def __init__(self, **kw):
-    #    self.fromObj(**kw)
-
     def __repr__(self):
         return 'vertex(x:%s,y:%s,z:%s,t:%s)'%(self.x, self.y, self.z, self.t)
 
-    def set_parent(self, parent):
-        parent.vertices.append(self)
-
     def toTuple(self):
         return (self.x, self.y, self.z, self.t)
 
@@ -426,33 +430,61 @@ class BQVertex (BQNode):
                 setattr(self,k,v)
 
 class BQGObject(BQResource):
-    '''Gobject resource: A grpahical annotation'''
-    type = 'gobject'
+    '''Gobject resource: A grpahical annotation
+
+    Vertex coordinates are read from the xml attributes (strings, as when
+    parsed with bqclass).
+    '''
     TAG = xmltag = "gobject"
-    xmlfields = ['name', 'type', 'uri']
+    xmlfields = ['name', 'value', 'type', 'uri']
     xmlkids = ['tags', 'gobjects', 'vertices']
 
-    #def __init__(self, name=None, type=None):
-    #    super(BQGObject, self).__init__()
-    #    self.vertices = []
-    #    self.name=name
-    #    self.type= type or self.xmltag
+    def __init__(self, *args, **kw):
+        super(BQGObject, self).__init__(*args, **kw)
+        if self.get('type') is None:
+            self.set('type', self.xmltag)
 
     def __str__(self):
         return '(type: %s, name: %s, %s)'%(self.type, self.name, self.vertices)
 
-    def set_parent(self, parent):
-        parent.gobjects.append(self)
+    vertices = childlist(('vertex',))
 
     def verticesAsTuples(self):
         return [v.toTuple() for v in self.vertices ]
 
+    def verticesAsArray(self):
+        """Return the vertices as an N x 4 float array of x,y,z,t
+
+        Missing coordinates are NaN.
+        """
+        if np is None:
+            raise ImportError("numpy is required for vertex arrays")
+        coords = np.array([ v.get(c, 'nan') for v in self.iterchildren('vertex') for c in 'xyzt' ], dtype=float)
+        return coords.reshape(-1, 4)
+
+    def verticesFromArray(self, coords):
+        """Replace the vertices with an N x 2, N x 3 or N x 4 array of x,y[,z[,t]]"""
+        if np is None:
+            raise ImportError("numpy is required for vertex arrays")
+        coords = np.asarray(coords, dtype=float)
+        vertices = []
+        for index, row in enumerate(coords.tolist()):
+            xyzt = dict( (c, value) for c, value in zip('xyzt', row) if value == value ) # NaN -> missing
+            vertices.append(BQVertex(index=index, **xyzt))
+        self.vertices = vertices
+
+    _vertexFloats = bqclass.BQGObject._vertexFloats
+
     def perimeter(self):
         return -1
 
     def area(self):
         return -1
 
+    centroid = bqclass.BQGObject.centroid
+    bbox = bqclass.BQGObject.bbox
+
+# The shape geometry is shared with bqclass: it only uses the vertex accessors
 
 class BQPoint (BQGObject):
     '''point gobject resource'''
@@ -465,96 +497,37 @@ class BQLabel (BQGObject):
 class BQPolyline (BQGObject):
     '''polyline gobject resource'''
     TAG = xmltag = "polyline"
-    def perimeter(self):
-        vx = self.verticesAsTuples()
-        d = 0
-        for i in range(0, len(vx)-1):
-            x1,y1,z1,t1 = vx[i]
-            x2,y2,z2,t2 = vx[i+1]
-            d += math.sqrt( math.pow(x2-x1,2.0) + math.pow(y2-y1,2.0) )
-        return d
-
+    perimeter = bqclass.BQPolyline.perimeter
 
-# only does 2D version right now, polygon area is flawed if the edges are intersecting
-# implement better algorithm based on triangles
 class BQPolygon (BQGObject):
     '''Polygon gobject resource'''
     TAG = xmltag = "polygon"
-    # only does 2D version right now
-    def perimeter(self):
-        vx = self.verticesAsTuples()
-        vx.append(vx[0])
-        d = 0
-        for i in range(0, len(vx)-1):
-            x1,y1,z1,t1 = vx[i]
-            x2,y2,z2,t2 = vx[i+1]
-            d += math.sqrt( math.pow(x2-x1,2.0) + math.pow(y2-y1,2.0) )
-        return d
-
-    # only does 2D version right now
-    # area is flawed if the edges are intersecting implement better algorithm based on triangles
-    def area(self):
-        vx = self.verticesAsTuples()
-        vx.append(vx[0])
-        d = 0
-        for i in range(0, len(vx)-1):
-            x1,y1,z1,t1 = vx[i]
-            x2,y2,z2,t2 = vx[i+1]
-            d += x1*y2 - y1*x2
-        return 0.5 * math.fabs(d)
+    perimeter = bqclass.BQPolygon.perimeter
+    area = bqclass.BQPolygon.area
+    centroid = bqclass.BQPolygon.centroid
+    _signed_area = staticmethod(bqclass.BQPolygon._signed_area)
 
 class BQCircle (BQGObject):
     '''circle gobject resource'''
     TAG = xmltag = "circle"
-    def perimeter(self):
-        vx = self.verticesAsTuples()
-        x1,y1,z1,t1 = vx[0]
-        x2,y2,z2,t2 = vx[1]
-        return 2.0 * math.pi * max(math.fabs(x1-x2), math.fabs(y1-y2))
-
-    def area(self):
-        vx = self.verticesAsTuples()
-        x1,y1,z1,t1 = vx[0]
-        x2,y2,z2,t2 = vx[1]
-        return math.pi * pow( max(math.fabs(x1-x2), math.fabs(y1-y2)), 2.0)
+    perimeter = bqclass.BQCircle.perimeter
+    area = bqclass.BQCircle.area
+    centroid = bqclass.BQCircle.centroid
+    bbox = bqclass.BQCircle.bbox
 
 class BQEllipse (BQGObject):
     '''ellipse gobject resource'''
     TAG = xmltag = "ellipse"
-    type = 'ellipse'
-
-    def perimeter(self):
-        vx = self.verticesAsTuples()
-        x1,y1,z1,t1 = vx[0]
-        x2,y2,z2,t2 = vx[1]
-        x3,y3,z3,t3 = vx[2]
-        a = max(math.fabs(x1-x2), math.fabs(y1-y2))
-        b = max(math.fabs(x1-x3), math.fabs(y1-y3))
-        return math.pi * ( 3.0*(a+b) - math.sqrt( 10.0*a*b + 3.0*(a*a + b*b)) )
-
-    def area(self):
-        vx = self.verticesAsTuples()
-        x1,y1,z1,t1 = vx[0]
-        x2,y2,z2,t2 = vx[1]
-        x3,y3,z3,t3 = vx[2]
-        a = max(math.fabs(x1-x2), math.fabs(y1-y2))
-        b = max(math.fabs(x1-x3), math.fabs(y1-y3))
-        return math.pi * a * b
+    perimeter = bqclass.BQEllipse.perimeter
+    area = bqclass.BQEllipse.area
+    centroid = bqclass.BQEllipse.centroid
+    bbox = bqclass.BQEllipse.bbox
 
 class BQRectangle (BQGObject):
     '''rectangle gobject resource'''
     TAG = xmltag = "rectangle"
-    def perimeter(self):
-        vx = self.verticesAsTuples()
-        x1,y1,z1,t1 = vx[0]
-        x2,y2,z2,t2 = vx[1]
-        return math.fabs(x1-x2)*2.0 + math.fabs(y1-y2)*2.0
-
-    def area(self):
-        vx = self.verticesAsTuples()
-        x1,y1,z1,t1 = vx[0]
-        x2,y2,z2,t2 = vx[1]
-        return math.fabs(x1-x2) * math.fabs(y1-y2)
+    perimeter = bqclass.BQRectangle.perimeter
+    area = bqclass.BQRectangle.area
 
 class BQSquare (BQRectangle):
     '''square gobject resource'''
@@ -566,42 +539,70 @@ class BQSquare (BQRectangle):
 ################################################################################
 class BQDataset(BQResource):
     TAG = xmltag = "dataset"
-    #xmlfields = ['name', 'uri', 'ts']
-    #xmlkids = ['kids', 'tags', 'gobjects']
-
-
-
-
-
 
 class BQUser(BQResource):
     TAG = xmltag = "user"
-    #xmlfields = ['name', 'uri', 'ts']
-    #xmlkids = ['tags', 'gobjects']
 
 class BQMex(BQResource):
     TAG = xmltag = "mex"
-    #xmlfields = ['module', 'uri', 'ts', 'value']
-    #xmlkids = ['tags', 'gobjects']
 
 
+def xmlfield(name):
+    "a property over the xml attribute name, None removes the attribute"
+    def get_field(self):
+        return self.get(name)
+    def set_field(self, val):
+        if val is None:
+            self.attrib.pop(name, None)
+        else:
+            self.set(name, str(val))
+    return property(get_field, set_field)
+
+for cls in [ x[1] for x in inspect.getmembers(sys.modules[__name__]) if inspect.isclass(x[1]) and issubclass(x[1], BQNode) ]:
+    for field in cls.xmlfields:
+        if not isinstance(getattr(cls, field, None), property):
+            setattr(cls, field, xmlfield(field))
+
 
 ################################################################################
 # Factory
 ################################################################################
 
 class BQFactory (etree.PythonElementClassLookup):
-    '''Factory for Bisque resources'''
-    resources = dict([ (x[1].xmltag, x[1]) for x in inspect.getmembers(sys.modules[__name__]) if inspect.isclass(x[1]) and hasattr(x[1], 'xmltag') ])
+    '''Factory for Bisque resources
 
+    The factory is the element class lookup of its parser: documents parsed
+    with it are made of BQ nodes directly, no second object tree is built.
+    '''
+    resources = dict([ (x[1].xmltag, x[1]) for x in inspect.getmembers(sys.modules[__name__]) if inspect.isclass(x[1]) and hasattr(x[1], 'xmltag') ])
 
-    def __init__(self, session):
+    def __init__(self, session, vertex_array=False, lazy=False):
+        """
+            @param session: the session attached to parsed resources
+            @param vertex_array, lazy: accepted for bqclass compatibility, nodes always
+            read vertices and children from the xml on access
+        """
+        super(BQFactory, self).__init__()
         self.session = session
-        self.parser = etree.XMLParser()
+        self.vertex_array = vertex_array
+        self.lazy = lazy
+        self.classes = self.resources
+        if session is not None:
+            # session bound node classes: nodes cannot hold a session attribute
+            self.classes = dict((tag, type(c.__name__, (c,), {'session': session}))
+                                for tag, c in self.resources.items())
+        self.parser = etree.XMLParser(remove_blank_text=True)
         self.parser.set_element_class_lookup(self)
 
     def lookup (self, document, element):
-        return self.find(element.tag, element.get ('type', ''))
+        xmltag = element.tag
+        if not isinstance(xmltag, str):
+            return None # comments and processing instructions
+        if xmltag == "gobject":
+            type_attr = element.get('type', '')
+            if type_attr in gobject_primitives:
+                xmltag = type_attr
+        return self.classes.get(xmltag, self.classes['resource'])
 
     @classmethod
     def find(cls, xmltag, type_attr):
@@ -620,119 +621,62 @@ class BQFactory (etree.PythonElementClassLookup):
     def index(cls, xmltag, parent, indx):
         array, ctor = cls.index_map.get (xmltag, (None,None))
         if array:
-            objarr =  getattr(parent, array)
-            objarr.extend ([ ctor() for x in range(((indx+1)-len(objarr)))])
-            v = objarr[indx]
-            v.indx = indx;
-            #log.debug ('fetching %s %s[%d]:%s' %(parent , array, indx, v))
+            for x in range((indx+1)-len(getattr(parent, array))):
+                parent.append(ctor())
+            v = getattr(parent, array)[indx]
+            v.index = indx
             return v
 
     # Parsing
-    def from_etree(self, node):
-        """ Convert an etree to a python structure"""
+    def from_etree(self, xmlResource, resource=None, parent=None):
+        """ Convert an etree to a python structure
+
+        Nodes of this factory are returned as is, other elements are copied into a BQ node tree.
+        """
+        node = xmlResource
+        if not isinstance(node, BQNode) or node.session is not self.session:
+            node = etree.fromstring(etree.tostring(node, with_tail=False), self.parser)
+        if parent is not None:
+            parent.append(node)
+        node.initialize()
         return node
 
     def from_string(self, xmlstring):
-        return etree.XML(xmlstring, self.parser)
+        return self.from_etree(etree.XML(xmlstring, self.parser))
+
+    def from_dict(self, d, resource=None, parent=None):
+        """Convert a document dict {tag: {...}} in the xml2d layout to a BQ node tree"""
+        return self.from_etree(d2xml(d, typed=True, makeelement=self.parser.makeelement), resource, parent)
+
+    def from_json(self, jsonstring):
+        return self.from_dict(json.loads(jsonstring))
 
     # Generation
     @classmethod
-    def to_string (self, nodes):
-        return etree.tostring (nodes)
+    def to_string (self, node):
+        return etree.tostring (node, with_tail=False)
 
     @classmethod
-    def to_etree(self, bqnode):
-        """Convert BQNode  to elementTree"""
-        return bqnode
+    def to_etree(self, dbo, parent=None, baseuri='', view=''):
+        """Copy a BQNode to an etree object suitable for XML generation"""
+        return toxmlnode(dbo, parent, baseuri, view)
 
     def string2etree(self, xmlstring):
         return etree.XML (xmlstring, self.parser)
 
+# directly created nodes use this parser so their children are BQ nodes too
+BQNode.PARSER = BQFactory(None).parser
 
 
 ################################################################################
 # Generation
 ################################################################################
 
-def toXml(dbo, parent=None, baseuri='', view=''):
-    """Convert a BQObject to an etree object suitable for XML
-    generation
-    """
-    node = dbo
-    return node;
-
-
-def create_element(dbo, parent, baseuri, **kw):
-    """Create an etree element from BQ object
-    """
-    xtag = kw.pop('xtag', dbo.xmltag)
-    if not kw:
-        kw = model_fields (dbo, baseuri)
-    if parent is not None:
-        node =  etree.SubElement (parent, xtag, **kw)
-    else:
-        node =  etree.Element (xtag,  **kw)
-    return node
-
 def toxmlnode (dbo, parent, baseuri, view=None):
     if hasattr(dbo, 'toetree'):
-        node = dbo.toetree(parent, baseuri)
-    else:
-        node = create_element (dbo, parent, baseuri)
-        for kid_name in dbo.xmlkids:
-            for x in getattr(dbo, kid_name, None):
-                toxmlnode (x, node, baseuri, view)
+        return dbo.toetree(parent, baseuri)
+    node = copy.deepcopy(dbo)
+    node.tail = None
+    if parent is not None:
+        parent.append(node)
     return node
-
-
-def make_owner (dbo, fn, baseuri):
-    return ('owner', baseuri + str(dbo.owner))
-
-def make_uri(dbo, fn, baseuri):
-    return ('uri', "%s%s" % (baseuri , str (dbo.uri)))
-
-def get_email (dbo, fn, baseuri):
-    return ('email', dbo.user.email_address)
-
-mapping_fields = {
-    'mex' : None,
-    'acl' : None,
-    # Auth
-    'user_id' : get_email,
-    'taggable_id': None,
-    'permission': 'action',
-    'resource': None,
-    }
-
-def model_fields(dbo, baseuri=None):
-    """Extract known fields from a BQ object, while removing any known
-    from C{excluded_fields}
-
-    @rtype: dict
-    @return fields to be rendered in XML
-    """
-    attrs = {}
-    try:
-        dbo_fields = dbo.xmlfields
-    except AttributeError:
-        # This occurs when the object is a fake DB objects
-        # The dictionary is sufficient
-        dbo_fields= dbo.__dict__
-    for fn in dbo_fields:
-        fn = mapping_fields.get(fn, fn)
-        # Skip when map is None
-        if fn is None:
-            continue
-        # Map is callable, then call
-        if isinstance(fn, collections.Callable):
-            fn, attr_val = fn(dbo, fn, baseuri)
-        else:
-            attr_val = getattr(dbo, fn, None)
-
-        # Put value in attribute dictionary
-        if attr_val is not None and attr_val!='':
-            if isinstance(attr_val, str):
-               attrs[fn] = attr_val
-            else:
-               attrs[fn] = str(attr_val) #unicode(attr_val,'utf-8')
-    return attrs
@@ -0,0 +1,375 @@
+"""
+Caches of resources shared by all sessions of a process
+"""
+import os
+import re
+import ast
+import glob
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+import collections
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger('bqapi.cache')
+
+
+class ImageMetaCache(object):
+    """Image service metadata (the meta document) keyed by resource_uniq and ts
+
+    Documents are kept in memory (least recently used are dropped past
+    max_entries) and, when path is set, stored in path as one file per image
+    so later processes do not fetch them again.  Images without a ts are only
+    cached in memory.
+    """
+    def __init__(self, path=None, max_entries=4096):
+        """
+            @param path: directory of the persistent cache (default: memory only)
+            @param max_entries: number of documents kept in memory
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(image):
+        "cache key of an image or None when it cannot be cached"
+        if not image.resource_uniq:
+            return None
+        return (image.resource_uniq, image.ts or '')
+
+    def _filename(self, key):
+        return os.path.join(self.path, re.sub(r'[^\w.-]', '_', '%s@%s.xml' % key))
+
+    def get(self, key):
+        "the cached meta document of key or None"
+        with self.lock:
+            meta = self.entries.get(key)
+            if meta is not None:
+                self.entries.move_to_end(key)
+                return meta
+        if self.path and key[1]:
+            try:
+                with open(self._filename(key), 'rb') as f:
+                    meta = f.read()
+            except (IOError, OSError):
+                return None
+            self._remember(key, meta)
+        return meta
+
+    def put(self, key, meta):
+        self._remember(key, meta)
+        if self.path and key[1]:
+            filename = self._filename(key)
+            try:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                tmp = '%s.%d.%d' % (filename, os.getpid(), threading.get_ident())
+                with open(tmp, 'wb') as f:
+                    f.write(meta)
+                os.replace(tmp, filename)
+            except (IOError, OSError):
+                log.warning("could not store image meta in %s", filename)
+
+    def _remember(self, key, meta):
+        with self.lock:
+            self.entries[key] = meta
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        "forget the documents kept in memory"
+        with self.lock:
+            self.entries.clear()
+
+    def fetch(self, image):
+        """the meta document of image, fetched from the image service when not cached
+
+        @param image: a BQImage
+        @return: the document as bytes
+        """
+        key = self.key(image)
+        meta = key and self.get(key)
+        if meta is None:
+            meta = image.pixels().meta().fetch()
+            if key:
+                self.put(key, meta)
+        return meta
+
+
+# shared by all images, set BQAPI_META_CACHE to a directory to keep it between runs
+image_meta_cache = ImageMetaCache(os.environ.get('BQAPI_META_CACHE'))
+
+
+class TableSliceCache(object):
+    """Slices of table service arrays keyed by (table path, ts) and their bounds
+
+    A slice contained in a cached slice is served from it.  Slices are kept
+    in memory (least recently used are dropped past max_bytes) and, when path
+    is set and the ts of the table is known, stored in path as .npy files
+    (oldest are removed past max_disk_bytes).  The info documents of the
+    tables (sizes of the dimensions) are cached separately.
+    """
+    def __init__(self, path=None, max_bytes=256*1024*1024, max_disk_bytes=4*1024*1024*1024):
+        """
+            @param path: directory of the persistent cache (default: memory only)
+            @param max_bytes: size of the slices kept in memory
+            @param max_disk_bytes: size of the slices kept in path
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.infos = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def bounds(slices, sizes):
+        """normalized [start, stop) of each dimension of slices (indices are ranges of one)
+
+        @return: a tuple of (start, stop) or None when slices cannot be cached (steps)
+        """
+        bounds = []
+        for i, size in enumerate(sizes):
+            s = slices[i] if i < len(slices) else slice(None)
+            if isinstance(s, slice):
+                if s.step not in (None, 1):
+                    return None
+                start, stop, _ = s.indices(size)
+                bounds.append((start, max(start, stop)))
+            else:
+                s = s + size if s < 0 else s
+                bounds.append((s, s + 1))
+        return tuple(bounds)
+
+    def _prefix(self, key):
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20])
+
+    def get_info(self, key):
+        "the info document of key (table path, ts) or None"
+        with self.lock:
+            info = self.infos.get(key)
+        if info is None and self.path and key[1]:
+            try:
+                with open(self._prefix(key) + '.json') as f:
+                    info = json.load(f)
+            except (IOError, OSError, ValueError):
+                return None
+            with self.lock:
+                self.infos[key] = info
+        return info
+
+    def put_info(self, key, info):
+        with self.lock:
+            self.infos[key] = info
+        if self.path and key[1]:
+            self._write(self._prefix(key) + '.json', lambda f: f.write(json.dumps(info).encode('utf-8')))
+
+    def get(self, key, bounds):
+        """a copy of the slice bounds of key served from a cached slice or None"""
+        with self.lock:
+            for (k, b), array in reversed(self.entries.items()):
+                if k == key and _contains(b, bounds):
+                    self.entries.move_to_end((k, b))
+                    return array[_subslice(b, bounds)].copy()
+        if self.path and key[1]:
+            for filename in glob.glob(self._prefix(key) + '_*.npy'):
+                b = _filename_bounds(filename)
+                if b is not None and _contains(b, bounds):
+                    try:
+                        array = np.load(filename, mmap_mode='r')[_subslice(b, bounds)].copy()
+                        os.utime(filename) # recently used
+                        return array
+                    except (IOError, OSError, ValueError):
+                        continue
+        return None
+
+    def put(self, key, bounds, array):
+        "cache (a copy of) the slice bounds of key"
+        if array.nbytes <= self.max_bytes:
+            copy = np.array(array)
+            with self.lock:
+                old = self.entries.pop((key, bounds), None)
+                if old is not None:
+                    self.nbytes -= old.nbytes
+                self.entries[(key, bounds)] = copy
+                self.nbytes += array.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, old = self.entries.popitem(last=False)
+                    self.nbytes -= old.nbytes
+        if self.path and key[1] and array.nbytes <= self.max_disk_bytes:
+            filename = '%s_%s.npy' % (self._prefix(key), '_'.join('%d-%d' % b for b in bounds))
+            self._write(filename, lambda f: np.save(f, array))
+            self._evict_disk()
+
+    def _write(self, filename, write):
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            tmp = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+            with open(tmp, 'wb') as f:
+                write(f)
+            os.replace(tmp, filename)
+        except (IOError, OSError):
+            log.warning("could not store table slice in %s", filename)
+
+    def _evict_disk(self):
+        "remove the oldest slices past max_disk_bytes"
+        files = []
+        for filename in glob.glob(os.path.join(self.path, '*.npy')):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, filename))
+        total = sum(f[1] for f in files)
+        for _, size, filename in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(filename)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        "forget the slices and infos kept in memory"
+        with self.lock:
+            self.entries.clear()
+            self.infos.clear()
+            self.nbytes = 0
+
+
+def _contains(outer, inner):
+    return len(outer) == len(inner) and all(o[0] <= i[0] and i[1] <= o[1] for o, i in zip(outer, inner))
+
+def _subslice(outer, inner):
+    return tuple(slice(i[0] - o[0], i[1] - o[0]) for o, i in zip(outer, inner))
+
+def _filename_bounds(filename):
+    try:
+        ranges = os.path.basename(filename)[:-4].split('_')[1:]
+        return tuple(tuple(int(v) for v in r.split('-')) for r in ranges)
+    except ValueError:
+        return None
+
+
+class FeatureCache(object):
+    """Rows of feature service results keyed by feature, its version and resource
+
+    A key is (feature name, version, image, mask, gobject, ts) where version
+    is the feature length (or any value changing with the feature) and ts the
+    ts of the resources.  Each entry is the pair of rows of the values and
+    status tables of the result.  Entries are kept in memory (least recently
+    used are dropped past max_entries) and, when path is set and ts is known,
+    stored in an sqlite database in path shared by later processes.
+    """
+    def __init__(self, path=None, max_entries=1000000):
+        """
+            @param path: directory of the persistent cache (default: memory only)
+            @param max_entries: number of results kept in memory
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name, version, resource, ts=None):
+        "cache key of resource (image, mask, gobject) of feature name"
+        image, mask, gobject = resource
+        return (name, str(version), image or '', mask or '', gobject or '', ts or '')
+
+    def version(self, name, fetch):
+        "the version of feature name, calling fetch() the first time"
+        with self.lock:
+            version = self.versions.get(name)
+        if version is None:
+            version = fetch()
+            with self.lock:
+                self.versions[name] = version
+        return version
+
+    def _connect(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        db = sqlite3.connect(os.path.join(self.path, 'features.sqlite'), timeout=60)
+        db.execute('CREATE TABLE IF NOT EXISTS features (key TEXT PRIMARY KEY, '
+                   'values_dtype TEXT, value BLOB, status_dtype TEXT, status BLOB)')
+        return db
+
+    def get_many(self, keys):
+        """the cached (values row, status row) of keys
+
+        @return: a dict {key: (values row, status row)} of the keys found
+        """
+        found = {}
+        with self.lock:
+            for key in keys:
+                rows = self.entries.get(key)
+                if rows is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = rows
+        missing = [ k for k in keys if k not in found and k[-1] ]
+        if self.path and missing:
+            try:
+                db = self._connect()
+                try:
+                    for key in set(missing):
+                        row = db.execute('SELECT values_dtype, value, status_dtype, status FROM features WHERE key=?',
+                                         (repr(key),)).fetchone()
+                        if row is not None:
+                            found[key] = (_record(row[0], row[1]), _record(row[2], row[3]))
+                            self._remember(key, found[key])
+                finally:
+                    db.close()
+            except (sqlite3.Error, OSError) as e:
+                log.warning("could not read feature cache in %s: %s", self.path, e)
+        return found
+
+    def put_many(self, items):
+        """cache the (values row, status row) of [(key, (values row, status row))]"""
+        items = [ (k, (v.copy(), s.copy())) for k, (v, s) in items ]
+        for key, rows in items:
+            self._remember(key, rows)
+        items = [ (k, rows) for k, rows in items if k[-1] ]
+        if self.path and items:
+            try:
+                db = self._connect()
+                try:
+                    with db:
+                        db.executemany('INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?)',
+                                       [ (repr(k), _descr(v), v.tobytes(), _descr(s), s.tobytes()) for k, (v, s) in items ])
+                finally:
+                    db.close()
+            except (sqlite3.Error, OSError) as e:
+                log.warning("could not store features in %s: %s", self.path, e)
+
+    def _remember(self, key, rows):
+        with self.lock:
+            self.entries[key] = rows
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        "forget the results and versions kept in memory"
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+
+def _descr(record):
+    return repr(np.lib.format.dtype_to_descr(record.dtype))
+
+def _record(descr, data):
+    return np.frombuffer(data, dtype=np.dtype(ast.literal_eval(descr)))[0].copy()
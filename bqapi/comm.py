@@ -54,6 +54,7 @@ DESCRIPTION
 
 import os
 import sys
+import json
 #import urlparse
 #import urllib
 import logging
@@ -83,7 +84,8 @@ try:
 except ImportError:
     import xml.etree.ElementTree as etree
 
-from .types import BQMex, BQNode, BQFactory
+from .types import get_backend
+from .xmldict import DictElement
 from .util import d2xml #parse_qs, make_qs, xml2d, d2xml, normalize_unicode
 from .services import ServiceFactory
 from .exception import BQCommError, BQApiError
@@ -297,7 +299,11 @@ class BQSession(object):
     """
         Top level Bisque communication object
     """
-    def __init__(self):
+    def __init__(self, backend=None):
+        """
+            @param backend: object model of loaded resources 'bqclass' or 'bqnode'
+            (default from the BQAPI_BACKEND environment variable, see bqapi.types)
+        """
         self.c = BQServer()
         self.mex = None
         self.services  = {}
@@ -305,15 +311,28 @@ class BQSession(object):
         self.dirty = set()
         self.deleted = set()
         self.bisque_root = None
-        self.factory = BQFactory(self)
+        self.backend = get_backend(backend)
+        self.factory = self.backend.BQFactory(self)
         self.dryrun = False
+        # post BQ objects as a chunked request body written while it is sent
+        # (the server must accept chunked transfer encoding)
+        self.stream_xml = False
+        # 'json' requests documents of fetchxml, load and query with format=json,
+        # servers answering xml or rejecting the format are read as xml. This is
+        # not a client cpu optimisation: lxml decodes xml faster than json is
+        # turned into BQ objects (see benchmarks/bench_wire_format.py)
+        self.wire_format = 'xml'
+        # a bqapi.cache.TableSliceCache serving repeated table slices (see TableProxy.load_array)
+        self.table_cache = None
+        # a bqapi.cache.FeatureCache serving features already computed (see Feature.fetch)
+        self.feature_cache = None
 
 
     ############################
     # Establish a bisque session
     ############################
     def _create_mex (self, user, moduleuri):
-        mex = BQMex()
+        mex = self.backend.BQMex()
         mex.name = moduleuri or 'script:%s' % " ".join (sys.argv)
         mex.status = 'RUNNING'
         self.mex = self.save(mex, url=self.service_url('module_service', 'mex'))
@@ -574,6 +593,9 @@ class BQSession(object):
 
             @return xml etree
         """
+        if path is None and self.wire_format == 'json':
+            doc = self.fetchdoc(url, **params)
+            return doc.etree() if isinstance(doc, DictElement) else doc
         url = self.c.prepare_url(url, **params)
         log.debug('fetchxml %s ' % url)
         if path:
@@ -583,12 +605,46 @@ class BQSession(object):
             return self.factory.string2etree(r)
 
 
+    def fetchdoc(self, url, **params):
+        """
+            Fetch a document in the session wire format (see wire_format)
+
+            @param: url - A url to fetch from
+            @param: params - params will be added to url
+
+            @return a DictElement of the json document (xml2d layout with text
+            under '__text__') or an xml etree when the server answered xml
+        """
+        if self.wire_format != 'json':
+            return self.fetchxml(url, **params)
+        xmlurl = self.c.prepare_url(url, **params)
+        params.setdefault('format', 'json')
+        url = self.c.prepare_url(url, **params)
+        log.debug('fetchdoc %s ', url)
+        try:
+            r = self.c.fetch(url, headers={'Accept':'application/json, text/xml;q=0.9'})
+        except BQCommError as ce:
+            if ce.response.status_code in (401, 403, 404):
+                raise
+            # servers without json support may reject the format
+            log.warning('fetchdoc %s failed with %s, retrying as xml', url, ce.response.status_code)
+            r = self.c.fetch(xmlurl, headers={'Content-Type':'text/xml', 'Accept':'text/xml'})
+        if r.lstrip()[:1] == b'{':
+            return DictElement.fromdict(json.loads(r))
+        return self.factory.string2etree(r)
+
+    def _from_doc(self, doc):
+        "BQ object of a document returned by fetchdoc"
+        if isinstance(doc, DictElement):
+            return self.factory.from_dict({ doc.tag : doc.d })
+        return self.factory.from_etree(doc)
+
     def postxml(self, url, xml, path=None, method="POST", **params):
         """
             Post xml allowed with files to bisque
 
             @param: url - the url to make to the request
-            @param: xml - an xml document that is post at the url location (excepts either string or etree._Element)
+            @param: xml - an xml document that is post at the url location (excepts either string, etree._Element or BQ object)
             @param: path - a location on the file system were one wishes the response to be stored (default: None)
             @param method - the method of the http request (HEAD,GET,POST,PUT,DELETE,...) (default: POST)
             @param: odict - ordered dictionary of params will be added to url for when the order matters
@@ -598,9 +654,13 @@ class BQSession(object):
         """
 
         if not isinstance(xml, str):
-            xml = self.factory.to_string (xml)
+            to_chunks = getattr(self.factory, 'to_chunks', None)
+            if self.stream_xml and to_chunks is not None and isinstance(xml, self.backend.BQNode):
+                xml = to_chunks(xml)
+            else:
+                xml = self.factory.to_string (xml)
 
-        log.debug('postxml %s  content %s ' % (url, xml))
+        log.debug('postxml %s  content %s ', url, xml)
 
         url = self.c.prepare_url(url, **params)
 
@@ -721,8 +781,8 @@ class BQSession(object):
             for  tg in elems:
                 if isinstance(tg, dict):
                     tg = d2xml({ type_ : tg})
-                elif isinstance(tg, BQNode):
-                    tg = BQFactory.to_etree(tg)
+                elif isinstance(tg, self.backend.BQNode):
+                    tg = self.factory.to_etree(tg)
                 elif isinstance(tg, etree._Element):
                     pass
                 else:
@@ -760,7 +820,7 @@ class BQSession(object):
             for  tg in elems:
                 if isinstance(tg, dict):
                     tg = d2xml({ type_ : tg})
-                elif isinstance(tg, BQNode):
+                elif isinstance(tg, self.backend.BQNode):
                     tg = self.factory.to_etree(tg)
                 elif isinstance(tg, etree._Element): #pylint: disable=protected-access
                     pass
@@ -857,9 +917,9 @@ class BQSession(object):
         """
         results = []
         queryurl = self.service_url ('data_service', path=resource_type, query=kw)
-        items = self.fetchxml (queryurl)
+        items = self.fetchdoc (queryurl)
         for item in items:
-            results.append (self.factory.from_etree(item))
+            results.append (self._from_doc(item))
         return results
 
 
@@ -874,10 +934,10 @@ class BQSession(object):
         #if view not in url:
         #    url = url + "?view=%s" % view
         try:
-            xml = self.fetchxml(url, **params)
+            xml = self.fetchdoc(url, **params)
             if xml.tag == "response":
-                xml = xml[0]
-            bqo = self.factory.from_etree(xml)
+                xml = next(iter(xml))
+            bqo = self._from_doc(xml)
             return bqo
         except BQCommError as ce:
             log.exception('communication issue while loading %s' % ce)
@@ -910,8 +970,7 @@ class BQSession(object):
             if url is None:
                 url = self.service_url ('data_service')
 
-            xml =  self.factory.to_etree(bqo)
-            xml = self.postxml(url, xml, **kw)
+            xml = self.postxml(url, bqo, **kw)
             return xml is not None and self.factory.from_etree(xml)
         except BQCommError as ce:
             log.exception('communication issue while saving %s' , ce)
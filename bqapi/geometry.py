@@ -0,0 +1,364 @@
+"""
+Batch geometry over the gobjects of a resource
+
+Measures every gobject nested in a resource in one pass. Gobjects are
+grouped by primitive type and each group is measured with vectorized
+numpy operations over the concatenated vertices of the group.
+
+    >>> from bqapi.geometry import measure_gobjects
+    >>> columns = measure_gobjects(image)
+    >>> df = pandas.DataFrame(columns)
+
+Only 2D measures are computed (x and y), as in the gobject classes.
+"""
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+log = logging.getLogger('bqapi.geometry')
+
+__all__ = [ 'iter_gobjects', 'measure_gobjects', 'MEASURES', 'GObjectIndex' ]
+
+MEASURES = ('area', 'perimeter', 'centroid_x', 'centroid_y', 'xmin', 'ymin', 'xmax', 'ymax')
+
+
+def iter_gobjects(resource):
+    """Iterate over all gobjects nested in resource in document order
+
+    @param resource: a BQResource
+    @return: generator of BQGObject
+    """
+    stack = list(reversed(resource.iterkids('gobjects')))
+    while stack:
+        gob = stack.pop()
+        yield gob
+        stack.extend(reversed(gob.iterkids('gobjects')))
+
+
+def measure_gobjects(resource):
+    """Measure all gobjects nested in resource
+
+    @param resource: a BQResource
+    @return: OrderedDict of equal length columns (numpy arrays): uri, name,
+    type, vertices (count) and the MEASURES. A measure is NaN when it is not
+    defined for the primitive (i.e. area of a polyline) or the gobject does
+    not have enough vertices.
+    """
+    return _measure(list(iter_gobjects(resource)))
+
+
+def _measure(gobs):
+    n = len(gobs)
+    columns = OrderedDict()
+    columns['uri'] = np.array([ g.uri for g in gobs ], dtype=object)
+    columns['name'] = np.array([ g.name for g in gobs ], dtype=object)
+    columns['type'] = np.array([ g.xmltag for g in gobs ], dtype=object)
+    columns['vertices'] = np.zeros(n, dtype=np.int64)
+    for m in MEASURES:
+        columns[m] = np.full(n, np.nan)
+
+    groups = OrderedDict()
+    for row, gob in enumerate(gobs):
+        groups.setdefault(gob.xmltag, []).append(row)
+
+    for kind, rows in groups.items():
+        measurer, min_vertices = MEASURERS.get(kind, (_measure_points, 1))
+        coords = [ gobs[r].verticesAsArray()[:, :2] for r in rows ]
+        counts = np.array([ len(c) for c in coords ], dtype=np.int64)
+        rows = np.array(rows, dtype=np.int64)
+        columns['vertices'][rows] = counts
+        valid = counts >= min_vertices
+        if not valid.any():
+            continue
+        xy = np.concatenate([ c for c, ok in zip(coords, valid) if ok ])
+        log.debug('measuring %s %s gobjects (%s vertices)', valid.sum(), kind, len(xy))
+        for m, values in measurer(xy, counts[valid]).items():
+            columns[m][rows[valid]] = values
+    return columns
+
+
+################################################################################
+# Vectorized measures: xy is the concatenated (M, 2) vertex array of a group
+# and counts the number of vertices of each gobject in the group
+################################################################################
+
+def _vertex_ids(counts):
+    "first vertex offset of every gobject and gobject id of every vertex"
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ids = np.repeat(np.arange(len(counts)), counts)
+    return starts, ids
+
+def _next_vertex(counts, starts, closed):
+    "index of the following vertex along the outline of each gobject"
+    nxt = np.arange(counts.sum()) + 1
+    ends = starts + counts - 1
+    # open outlines end with a zero length segment
+    nxt[ends] = starts if closed else ends
+    return nxt
+
+def _measure_points(xy, counts):
+    starts, ids = _vertex_ids(counts)
+    n = len(counts)
+    x, y = xy.T
+    return {
+        'centroid_x' : np.bincount(ids, x, n) / counts,
+        'centroid_y' : np.bincount(ids, y, n) / counts,
+        'xmin' : np.minimum.reduceat(x, starts),
+        'ymin' : np.minimum.reduceat(y, starts),
+        'xmax' : np.maximum.reduceat(x, starts),
+        'ymax' : np.maximum.reduceat(y, starts),
+    }
+
+def _measure_polyline(xy, counts):
+    starts, ids = _vertex_ids(counts)
+    nxt = _next_vertex(counts, starts, closed=False)
+    x, y = xy.T
+    m = _measure_points(xy, counts)
+    m['perimeter'] = np.bincount(ids, np.hypot(x[nxt]-x, y[nxt]-y), len(counts))
+    return m
+
+def _measure_polygon(xy, counts):
+    starts, ids = _vertex_ids(counts)
+    nxt = _next_vertex(counts, starts, closed=True)
+    n = len(counts)
+    x, y = xy.T
+    xn, yn = x[nxt], y[nxt]
+    cross = x*yn - xn*y
+    signed = 0.5 * np.bincount(ids, cross, n)
+    m = _measure_points(xy, counts)
+    m['area'] = np.abs(signed)
+    m['perimeter'] = np.bincount(ids, np.hypot(xn-x, yn-y), n)
+    # area weighted centroid, degenerate polygons keep the vertex mean
+    nonzero = signed != 0
+    for c, v, vn in (('centroid_x', x, xn), ('centroid_y', y, yn)):
+        moment = np.bincount(ids, (v+vn)*cross, n)
+        m[c] = np.where(nonzero, moment / np.where(nonzero, 6.0*signed, 1.0), m[c])
+    return m
+
+def _measure_circle(xy, counts):
+    starts, _ = _vertex_ids(counts)
+    (x1, y1), (x2, y2) = xy[starts].T, xy[starts+1].T
+    r = np.maximum(np.abs(x1-x2), np.abs(y1-y2))
+    return {
+        'area' : np.pi * r * r,
+        'perimeter' : 2.0 * np.pi * r,
+        'centroid_x' : x1,
+        'centroid_y' : y1,
+        'xmin' : x1 - r,
+        'ymin' : y1 - r,
+        'xmax' : x1 + r,
+        'ymax' : y1 + r,
+    }
+
+def _measure_ellipse(xy, counts):
+    starts, _ = _vertex_ids(counts)
+    (x1, y1), (x2, y2), (x3, y3) = xy[starts].T, xy[starts+1].T, xy[starts+2].T
+    a = np.maximum(np.abs(x1-x2), np.abs(y1-y2))
+    b = np.maximum(np.abs(x1-x3), np.abs(y1-y3))
+    w = np.hypot(x2-x1, x3-x1)
+    h = np.hypot(y2-y1, y3-y1)
+    return {
+        'area' : np.pi * a * b,
+        'perimeter' : np.pi * ( 3.0*(a+b) - np.sqrt( 10.0*a*b + 3.0*(a*a + b*b)) ),
+        'centroid_x' : x1,
+        'centroid_y' : y1,
+        'xmin' : x1 - w,
+        'ymin' : y1 - h,
+        'xmax' : x1 + w,
+        'ymax' : y1 + h,
+    }
+
+def _measure_rectangle(xy, counts):
+    starts, _ = _vertex_ids(counts)
+    (x1, y1), (x2, y2) = xy[starts].T, xy[starts+1].T
+    dx, dy = np.abs(x1-x2), np.abs(y1-y2)
+    return {
+        'area' : dx * dy,
+        'perimeter' : 2.0*dx + 2.0*dy,
+        'centroid_x' : (x1+x2) / 2.0,
+        'centroid_y' : (y1+y2) / 2.0,
+        'xmin' : np.minimum(x1, x2),
+        'ymin' : np.minimum(y1, y2),
+        'xmax' : np.maximum(x1, x2),
+        'ymax' : np.maximum(y1, y2),
+    }
+
+# primitive -> (measurer, minimum vertex count)
+MEASURERS = {
+    'point' : (_measure_points, 1),
+    'label' : (_measure_points, 1),
+    'polyline' : (_measure_polyline, 1),
+    'line' : (_measure_polyline, 1),
+    'polygon' : (_measure_polygon, 1),
+    'circle' : (_measure_circle, 2),
+    'ellipse' : (_measure_ellipse, 3),
+    'rectangle' : (_measure_rectangle, 2),
+    'square' : (_measure_rectangle, 2),
+}
+
+
+################################################################################
+# Spatial index
+################################################################################
+
+class GObjectIndex(object):
+    """Grid index over the bounding boxes of the gobjects nested in a resource
+
+    The bounds of all gobjects are computed in one measure_gobjects pass and
+    each gobject is registered in every grid cell its bounding box overlaps.
+    Cells are stored as a sorted (CSR) array so a query only gathers slices
+    of the cells it touches before an exact vectorized bounds test.
+
+    Use BQResource.spatialIndex() to get an index that is built on first use
+    and dropped when gobjects are added with addGObject.
+    """
+
+    def __init__(self, resource, cells=None):
+        """
+            @param resource: a BQResource
+            @param cells: number of cells along each axis (default: sqrt of gobject count)
+        """
+        gobs = list(iter_gobjects(resource))
+        columns = _measure(gobs)
+        valid = ~np.isnan(columns['xmin'])
+        self.gobjects = [ g for g, ok in zip(gobs, valid) if ok ]
+        self.types = columns['type'][valid]
+        self.bounds = np.column_stack([ columns[m][valid] for m in ('xmin', 'ymin', 'xmax', 'ymax') ])
+        self.centroids = np.column_stack([ columns['centroid_x'][valid], columns['centroid_y'][valid] ])
+        self._build(cells)
+
+    def __len__(self):
+        return len(self.gobjects)
+
+    def _build(self, cells):
+        n = len(self.gobjects)
+        if n == 0:
+            self.origin, self.cell_size, self.shape = (0.0, 0.0), 1.0, (1, 1)
+            self.items = np.zeros(0, dtype=np.int64)
+            self.cell_start = np.zeros(2, dtype=np.int64)
+            return
+        cells = cells or max(1, int(np.sqrt(n)))
+        xmin, ymin = self.bounds[:, 0].min(), self.bounds[:, 1].min()
+        xmax, ymax = self.bounds[:, 2].max(), self.bounds[:, 3].max()
+        self.origin = (xmin, ymin)
+        self.cell_size = max(xmax - xmin, ymax - ymin) / cells or 1.0
+        nx = int((xmax - xmin) / self.cell_size) + 1
+        ny = int((ymax - ymin) / self.cell_size) + 1
+        self.shape = (nx, ny)
+
+        cx0, cy0 = self._cell(self.bounds[:, 0], self.bounds[:, 1])
+        cx1, cy1 = self._cell(self.bounds[:, 2], self.bounds[:, 3])
+        w, h = cx1 - cx0 + 1, cy1 - cy0 + 1
+        count = w * h
+        # one entry per (gobject, covered cell)
+        obj = np.repeat(np.arange(n), count)
+        k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        cell = (cy0[obj] + k // w[obj]) * nx + cx0[obj] + k % w[obj]
+        order = np.argsort(cell, kind='stable')
+        self.items = obj[order]
+        self.cell_start = np.searchsorted(cell[order], np.arange(nx * ny + 1))
+        log.debug('gobject index: %s gobjects in %sx%s cells (%s entries)', n, nx, ny, len(obj))
+
+    def _cell(self, x, y):
+        "grid cell of coordinates, clipped to the grid"
+        nx, ny = self.shape
+        cx = np.clip(np.floor((np.asarray(x) - self.origin[0]) / self.cell_size), 0, nx - 1).astype(np.int64)
+        cy = np.clip(np.floor((np.asarray(y) - self.origin[1]) / self.cell_size), 0, ny - 1).astype(np.int64)
+        return cx, cy
+
+    def _gather(self, cx0, cy0, cx1, cy1):
+        "candidate ids registered in the cells of a (clipped) cell range"
+        nx, ny = self.shape
+        cx0, cx1 = max(cx0, 0), min(cx1, nx - 1)
+        cy0, cy1 = max(cy0, 0), min(cy1, ny - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.zeros(0, dtype=np.int64)
+        rows = [ self.items[self.cell_start[cy*nx + cx0]:self.cell_start[cy*nx + cx1 + 1]] for cy in range(cy0, cy1 + 1) ]
+        return np.unique(np.concatenate(rows))
+
+    def _window_ids(self, xmin, ymin, xmax, ymax):
+        if not len(self.gobjects):
+            return np.zeros(0, dtype=np.int64)
+        cx0, cy0 = self._cell(xmin, ymin)
+        cx1, cy1 = self._cell(xmax, ymax)
+        ids = self._gather(int(cx0), int(cy0), int(cx1), int(cy1))
+        b = self.bounds[ids]
+        hit = (b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+        return ids[hit]
+
+    def window(self, xmin, ymin, xmax, ymax):
+        """Gobjects whose bounding box intersects the window
+
+        @return: list of BQGObject in document order
+        """
+        return [ self.gobjects[i] for i in self._window_ids(xmin, ymin, xmax, ymax) ]
+
+    def contains(self, x, y):
+        """Gobjects whose area contains the point (x, y)
+
+        Polygons, circles, ellipses, rectangles and squares are tested
+        exactly, other primitives have no area and are never returned.
+
+        @return: list of BQGObject in document order
+        """
+        return [ self.gobjects[i] for i in self._window_ids(x, y, x, y) if self._inside(i, x, y) ]
+
+    def _inside(self, i, x, y):
+        kind = self.types[i]
+        if kind in ('rectangle', 'square'):
+            return True  # the bounds are the rectangle
+        cx, cy = self.centroids[i]
+        if kind == 'circle':
+            r = (self.bounds[i, 2] - self.bounds[i, 0]) / 2.0
+            return np.hypot(x - cx, y - cy) <= r
+        if kind == 'ellipse':
+            (x1, y1), (x2, y2), (x3, y3) = self.gobjects[i].verticesAsArray()[:3, :2]
+            a = max(abs(x1-x2), abs(y1-y2))
+            b = max(abs(x1-x3), abs(y1-y3))
+            return a > 0 and b > 0 and ((x-x1)/a)**2 + ((y-y1)/b)**2 <= 1.0
+        if kind == 'polygon':
+            px, py = self.gobjects[i].verticesAsArray()[:, :2].T
+            qx, qy = np.roll(px, -1), np.roll(py, -1)
+            # ray casting: count edges crossing the horizontal ray to the right of the point
+            crosses = (py > y) != (qy > y)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                xs = px + (y - py) * (qx - px) / (qy - py)
+            return bool(np.count_nonzero(crosses & (x < xs)) % 2)
+        return False
+
+    def nearest(self, x, y, k=1):
+        """The k gobjects closest to the point (x, y)
+
+        Distance is measured to the bounding box (0 inside the box). The grid
+        is searched in growing rings of cells around the point until no
+        unvisited cell can hold a closer gobject.
+
+        @return: list of (distance, BQGObject) sorted by distance
+        """
+        n = len(self.gobjects)
+        if n == 0 or k < 1:
+            return []
+        nx, ny = self.shape
+        px, py = [ int(c) for c in self._cell(x, y) ]
+        seen = np.zeros(0, dtype=np.int64)
+        for r in range(max(nx, ny) + 1):
+            ring = [ self._gather(px - r, py - r, px + r, py - r),
+                     self._gather(px - r, py + r, px + r, py + r),
+                     self._gather(px - r, py - r + 1, px - r, py + r - 1),
+                     self._gather(px + r, py - r + 1, px + r, py + r - 1) ]
+            seen = np.union1d(seen, np.concatenate(ring))
+            if len(seen) >= min(k, n):
+                dist = self._distance(seen, x, y)
+                # unvisited cells are at least r cells away
+                if np.partition(dist, min(k, len(seen)) - 1)[min(k, len(seen)) - 1] <= r * self.cell_size:
+                    break
+        dist = self._distance(seen, x, y)
+        order = np.argsort(dist, kind='stable')[:k]
+        return [ (float(dist[j]), self.gobjects[seen[j]]) for j in order ]
+
+    def _distance(self, ids, x, y):
+        b = self.bounds[ids]
+        dx = np.maximum(np.maximum(b[:, 0] - x, 0), x - b[:, 2])
+        dy = np.maximum(np.maximum(b[:, 1] - y, 0), y - b[:, 3])
+        return np.hypot(dx, dy)
@@ -1,13 +1,14 @@
 import os
+import io
 #import urllib
 #import urlparse
 
 import random
 import string
 import logging
-import tempfile
 import json
 import shutil
+import threading
 
 from six.moves import urllib
 
@@ -20,10 +21,19 @@ try:
     import tables
 except ImportError:
     logging.warn ("pytables services not available")
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
 
 from requests_toolbelt import MultipartEncoder
-from .util import  normalize_unicode
-from .exception import BQCommError
+from concurrent.futures import ThreadPoolExecutor
+from .util import  normalize_unicode, ordered_map, create_output
+from .exception import BQCommError, BQApiError
 
 
 
@@ -239,13 +249,18 @@ class ModuleProxy (BaseServiceProxy):
 
 
 
+# pytables (and hdf5) calls are not thread safe
+HDF_LOCK = threading.Lock()
+
 class TableProxy (BaseServiceProxy):
-    def load_array(self, table_uniq, path, slices=[]):
-        """
-        Load array from BisQue.
-        """
+    def _path(self, table_uniq, path):
         if table_uniq.startswith('http'):
             table_uniq = table_uniq.split('/')[-1]
+        return '/'.join([table_uniq.strip('/'), path.strip('/')])
+
+    @staticmethod
+    def _slice_list(slices):
+        "service ranges 'start;last' of python slices or indices"
         slice_list = []
         for single_slice in slices:
             if isinstance(single_slice, slice):
@@ -254,45 +269,211 @@ class TableProxy (BaseServiceProxy):
                 slice_list.append("%s;%s" % (single_slice, single_slice))
             else:
                 raise BQCommError("malformed slice parameter")
-        path = '/'.join([table_uniq.strip('/'), path.strip('/')])
+        return slice_list
+
+    def _info(self, path, ts=None):
+        "the info document of the array at path (sizes of its dimensions ...)"
+        cache = self.session.table_cache
+        info = cache and cache.get_info((path, ts or ''))
+        if info is not None:
+            return info
         info_url = '/'.join([path, 'info', 'format:json'])
         response = self.get(info_url)
         try:
-            num_dims = len(json.loads(response.content).get('sizes'))
+            info = json.loads(response.content)
         except ValueError:
             raise BQCommError('array could not be read')
-        # fill slices with missing dims
-        for _ in range(num_dims-len(slice_list)):
-            slice_list.append(';')
+        if cache is not None:
+            cache.put_info((path, ts or ''), info)
+        return info
+
+    def _fetch(self, path, slice_list, out=None):
+        "fetch the ranges of slice_list of the array at path, into out when given"
         data_url = '/'.join([path, ','.join(slice_list), 'format:hdf'])
         response = self.get(data_url)
         # convert HDF5 to Numpy array (preserve indices??)
-        with tables.open_file('array.h5', driver="H5FD_CORE", driver_core_image=response.content, driver_core_backing_store=0) as h5file:
-            return h5file.root.array.read()
+        with HDF_LOCK, tables.open_file('array.h5', driver="H5FD_CORE", driver_core_image=response.content, driver_core_backing_store=0) as h5file:
+            array = h5file.root.array
+            if out is None or out.dtype != array.dtype or not out.flags.c_contiguous:
+                data = array.read()
+                if out is None:
+                    return data
+                out[...] = data
+                return out
+            return array.read(out=out)
+
+    def _blocks(self, path, slices, rows, ts=None):
+        """split the first dimension of slices in blocks of rows
+
+        @return: the info document and a list of (start, stop, slice_list) of the blocks,
+        empty for an empty range of rows
+        """
+        info = self._info(path, ts)
+        sizes = info.get('sizes')
+        if sizes is None:
+            raise BQCommError('array could not be read')
+        slice_list = self._slice_list(slices)
+        # fill slices with missing dims
+        for _ in range(len(sizes)-len(slice_list)):
+            slice_list.append(';')
+        first = slices[0] if slices else slice(None)
+        if isinstance(first, slice):
+            start, stop, _ = first.indices(sizes[0])
+            if start >= stop:
+                return info, []
+        if rows is None or not isinstance(first, slice):
+            return info, [ (0, None, slice_list) ]
+        return info, [ (a, min(a+rows, stop), ["%s;%s" % (a, min(a+rows, stop)-1)] + slice_list[1:])
+                       for a in range(start, stop, rows) ]
+
+    def iter_array(self, table_uniq, path, slices=[], rows=1024*1024, workers=4):
+        """
+        Iterate over an array of BisQue in blocks of rows, fetched concurrently
 
-    def store_array(self, array, name):
+        @param slices: slices or indices of the array dimensions (default: all)
+        @param rows: number of rows (first dimension) of the blocks
+        @param workers: number of concurrent block requests
+        @return: a generator of numpy arrays in row order
+        """
+        path = self._path(table_uniq, path)
+        _, blocks = self._blocks(path, slices, rows)
+        return ordered_map(lambda block: self._fetch(path, block[2]), blocks, workers=workers)
+
+    def iter_table(self, table_uniq, path, columns=None, start=None, stop=None, rows=100000, workers=4, dataframe=True):
+        """
+        Iterate over the selected columns of a table of BisQue in blocks of rows
+
+        The table schema (info) is fetched once, then each block requests only
+        the ranges of the selected columns.
+
+        @param columns: names (from the table headers) or indices of the columns (default: all)
+        @param start, stop: the range of rows (default: all)
+        @param rows: number of rows of the blocks
+        @param workers: number of concurrent block requests
+        @param dataframe: yield pandas DataFrames, else numpy structured arrays
+        @return: a generator of the blocks in row order
+        """
+        if dataframe and pd is None:
+            raise BQApiError("pandas is required for dataframe blocks")
+        path = self._path(table_uniq, path)
+        info, blocks = self._blocks(path, [slice(start, stop)], rows)
+        headers = info.get('headers') or [ 'c%d' % i for i in range(info['sizes'][1]) ]
+        if columns is None:
+            columns = list(range(len(headers)))
+        columns = [ headers.index(c) if isinstance(c, str) else c for c in columns ]
+        # contiguous ranges of the selected columns
+        runs = []
+        for c in sorted(set(columns)):
+            if runs and runs[-1][1] == c - 1:
+                runs[-1][1] = c
+            else:
+                runs.append([c, c])
+
+        def fetch_block(block):
+            data = {}
+            for first, last in runs:
+                part = self._fetch(path, block[2][:1] + ["%s;%s" % (first, last)] + block[2][2:])
+                for k, c in enumerate(range(first, last+1)):
+                    data[c] = part[part.dtype.names[k]] if part.dtype.names else part[:, k]
+            names = [ headers[c] for c in columns ]
+            if dataframe:
+                return pd.DataFrame(dict((name, data[c]) for name, c in zip(names, columns)), columns=names)
+            records = np.empty(len(data[columns[0]]), dtype=[ (name, data[c].dtype) for name, c in zip(names, columns) ])
+            for name, c in zip(names, columns):
+                records[name] = data[c]
+            return records
+
+        return ordered_map(fetch_block, blocks, workers=workers)
+
+    def load_array(self, table_uniq, path, slices=[], rows=None, workers=4, out=None, ts=None):
+        """
+        Load array from BisQue.
+
+        Slices are served from the session table_cache when set.
+
+        @param slices: slices or indices of the array dimensions (default: all)
+        @param rows: fetch the array in concurrent requests of rows rows (default: a single request)
+        @param workers: number of concurrent block requests
+        @param out: the array filled with the blocks, an ndarray, 'memmap' or a filename
+        for a np.memmap (default: a new ndarray)
+        @param ts: ts of the table resource, slices of tables with a ts are kept in the disk cache
+        """
+        path = self._path(table_uniq, path)
+        info, blocks = self._blocks(path, slices, rows, ts)
+        if not blocks:
+            return self._empty(path, info, slices, out)
+        cache = self.session.table_cache
+        if cache is not None:
+            key = (path, ts or '')
+            bounds = cache.bounds(slices, info['sizes'])
+            cached = bounds and cache.get(key, bounds)
+            if cached is not None:
+                if out is None:
+                    return cached
+                array = create_output(out, cached.shape, cached.dtype)
+                array[...] = cached
+                return array
+            array = self._load_blocks(path, blocks, workers, out)
+            if bounds and array.shape == tuple(b[1] - b[0] for b in bounds):
+                cache.put(key, bounds, array)
+            return array
+        return self._load_blocks(path, blocks, workers, out)
+
+    def _empty(self, path, info, slices, out):
+        "the empty array of an empty range of rows"
+        sizes = info['sizes']
+        slice_list = self._slice_list(slices[1:])
+        slice_list += [';'] * (len(sizes)-1-len(slice_list))
+        if not sizes[0]:
+            return create_output(out, [0] + sizes[1:], 'float64')
+        # no row is selected: the type and the other dimensions are the ones of the first row
+        row = self._fetch(path, ['0;0'] + slice_list)
+        return create_output(out, (0,) + row.shape[1:], row.dtype)
+
+    def _load_blocks(self, path, blocks, workers, out):
+        # the first block gives the type and the shape of the rows
+        first = self._fetch(path, blocks[0][2])
+        if len(blocks) == 1 and out is None:
+            return first
+        start, stop = blocks[0][0], blocks[-1][1]
+        if stop is None:
+            stop = start + len(first)
+        array = create_output(out, (stop-start,) + first.shape[1:], first.dtype)
+        array[:len(first)] = first
+        first = None
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(lambda block: self._fetch(path, block[2], out=array[block[0]-start:block[1]-start]), blocks[1:]):
+                pass
+        return array
+
+    def store_array(self, array, name, complevel=5, complib='zlib'):
         """
         Store numpy array in BisQue and return resource doc.
+
+        The HDF5 file is built in memory and uploaded from there.
+
+        @param complevel: compression level 0-9 of the array (0 for none)
+        @param complib: compression library of pytables (zlib, blosc, lzo, bzip2 ..)
         """
-        try:
-            dirpath = tempfile.mkdtemp()
-            # (1) store array as HDF5 file
-            out_file = os.path.join(dirpath, "%s.h5" % name)   # importer needs extension .h5
-            with tables.open_file(out_file, "w", filters = tables.Filters(complevel=5)) as h5file:  # compression level 5
-                h5file.create_array(h5file.root, name, array)
-            # (2) call bisque importer with file
-            importer = self.session.service('import')
-            response = importer.transfer(out_file)
-            # (3) return resource xml
-            res = etree.fromstring (response.content)
-            if res.tag != 'resource' or res.get('type') != 'uploaded':
-                raise BQCommError('array could not be stored')
+        # (1) store array as HDF5 file image
+        with HDF_LOCK, tables.open_file("%s.h5" % name, "w", driver="H5FD_CORE", driver_core_backing_store=0,
+                                        filters = tables.Filters(complevel=complevel, complib=complib)) as h5file:
+            if complevel:
+                # only chunked arrays are compressed
+                h5file.create_carray(h5file.root, name, obj=array)
             else:
-                return res[0]
-        finally:
-            if os.path.isfile(out_file):
-                os.remove(out_file)
-            os.rmdir(dirpath)
+                h5file.create_array(h5file.root, name, array)
+            h5file.flush()
+            image = h5file.get_file_image()
+        # (2) call bisque importer with file
+        importer = self.session.service('import')
+        response = importer.transfer("%s.h5" % name, fileobj=io.BytesIO(image))   # importer needs extension .h5
+        # (3) return resource xml
+        res = etree.fromstring (response.content)
+        if res.tag != 'resource' or res.get('type') != 'uploaded':
+            raise BQCommError('array could not be stored')
+        else:
+            return res[0]
 
 
 class ImageProxy(BaseServiceProxy):
@@ -3,8 +3,6 @@
 import pytest
 from collections import OrderedDict, namedtuple
 
-from bq.util.bunch import Bunch
-from bq.util.mkdir import _mkdir
 from .util import  fetch_file
 from bqapi import BQServer
 
@@ -17,6 +15,9 @@ LocalFile = namedtuple('LocalFile', ['name', 'location'])
 
 @pytest.fixture(scope="module")
 def stores(config):
+    # bisque server utilities, only needed by the functional tests
+    from bq.util.bunch import Bunch
+    from bq.util.mkdir import _mkdir
     samples = config.store.samples_url
     inputs = config.store.input_dir
     results = config.store.results_dir
@@ -24,7 +25,7 @@ def stores(config):
 
     files = []
     for name in [ x.strip() for x in config.store.files.split() ]:
-        print "Fetching", name
+        print("Fetching", name)
         files.append (LocalFile (name, fetch_file(name, samples, inputs)))
 
     return Bunch(samples=samples, inputs=inputs, results=results, files=files)
@@ -19,7 +19,7 @@ def test_load (session):
     #bq = BQSession()
     #bq.init_local (user, passwd, bisque_root = host, create_mex = False)
     x = session.load ('/data_service/image/?limit=10')
-    print "loading /data_service/images->", BQFactory.to_string((x))
+    print("loading /data_service/images->", BQFactory.to_string((x)))
 
 
 def test_load_pixels(session):
@@ -30,4 +30,4 @@ def test_load_pixels(session):
     if len(x.kids):
         i0 = x.kids[0]
         pixels = i0.pixels().slice(z=1,t=1).fetch()
-        print len(pixels)
+        print(len(pixels))
@@ -1,7 +1,9 @@
+import io
 import pytest
 
 from lxml import etree
-from bqapi.bqclass import BQFactory
+from bqapi.bqclass import BQFactory, BQImage, BQTag, BQValue, BQVertex, iter_xml, model_fields
+from bqapi.cache import image_meta_cache
 
 pytestmark = pytest.mark.unit
 
@@ -19,16 +21,341 @@ X="""
 
 def test_conversion():
     'test simple xml conversions'
-    print "ORIGINAL"
-    print X
+    print ("ORIGINAL")
+    print (X)
 
     factory = BQFactory(None)
 
     r = factory.from_string(X)
-    print "PARSED"
+    print ("PARSED")
 
     x = factory.to_string (r)
 
-    print "XML"
-    print r
-    assert x == X.translate(None, '\r\n')
+    print ("XML")
+    print (r)
+    assert x == X.replace('\r', '').replace('\n', '').encode()
+
+
+def test_slotted_leaves():
+    'vertices and values do not carry an instance dict'
+    v = BQVertex(x=1, y=2, z=0, t=0)
+    assert not hasattr(v, '__dict__')
+    assert v.toTuple() == (1, 2, 0, 0)
+    assert not hasattr(BQValue('a'), '__dict__')
+
+
+def test_lazy_child_lists():
+    'leaf tags do not allocate child lists until used'
+    factory = BQFactory(None)
+    r = factory.from_string(X)
+    image = r.kids[0]
+    tag = image.find('filename')
+    assert tag._tags is None and tag._gobjects is None and tag._kids is None
+    assert tag.value == 'boo'
+    assert tag.tags == []
+    sub = tag.addTag(name='sub', value='1')
+    assert tag.tags == [sub]
+    assert BQTag(name='empty').values == []
+
+
+G="""
+<image uri="/is/1">
+<gobject type="polygon" name="p">
+<vertex x="0" y="0" index="0"/><vertex x="4" y="0" index="1"/><vertex x="4" y="3" index="2"/><vertex x="0" y="3" index="3"/>
+</gobject>
+<polyline><vertex x="0" y="0" index="0"/><vertex x="3" y="4" index="1"/></polyline>
+<circle><vertex x="1" y="1" index="0"/><vertex x="3" y="1" index="1"/></circle>
+</image>
+"""
+
+def test_vertex_array():
+    'gobjects parsed into vertex arrays measure the same as BQVertex lists'
+    pytest.importorskip('numpy')
+    plain = BQFactory(None).from_string(G)
+    array = BQFactory(None, vertex_array=True).from_string(G)
+    for gp, ga in zip(plain.gobjects, array.gobjects):
+        assert ga._coords is not None
+        assert gp.area() == ga.area()
+        assert gp.perimeter() == ga.perimeter()
+        assert gp.centroid() == ga.centroid()
+        assert gp.bbox() == ga.bbox()
+    polygon = array.gobjects[0]
+    assert polygon.area() == 12.0 and polygon.perimeter() == 14.0
+    assert polygon.centroid() == (2.0, 1.5)
+    assert polygon.bbox() == (0.0, 0.0, 4.0, 3.0)
+    # BQVertex list is still available, with the parsed strings
+    assert polygon.vertices[2].toTuple() == plain.gobjects[0].vertices[2].toTuple() == ('4', '3', None, None)
+
+
+V="""<image uri="/is/1"><point><vertex x="1" y="2" c="3" index="0"/></point><polyline><vertex x="1" y="2.50" index="0"/><vertex x="3" y="4" z="1" index="1"/></polyline><polygon><vertex x="1" y="2" index="1"/><vertex x="3" y="4" index="0"/></polygon></image>"""
+
+def test_vertex_array_round_trip():
+    'vertex arrays write the parsed vertices back unchanged'
+    pytest.importorskip('numpy')
+    factory = BQFactory(None, vertex_array=True)
+    image = factory.from_string(V)
+    point, polyline, polygon = image.gobjects
+    # c and out of order indices are not stored by the array
+    assert point._coords is None and polygon._coords is None
+    assert polyline._coords is not None
+    assert factory.to_string(image) == V.encode()
+    assert b''.join(iter_xml(image)) == V.encode()
+    assert polyline.vertices[1].toTuple() == ('3', '4', '1', None)
+    assert factory.to_string(image) == V.encode()
+
+
+P="""
+<image name="im">
+<tag name="a"><tag name="b"><tag name="c" value="1"/></tag><tag name="b"><tag name="c" value="2"/></tag></tag>
+<tag name="dir/file.tif" value="x"/>
+<gobject type="point" name="a"/>
+</image>
+"""
+
+def test_find_paths():
+    'find and findall by name and by name path'
+    image = BQFactory(None).from_string(P)
+    assert [ x.xmltag for x in image.findall('a') ] == ['tag', 'point']
+    assert [ x.xmltag for x in image.findall('a', limit=['gobject']) ] == ['point']
+    assert image.find('a/b/c').value == '1'
+    assert [ x.value for x in image.findall('a/b/c') ] == ['1', '2']
+    # exact names with a slash take precedence over paths
+    assert image.find('dir/file.tif').value == 'x'
+    assert image.find('a/x/c') is None
+
+
+def test_find_index_updates():
+    'the name index follows added and replaced children'
+    image = BQFactory(None).from_string(P)
+    assert image.find('late') is None
+    tag = image.addTag(name='late', value='1')
+    assert image.find('late') is tag
+    image.tags.append(BQTag(name='direct'))
+    assert image.find('direct') is not None
+    image.tags = [ BQTag(name='replaced') ]
+    assert image.find('late') is None
+    assert image.find('replaced') is not None
+
+
+def test_find_after_rename():
+    'renamed children are found by their new name only'
+    image = BQFactory(None).from_string(P)
+    tag = image.find('a')
+    assert image.findall('a') == [ tag, image.find('a', limit=['gobject']) ]
+    tag.name = 'z'
+    assert image.find('z') is tag
+    assert image.find('a').xmltag == 'point'
+    assert image.findall('z/b/c')[0].value == '1'
+
+
+def test_find_after_remove_and_add():
+    'removing a child and adding another keeps the name index current'
+    image = BQFactory(None).from_string('<image><tag name="a"/><tag name="b"/></image>')
+    a = image.find('a')
+    image.tags.remove(a)
+    c = image.addTag(name='c', value='3')
+    assert image.find('a') is None
+    assert image.find('c') is c
+    assert image.findall('b') == [ image.tags[0] ]
+
+
+def test_find_after_replace():
+    'replacing a child in place keeps the name index current'
+    image = BQFactory(None).from_string('<image><tag name="a"/><tag name="b"/></image>')
+    assert image.find('a') is not None
+    image.tags[0] = BQTag(name='zz')
+    assert image.find('a') is None
+    assert image.find('zz') is image.tags[0]
+    image.tags[:] = [ BQTag(name='y') ]
+    assert image.find('b') is None and image.find('y') is image.tags[0]
+    del image.tags[0]
+    assert image.find('y') is None
+
+
+def test_find_path_backtracks():
+    'find follows every match of a path like findall'
+    image = BQFactory(None).from_string(P)
+    image.addTag(name='x').addTag(name='y')
+    image.find('a').name = 'x'
+    assert image.find('x').find('y') is None # the first x has no y
+    assert image.find('x/y') is image.findall('x/y')[0]
+    assert image.find('/') is None and image.findall('/') == []
+    assert image.find('/x/y/') is image.find('x/y')
+
+
+L="""
+<image name="lazy" uri="/is/3">
+<tag name="experiment"><tag name="date" value="2016"/><value>a</value><value>b</value></tag>
+<gobject name="cells"><polygon name="p1"><vertex x="0" y="0"/><vertex x="4" y="0"/><vertex x="0" y="3"/></polygon></gobject>
+<tag name="list" value="x"/>
+</image>
+"""
+
+@pytest.mark.parametrize('vertex_array', [False, True])
+def test_lazy_factory(vertex_array):
+    'lazily parsed resources are expanded on access and match eager parsing'
+    eager = BQFactory(None, vertex_array=vertex_array).from_string(L)
+    factory = BQFactory(None, vertex_array=vertex_array, lazy=True)
+    image = factory.from_string(L)
+    assert image.name == 'lazy'
+    assert image._pending is factory and image._tags is None
+    assert image.find('experiment/date').value == '2016'
+    gobjects = image.gobjects
+    assert gobjects[0]._pending is factory
+    assert image.find('cells/p1').area() == eager.find('cells/p1').area() == 6
+    assert factory.from_string(L).value is None
+    assert factory.from_string(L).find('experiment').value == ['a', 'b']
+    assert factory.to_string(factory.from_string(L)) == factory.to_string(eager)
+
+
+def test_iter_xml():
+    'the streaming serializer writes the same xml as to_etree'
+    image = BQFactory(None, vertex_array=True).from_string(G)
+    image.addTag(name='escaped "<&>"\n\t', value=['a&b', ('c<d', 'string'), 'café'])
+    image.addTag(name='single', value=[('one', 'number')])
+    xml = etree.tostring(BQFactory.to_etree(image))
+    for chunk_size in (1, 64, 1 << 20):
+        chunks = list(iter_xml(image, chunk_size=chunk_size))
+        assert b''.join(chunks) == xml
+    assert len(list(iter_xml(image, chunk_size=1))) > 1
+    # no recursion limit
+    node = deep = BQTag(name='deep')
+    for i in range(5000):
+        node = node.addTag(name='t%d' % i)
+    assert BQFactory.to_string(deep).count(b'<tag') == 5001
+
+
+def test_model_fields():
+    'the cached field getters skip empty and unset fields'
+    vertex = BQVertex(x=1.5, y=2) # z, t, c, index are never set
+    assert model_fields(vertex) == {'x': '1.5', 'y': '2'}
+    assert '_field_getters' in BQVertex.__dict__
+    assert model_fields(BQTag(name='a', value='', type='number')) == {'name': 'a', 'type': 'number'}
+    class Fake(object):
+        pass
+    fake = Fake()
+    fake.name = 'n'
+    fake.mex = 'skipped'
+    assert model_fields(fake) == {'name': 'n'}
+
+
+def test_model_fields_changes():
+    'changes of xmlfields and mapping_fields are used by model_fields'
+    from bqapi.bqclass import mapping_fields
+    class Tagged(BQTag):
+        __slots__ = ()
+        xmlfields = ['name', 'value']
+    tag = Tagged(name='a', value='1')
+    assert model_fields(tag) == {'name': 'a', 'value': '1'}
+    Tagged.xmlfields = ['name']
+    assert model_fields(tag) == {'name': 'a'}
+    mapping_fields['name'] = lambda dbo, fn, baseuri: ('label', dbo.name.upper())
+    try:
+        assert model_fields(tag) == {'label': 'A'}
+    finally:
+        del mapping_fields['name']
+    assert model_fields(tag) == {'name': 'a'}
+
+
+class FakeImageService(object):
+    "session and image service serving slices of a (y, x, c) or (t, z, y, x, c) array as tiff"
+    def __init__(self, pixels):
+        self.pixels = pixels.reshape((1,) * (5 - pixels.ndim) + pixels.shape)
+        self.urls = []
+        self.factory = BQFactory(self)
+        self.image = BQImage(resource_uniq='00-1')
+        self.image.session = self
+        image_meta_cache.clear() # the pixels of 00-1 changed
+
+    def load(self, uri, **kw):
+        return self.image
+
+    def service(self, name):
+        return self
+
+    def construct(self, path):
+        return path
+
+    def fetch(self, url, stream=False):
+        import tifffile
+        self.urls.append(url)
+        ops = dict(op.split('=') for op in url.split('?')[1].split('&'))
+        if 'meta' in ops:
+            meta = etree.Element('resource')
+            for n, v in zip('tzyxc', self.pixels.shape):
+                etree.SubElement(meta, 'tag', name='image_num_%s' % n, value=str(v))
+            return type('Response', (), {'content': etree.tostring(meta)})
+        x, y, z, t = [ slice(int(a)-1, int(b or a)) if a else slice(None)
+                       for a, _, b in (r.partition('-') for r in ops['slice'].split(',')) ]
+        data = self.pixels[t, z, y, x].reshape(self.pixels[t, z, y, x].shape[-3:])
+        if 'resize' in ops:
+            # nearest neighbour
+            w, h = [ int(v) for v in ops['resize'].split(',')[:2] ]
+            data = data[[ i * data.shape[0] // h for i in range(h) ]][:, [ i * data.shape[1] // w for i in range(w) ]]
+        buf = io.BytesIO()
+        tifffile.imwrite(buf, data, photometric='rgb')
+        return type('Response', (), {'content': buf.getvalue()})
+
+
+@pytest.mark.parametrize("out", [None, 'memmap'])
+def test_tiled_asarray(out):
+    'tiles are fetched concurrently into one array'
+    np = pytest.importorskip('numpy')
+    pytest.importorskip('tifffile')
+    pixels = np.arange(70 * 50 * 3, dtype='uint16').reshape(70, 50, 3)
+    service = FakeImageService(pixels)
+    image = service.image
+    image._geometry = (50, 70, 1, 1, 3)
+    data = image.pixels().slice(z=1, t=1).asarray(tile=32, workers=3, out=out)
+    assert data.dtype == pixels.dtype and (data == pixels).all()
+    assert len(service.urls) == 6
+    assert '00-1?slice=33-50,65-70,1,1&format=tiff' in service.urls
+    # a sliced range is tiled within the range
+    data = image.pixels().slice(x='11-40', y='5-9').asarray(tile=16)
+    assert (data == pixels[4:9, 10:40]).all()
+
+
+def test_tiled_asarray_empty_range():
+    'an empty range gives an empty array of the image type'
+    np = pytest.importorskip('numpy')
+    pytest.importorskip('tifffile')
+    pixels = np.arange(35 * 35 * 3, dtype='uint16').reshape(35, 35, 3)
+    image = FakeImageService(pixels).image
+    data = image.pixels().slice(x='11-10').asarray(tile=32)
+    assert data.shape == (35, 0, 3) and data.dtype == pixels.dtype
+
+
+def test_tiled_asarray_edge_tiles():
+    'edge tiles as small as the channel count keep the layout of the first tile'
+    np = pytest.importorskip('numpy')
+    pytest.importorskip('tifffile')
+    pixels = np.arange(35 * 35 * 3, dtype='uint8').reshape(35, 35, 3)
+    image = FakeImageService(pixels).image
+    data = image.pixels().asarray(tile=32)
+    assert data.shape == pixels.shape and (data == pixels).all()
+
+
+def test_tiles():
+    'tiles with a halo and pyramid levels are streamed in order'
+    np = pytest.importorskip('numpy')
+    pytest.importorskip('tifffile')
+    pixels = np.arange(70 * 50 * 3, dtype='uint16').reshape(70, 50, 3)
+    service = FakeImageService(pixels)
+    image = service.image
+    image._geometry = (50, 70, 1, 1, 3)
+    tiles = list(image.tiles(32, overlap=4, prefetch=2))
+    assert [ (r[0].start, r[0].stop, r[1].start, r[1].stop) for r, _ in tiles ] == [
+        (0, 36, 0, 36), (0, 36, 28, 50), (28, 68, 0, 36), (28, 68, 28, 50), (60, 70, 0, 36), (60, 70, 28, 50)]
+    for region, data in tiles:
+        assert (data == pixels[region]).all()
+    # level 1 is the image downscaled by 2
+    level = np.zeros((35, 25, 3), dtype='uint16')
+    for region, data in image.tiles(16, level=1):
+        level[region] = data
+    assert (level == pixels[::2, ::2]).all()
+    # a stopped iteration does not fetch the remaining tiles
+    service.urls = []
+    tiles = image.tiles(10, prefetch=1)
+    next(tiles)
+    tiles.close()
+    assert len(service.urls) <= 3
@@ -1,9 +1,9 @@
 import os
 import numpy as np
-import urllib
-from util import fetch_file
+from six.moves import urllib
+from .util import fetch_file
 from lxml import etree
-import ConfigParser
+from six.moves import configparser as ConfigParser
 from datetime import datetime
 
 
@@ -21,7 +21,7 @@ from bqapi.bqfeature import *
 
 
 
-TEST_PATH = 'tests_%s'%urllib.quote(datetime.now().strftime('%Y%m%d%H%M%S%f'))  #set a test dir on the system so not too many repeats occur
+TEST_PATH = 'tests_%s'%urllib.parse.quote(datetime.now().strftime('%Y%m%d%H%M%S%f'))  #set a test dir on the system so not too many repeats occur
 
 pytestmark = pytest.mark.skip("Unported tests")
 #pytestmark = pytest.mark.functional
@@ -132,7 +132,7 @@ def setup_bqparallelfeature_fetch():
     """
     global resource_list
     resource_list = []
-    for _ in xrange(10):
+    for _ in range(10):
         resource = etree.Element ('resource', name=u'%s/%s'%(TEST_PATH, filename1))
         content = bqsession.postblob(file1_location, xml=resource)
         uniq = etree.XML(content)[0].attrib['resource_uniq']
@@ -174,7 +174,7 @@ def setup_bqparallelfeature_fetchvector():
     """
     global resource_list
     resource_list = []
-    for _ in xrange(10):
+    for _ in range(10):
         resource = etree.Element ('resource', name=u'%s/%s'%(TEST_PATH, filename1))
         content = bqsession.postblob(file1_location, xml=resource)
         uniq = etree.XML(content)[0].attrib['resource_uniq']
@@ -0,0 +1,133 @@
+import json
+import pytest
+
+from lxml import etree
+from bqapi import bqclass, bqnode
+from bqapi.types import get_backend
+from bqapi.exception import BQApiError
+from bqapi.xmldict import xml2d
+
+pytestmark = pytest.mark.unit
+
+
+X="""
+<image name="img" uri="/is/1" resource_uniq="00-1">
+<tag name="a" value="1"/>
+<tag name="m"><tag name="deep" value="d"/><value>x</value><value>y</value></tag>
+<gobject name="g">
+<polygon name="p"><vertex x="0" y="0" index="0"/><vertex x="4" y="0" index="1"/><vertex x="0" y="3" index="2"/></polygon>
+<circle name="c"><vertex x="1" y="1" index="0"/><vertex x="3" y="1" index="1"/></circle>
+</gobject>
+</image>
+"""
+
+def test_parity():
+    'bqnode resources read like bqclass resources'
+    views = [ mod.BQFactory(None).from_string(X) for mod in (bqclass, bqnode) ]
+    for image in views:
+        assert image.name == 'img' and image.resource_uniq == '00-1'
+        assert [ t.name for t in image.tags ] == ['a', 'm']
+        assert image.find('a').value == '1'
+        assert image.find('m').value == ['x', 'y']
+        assert image.find('m/deep').value == 'd'
+        polygon = image.find('g/p')
+        assert type(polygon).__name__ == 'BQPolygon'
+        assert polygon.area() == 6 and polygon.perimeter() == 12
+        assert polygon.verticesAsTuples() == [('0', '0', None, None), ('4', '0', None, None), ('0', '3', None, None)]
+        assert image.find('g/c').bbox() == (-1, -1, 3, 3)
+    # bqnode output reads back to the same bqclass model
+    factory = bqclass.BQFactory(None)
+    strings = [ factory.to_string(factory.from_string(mod.BQFactory.to_string(r)))
+                for mod, r in zip((bqclass, bqnode), views) ]
+    assert strings[0] == strings[1]
+
+
+def test_nodes_are_xml():
+    'bqnode state lives in the xml tree'
+    image = bqnode.BQImage(name='i')
+    image.addTag(name='t', value=['a', 'b'])
+    gob = image.addGObject(name='g')
+    gob.verticesFromArray([[1, 2], [3, 4]])
+    image.find('t').value = 5
+    assert bqnode.BQFactory.to_string(image) == (b'<image name="i"><tag name="t" value="5"/>'
+        b'<gobject name="g" type="gobject"><vertex x="1.0" y="2.0" index="0"/>'
+        b'<vertex x="3.0" y="4.0" index="1"/></gobject></image>')
+    assert [ type(x) for x in image ] == [ bqnode.BQTag, bqnode.BQGObject ]
+    copy = bqnode.BQFactory.to_etree(image.find('t'))
+    assert copy.getparent() is None and image.find('t') is not None
+
+
+def test_backend_selection():
+    'the factory binds its session and the backend is selected by name'
+    session = object()
+    factory = get_backend('bqnode').BQFactory(session)
+    image = factory.from_etree(etree.XML(X))
+    assert isinstance(image, bqnode.BQImage)
+    assert image.session is session and image.find('a').session is session
+    assert get_backend('bqclass') is bqclass
+    with pytest.raises(BQApiError):
+        get_backend('nodes')
+
+
+def test_from_dict():
+    'json documents in the xml2d layout parse like their xml'
+    d = json.loads(json.dumps(xml2d(etree.XML(X), typed=True, text=True)))
+    factory = bqclass.BQFactory(None)
+    expected = factory.to_string(factory.from_string(X))
+    for mod in (bqclass, bqnode):
+        image = mod.BQFactory(None).from_dict(d)
+        assert image.find('m').value == ['x', 'y']
+        assert image.find('g/p').verticesAsTuples()[1] == ('4', '0', None, None)
+        assert factory.to_string(factory.from_string(mod.BQFactory.to_string(image))) == expected
+    # element methods of the dict view are served by its tree
+    image = factory.from_dict(d)
+    assert image.xmltree.find('tag[@name="m"]/tag').get('value') == 'd'
+
+
+@pytest.mark.parametrize('mod', [bqclass, bqnode])
+def test_child_list_mutation(mod):
+    'changes of the child lists are kept by both backends'
+    image = mod.BQFactory(None).from_string(X)
+    image.tags.append(mod.BQTag(name='appended', value='2'))
+    assert [ t.name for t in image.tags ] == ['a', 'm', 'appended']
+    assert image.find('appended').value == '2'
+    del image.tags[0]
+    assert [ t.name for t in image.tags ] == ['m', 'appended']
+    image.tags.insert(0, mod.BQTag(name='first'))
+    assert image.tags[0].name == 'first'
+    gob = image.addGObject(name='pt', type='point')
+    assert isinstance(gob, mod.BQPoint)
+    assert gob in image.gobjects
+    image.gobjects.remove(gob)
+    assert [ g.name for g in image.gobjects ] == ['g']
+
+
+class FakeResponse(object):
+    content = b'unknown format'
+    class request:
+        headers = {}
+
+    def __init__(self, url, status_code):
+        self.url = url
+        self.status_code = status_code
+
+
+def test_fetchdoc_json_rejected():
+    'a server rejecting format=json is asked again for xml'
+    from bqapi.comm import BQSession
+    from bqapi.exception import BQCommError
+    session = BQSession()
+    session.wire_format = 'json'
+    urls = []
+    def fetch(url, headers=None, path=None):
+        urls.append(url)
+        if 'format=json' in url:
+            raise BQCommError(FakeResponse(url, 404 if 'missing' in url else 400))
+        return X.encode()
+    session.c.fetch = fetch
+    image = session.load('http://bisque/data_service/00-1')
+    assert image.find('m').value == ['x', 'y']
+    assert [ 'format=json' in url for url in urls ] == [True, False]
+    with pytest.raises(BQCommError):
+        session.fetchxml('http://bisque/data_service/missing')
+    assert len(urls) == 3
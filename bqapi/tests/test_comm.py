@@ -3,13 +3,13 @@ import pytest
 from collections import OrderedDict, namedtuple
 import os
 from lxml import etree
-import urllib
+from six.moves import urllib
 from datetime import datetime
 import time
 
 from bqapi import BQSession
 
-TEST_PATH = 'tests_%s'%urllib.quote(datetime.now().strftime('%Y%m%d%H%M%S%f'))  #set a test dir on the system so not too many repeats occur
+TEST_PATH = 'tests_%s'%urllib.parse.quote(datetime.now().strftime('%Y%m%d%H%M%S%f'))  #set a test dir on the system so not too many repeats occur
 
 # default mark is function.. may be overridden
 pytestmark = pytest.mark.functional
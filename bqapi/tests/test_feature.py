@@ -0,0 +1,428 @@
+import time
+import socket
+import threading
+import pytest
+
+from six.moves import urllib
+
+pytestmark = pytest.mark.unit
+
+np = pytest.importorskip('numpy')
+tables = pytest.importorskip('tables')
+
+from lxml import etree
+from bqapi import bqfeature
+from bqapi.bqfeature import Feature, ParallelFeature, RequestPlan, FeatureError
+from bqapi.cache import FeatureCache
+from bqapi.exception import BQCommError
+
+
+FEATURE_LENGTH = 4
+
+class FeatureRow(tables.IsDescription):
+    image = tables.StringCol(64, pos=0)
+    mask = tables.StringCol(64, pos=1)
+    gobject = tables.StringCol(64, pos=2)
+    feature = tables.Float32Col(shape=(FEATURE_LENGTH,), pos=3)
+
+class StatusRow(tables.IsDescription):
+    status = tables.Int32Col(pos=0)
+    error = tables.StringCol(64, pos=1)
+    image = tables.StringCol(64, pos=2)
+    mask = tables.StringCol(64, pos=3)
+    gobject = tables.StringCol(64, pos=4)
+
+
+def image_value(image):
+    "feature values of the images http://bisque/image/<n> are n"
+    return float(image.rsplit('/', 1)[-1])
+
+
+class FakeResponse(object):
+    url = 'http://bisque/features/HTD/hdf'
+    status_code = 500
+    content = b'internal error'
+    class request:
+        headers = {}
+
+
+class FakeFeatureServer(object):
+    """feature service answering the hdf requests, images named bad fail with 500,
+    requests with crash images fail, with forbidden images are refused, with down
+    images cannot connect, with boom images raise and with corrupt images answer garbage.
+    The responses hold the resources as rewritten by echo and no values
+    table when every resource failed"""
+    bisque_root = 'http://bisque'
+    feature_cache = None
+    echo = staticmethod(lambda uri: uri)
+
+    def __init__(self):
+        self.c = self
+        self.requests = []
+        self.urls = []
+        self.lock = threading.Lock()
+
+    def fetchxml(self, url, **kw):
+        return etree.XML('<resource><feature name="HTD"><tag name="feature_length" value="%s"/></feature></resource>' % FEATURE_LENGTH)
+
+    def push(self, url, content=None, headers=None, path=None, **kw):
+        resources = []
+        for feature in etree.fromstring(content):
+            query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(feature.get('uri')).query))
+            resources.append(tuple(query.get(k, '') for k in ('image', 'mask', 'gobject')))
+        with self.lock:
+            self.requests.append(resources)
+            self.urls.append(url)
+            if any(r[0].endswith('crash') for r in resources):
+                raise BQCommError(FakeResponse())
+            if any(r[0].endswith('forbidden') for r in resources):
+                response = FakeResponse()
+                response.status_code = 403
+                raise BQCommError(response)
+            if any(r[0].endswith('down') for r in resources):
+                raise socket.error('connection refused')
+            if any(r[0].endswith('boom') for r in resources):
+                raise ValueError('unexpected')
+            if any(r[0].endswith('corrupt') for r in resources):
+                return b'<html>proxy error</html>'
+            name = 'response_%s.h5' % len(self.requests)
+            with tables.open_file(name, 'w', driver='H5FD_CORE', driver_core_backing_store=0) as h5:
+                if not all(r[0].endswith('bad') for r in resources):
+                    values = h5.create_table('/', 'values', FeatureRow)
+                status = h5.create_table('/', 'status', StatusRow)
+                for image, mask, gobject in resources:
+                    failed = image.endswith('bad')
+                    if not failed:
+                        values.append([(self.echo(image), mask, gobject, [image_value(image)] * FEATURE_LENGTH)])
+                    status.append([(500 if failed else 200, 'failed' if failed else '', self.echo(image), mask, gobject)])
+                h5.flush()
+                image = h5.get_file_image()
+        if path:
+            with open(path, 'wb') as f:
+                f.write(image)
+            return path
+        return image
+
+
+def images(n):
+    return [('http://bisque/image/%s' % i, None, None) for i in range(n)]
+
+
+def test_fetch_vector():
+    session = FakeFeatureServer()
+    vector = Feature().fetch_vector(session, 'HTD', images(3))
+    np.testing.assert_array_equal(vector[:, 0], [0, 1, 2])
+
+
+def test_fetch_vector_error():
+    session = FakeFeatureServer()
+    with pytest.raises(FeatureError):
+        Feature().fetch_vector(session, 'HTD', images(2) + [('http://bisque/image/bad', None, None)])
+
+
+def test_fetch_path(tmp_path):
+    session = FakeFeatureServer()
+    path = str(tmp_path / 'features.h5')
+    assert Feature().fetch(session, 'HTD', images(2), path=path) == path
+    with tables.open_file(path) as h5:
+        assert h5.root.values.nrows == 2
+
+
+def test_parallel_fetch_in_memory():
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(3)
+    feature.set_chunk_size(4)
+    with feature.fetch(session, 'HTD', images(25)) as h5:
+        values = h5.root.values[:]
+        assert h5.root.status.nrows == 25
+    assert len(session.requests) == 7
+    assert sorted(values['feature'][:, 0]) == list(range(25))
+
+
+def test_parallel_fetch_path(tmp_path):
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(2)
+    feature.set_chunk_size(3)
+    path = str(tmp_path / 'features.h5')
+    assert feature.fetch(session, 'HTD', images(10), path=path) == path
+    with tables.open_file(path) as h5:
+        assert sorted(h5.root.values[:]['feature'][:, 0]) == list(range(10))
+        assert h5.root.status.nrows == 10
+
+
+def test_parallel_fetch_adaptive():
+    session = FakeFeatureServer()
+    with ParallelFeature().fetch(session, 'HTD', images(60)) as h5:
+        assert sorted(h5.root.values[:]['feature'][:, 0]) == list(range(60))
+    assert sum(len(r) for r in session.requests) == 60
+
+
+def test_request_plan_fixed():
+    plan = RequestPlan(images(10), 2, 4, adaptive=False)
+    chunks = [plan.next_chunk(), plan.next_chunk()]
+    assert [len(c) for c in chunks] == [4, 4]
+    plan.done(4, 100.0, failed=True)
+    assert (plan.thread_num, plan.chunk_size) == (2, 4)
+    assert len(plan.next_chunk()) == 2
+    plan.done(4, 1.0)
+    plan.done(2, 1.0)
+    assert plan.next_chunk() is None
+
+
+def test_request_plan_retry():
+    plan = RequestPlan(images(4), 2, 4, adaptive=False)
+    start, chunk = plan.next_indexed_chunk()
+    plan.retry(start, chunk[:2])
+    plan.retry(start+2, chunk[2:])
+    plan.done(4, 1.0, failed=True)
+    assert plan.next_indexed_chunk() == (0, chunk[:2])
+    assert plan.next_indexed_chunk() == (2, chunk[2:])
+    assert plan.completed == 0 # the retried resources are not completed yet
+    plan.done(2, 1.0)
+    plan.done(2, 1.0)
+    assert plan.next_indexed_chunk() is None
+    assert plan.completed == 4
+
+
+def test_request_plan_additive_increase():
+    plan = RequestPlan(images(1000), 2, 10, max_threads=4, min_chunk=5, max_chunk=20, target_latency=10.0)
+    for _ in range(6):
+        plan.next_chunk()
+        plan.done(10, 1.0)
+    assert plan.thread_num == 4
+    assert plan.chunk_size == 20
+
+
+def test_request_plan_multiplicative_decrease():
+    plan = RequestPlan(images(1000), 8, 20, max_threads=8, min_chunk=5, max_chunk=20, target_latency=1.0)
+    plan.next_chunk()
+    plan.done(20, 1.0)
+    for _ in range(8): # slower latency per resource over a round of requests
+        plan.next_chunk()
+        plan.done(20, 4.0)
+    assert plan.thread_num == 4
+    assert plan.chunk_size == 5
+    plan.next_chunk()
+    plan.done(20, 1.0, failed=True) # at most one decrease per round
+    assert plan.thread_num == 4
+
+
+def test_feature_cache():
+    session = FakeFeatureServer()
+    session.feature_cache = FeatureCache()
+    Feature().fetch_vector(session, 'HTD', images(3))
+    resources = images(5)[::-1] + [('http://bisque/image/bad', None, None)]
+    with Feature().fetch(session, 'HTD', resources) as h5:
+        assert list(h5.root.values[:]['feature'][:, 0]) == [4, 3, 2, 1, 0]
+        assert list(h5.root.status[:]['status']) == [200] * 5 + [500]
+    assert session.requests[1] == [ ('http://bisque/image/%s' % i, '', '') for i in (4, 3) ] + [('http://bisque/image/bad', '', '')]
+    vector = ParallelFeature().fetch_vector(session, 'HTD', images(5))
+    np.testing.assert_array_equal(vector[:, 0], range(5))
+    assert len(session.requests) == 2
+
+
+def test_feature_cache_rows_by_position():
+    'fresh rows are matched to the resources by position, not by the uris echoed'
+    session = FakeFeatureServer()
+    session.feature_cache = FeatureCache()
+    session.echo = lambda uri: uri.replace('http://', 'https://')
+    assert Feature().fetch(session, 'HTD', []) is None
+    resources = images(4)[::-1]
+    resources[1] = ('http://bisque/image/bad', None, None)
+    with Feature().fetch(session, 'HTD', resources) as h5:
+        assert list(h5.root.values[:]['feature'][:, 0]) == [3, 1, 0]
+        assert list(h5.root.status[:]['status']) == [200, 500, 200, 200]
+    vector = ParallelFeature().fetch_vector(session, 'HTD', images(4)[::-1][2:])
+    np.testing.assert_array_equal(vector[:, 0], [1, 0])
+    assert len(session.requests) == 1
+
+
+def test_feature_cache_all_failed():
+    'misses without any values table write the status rows only'
+    session = FakeFeatureServer()
+    session.feature_cache = FeatureCache()
+    resources = [('http://bisque/image/bad', None, None), ('http://bisque/image/crash', None, None)]
+    feature = ParallelFeature()
+    feature.set_thread_num(2)
+    feature.set_chunk_size(1)
+    with feature.fetch(session, 'HTD', resources) as h5:
+        assert 'values' not in h5.root
+        assert list(h5.root.status[:]['status']) == [500, 500]
+        assert list(h5.root.status[:]['image']) == [ r[0].encode() for r in resources ]
+    with pytest.raises(FeatureError):
+        Feature().fetch_vector(session, 'HTD', resources[:1])
+
+
+def test_feature_cache_disk(tmp_path):
+    session = FakeFeatureServer()
+    session.feature_cache = FeatureCache(str(tmp_path))
+    Feature().fetch_vector(session, 'HTD', images(3), ts='2020-01-01')
+    Feature().fetch_vector(session, 'HTD', images(2))
+    assert len(session.requests) == 2
+    session.feature_cache = FeatureCache(str(tmp_path))
+    vector = Feature().fetch_vector(session, 'HTD', images(3), ts='2020-01-01')
+    np.testing.assert_array_equal(vector[:, 0], range(3))
+    assert len(session.requests) == 2
+    Feature().fetch_vector(session, 'HTD', images(3), ts='2021-01-01')
+    assert len(session.requests) == 3
+
+
+def test_iter_features_ordered():
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(3)
+    feature.set_chunk_size(4)
+    resources = images(20)
+    resources[5] = ('http://bisque/image/bad', None, None)
+    resources[13] = ('http://bisque/image/crash', None, None)
+    failures = []
+    blocks = list(feature.iter_features(session, 'HTD', resources, failures=failures))
+    indices = np.concatenate([ i for i, _ in blocks ])
+    features = np.concatenate([ f for _, f in blocks ])
+    assert list(indices) == [ i for i in range(20) if i not in (5, 13) ]
+    np.testing.assert_array_equal(features[:, 0], indices)
+    assert [ (i, status) for i, status, _ in failures ] == [(5, 500), (13, 500)]
+
+
+def test_iter_features_ordered_window():
+    'a slow first chunk holds back the requests of the later ones'
+    session = FakeFeatureServer()
+    slow = threading.Event()
+    push = session.push
+    def slow_push(url, content=None, **kw):
+        if b'image/0' in content:
+            slow.wait(5)
+        return push(url, content, **kw)
+    session.push = slow_push
+    feature = ParallelFeature()
+    feature.set_thread_num(2)
+    feature.set_chunk_size(2)
+    requested = []
+    def release():
+        time.sleep(0.5)
+        requested.append(sum(len(r) for r in session.requests))
+        slow.set()
+    threading.Thread(target=release).start()
+    blocks = list(feature.iter_features(session, 'HTD', images(100)))
+    # at most two rounds of requests past the slow chunk
+    assert requested[0] <= 2 * 2 * 2
+    assert list(np.concatenate([ i for i, _ in blocks ])) == list(range(100))
+
+
+def test_iter_features_unordered_early_stop():
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(2)
+    feature.set_chunk_size(2)
+    blocks = feature.iter_features(session, 'HTD', images(40), ordered=False)
+    indices, features = next(blocks)
+    np.testing.assert_array_equal(features[:, 0], indices)
+    blocks.close()
+    assert sum(len(r) for r in session.requests) < 40
+
+
+def test_parallel_fetch_bisects_failures():
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(2)
+    feature.set_chunk_size(16)
+    resources = images(32)
+    resources[3] = ('http://bisque/image/crash', None, None)
+    resources[20] = ('http://bisque/image/corrupt', None, None)
+    with feature.fetch(session, 'HTD', resources) as h5:
+        assert sorted(h5.root.values[:]['feature'][:, 0]) == [ i for i in range(32) if i not in (3, 20) ]
+        status = h5.root.status[:]
+    assert len(status) == 32
+    failed = status[status['status'] >= 400]
+    assert sorted(failed['image']) == [b'http://bisque/image/corrupt', b'http://bisque/image/crash']
+    # the good resources of the failing chunks are requested again in halves, not one by one
+    assert len([ r for r in session.requests if len(r) == 1 ]) == 5
+    assert sum(len(r) for r in session.requests) == 2 * (16 + 16 + 8 + 4 + 2) + 1
+
+
+def test_parallel_fetch_bisection_counts_resources_once(monkeypatch):
+    'the resources of a bisected chunk are completed once in the plan'
+    plans = []
+    request_plan = ParallelFeature.request_plan
+    def capture(self, *args, **kw):
+        plans.append(request_plan(self, *args, **kw))
+        return plans[-1]
+    monkeypatch.setattr(ParallelFeature, 'request_plan', capture)
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(2)
+    feature.set_chunk_size(8)
+    resources = images(16)
+    resources[5] = ('http://bisque/image/crash', None, None)
+    with feature.fetch(session, 'HTD', resources) as h5:
+        assert h5.root.status.nrows == 16
+    assert sum(len(r) for r in session.requests) > 16 # the first chunk was bisected
+    assert plans[0].completed == 16
+
+
+@pytest.mark.parametrize("image,status", [('forbidden', 403), ('down', 503), ('boom', 500)])
+def test_parallel_fetch_fails_whole_chunks(monkeypatch, image, status):
+    'refused chunks, connection and unexpected failures are not bisected'
+    monkeypatch.setattr(bqfeature, 'MAX_ATTEMPTS', 1)
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(2)
+    feature.set_chunk_size(8)
+    resources = images(32)
+    resources[3] = ('http://bisque/image/%s' % image, None, None)
+    with feature.fetch(session, 'HTD', resources) as h5:
+        assert sorted(h5.root.values[:]['feature'][:, 0]) == list(range(8, 32))
+        status_rows = h5.root.status[:]
+    assert sorted(status_rows['status']) == [200] * 24 + [status] * 8
+    assert all(len(r) == 8 for r in session.requests)
+    assert sum(len(r) for r in session.requests) == 32 + (8 if image == 'down' else 0)
+
+
+def test_parallel_fetch_all_failed():
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(1)
+    feature.set_chunk_size(2)
+    with pytest.raises(FeatureError):
+        feature.fetch_vector(session, 'HTD', [('http://bisque/image/crash', None, None)] * 2)
+
+
+def test_fetch_many():
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(3)
+    feature.set_chunk_size(4)
+    resources = images(10) + images(10)[::2] + [('http://bisque/image/crash', None, None)]
+    with feature.fetch_many(session, ['HTD', 'EHD'], resources) as h5:
+        for name in ('HTD', 'EHD'):
+            values = h5.get_node('/%s/values' % name)[:]
+            status = h5.get_node('/%s/status' % name)[:]
+            assert sorted(values['feature'][:, 0]) == list(range(10))
+            assert len(status) == 11
+            assert list(status[status['status'] >= 400]['image']) == [b'http://bisque/image/crash']
+    assert set(session.urls) == {'http://bisque/features/HTD/hdf', 'http://bisque/features/EHD/hdf'}
+    for name in ('HTD', 'EHD'): # the repeated resources are computed once
+        computed = [ r for url, rs in zip(session.urls, session.requests) if name in url
+                     and not any(i.endswith('crash') for i, _, _ in rs) for r in rs ]
+        assert sorted(computed) == sorted(set(computed)) and len(computed) == 10
+
+
+def test_parallel_fetch_writer_failure(monkeypatch):
+    'a failing writer stops the requests instead of blocking them'
+    from bqapi.bqfeature import WriteHDF5Thread
+    def write_chunk(self, *item):
+        raise IOError('disk full')
+    monkeypatch.setattr(WriteHDF5Thread, 'write_chunk', write_chunk)
+    session = FakeFeatureServer()
+    feature = ParallelFeature()
+    feature.set_thread_num(2)
+    feature.set_chunk_size(1)
+    with pytest.raises(FeatureError):
+        feature.fetch(session, 'HTD', images(40))
+    assert len(session.requests) < 40
+    monkeypatch.undo()
+    monkeypatch.setattr(WriteHDF5Thread, 'write_failures', write_chunk)
+    with pytest.raises(FeatureError):
+        feature.fetch(session, 'HTD', images(4))
@@ -0,0 +1,66 @@
+import os
+import pytest
+
+from bqapi import bqnode
+from bqapi.bqclass import BQImage
+from bqapi.cache import ImageMetaCache
+from bqapi.util import fetch_image_planes
+from .test_bqclass import FakeImageService
+
+pytestmark = pytest.mark.unit
+
+np = pytest.importorskip('numpy')
+tifffile = pytest.importorskip('tifffile')
+
+
+def make_pixels():
+    return np.arange(3 * 4 * 20 * 10 * 3, dtype='uint8').reshape(3, 4, 20, 10, 3)
+
+
+@pytest.mark.parametrize("out", [None, 'memmap'])
+def test_fetch_image_planes_array(out):
+    'planes are decoded concurrently into a (t,z,c,y,x) array'
+    pixels = make_pixels()
+    service = FakeImageService(pixels)
+    planes = fetch_image_planes(service, '/data_service/00-1', out=out, workers=3)
+    assert planes.shape == (3, 4, 3, 20, 10)
+    assert (planes == pixels.transpose(0, 1, 4, 2, 3)).all()
+    assert len(service.urls) == 1 + 12
+
+
+def test_fetch_image_planes_channel_sized():
+    'planes as small as the channel count keep their samples last layout'
+    pixels = np.arange(2 * 3 * 3 * 3, dtype='uint8').reshape(1, 2, 3, 3, 3)
+    planes = fetch_image_planes(FakeImageService(pixels), '/data_service/00-1')
+    assert (planes == pixels.transpose(0, 1, 4, 2, 3)).all()
+
+
+def test_fetch_image_planes_files(tmpdir):
+    'planes are still written as numbered files'
+    pixels = make_pixels()
+    files = fetch_image_planes(FakeImageService(pixels), '/data_service/00-1', dest=str(tmpdir))
+    assert [ os.path.basename(f) for f in files ] == [ '%.5d.TIF' % i for i in range(12) ]
+    assert (tifffile.imread(files[5]) == pixels[1, 1]).all()
+
+
+def test_image_meta_cache(tmpdir):
+    'image meta is fetched once per resource_uniq and ts'
+    service = FakeImageService(make_pixels())
+    service.image.ts = '2020-01-01T00:00:00'
+    fetch_image_planes(service, '/data_service/00-1')
+    other = BQImage(resource_uniq='00-1', ts='2020-01-01T00:00:00')
+    other.session = service
+    assert other.geometry() == (10, 20, 4, 3, 3)
+    node = bqnode.BQImage(resource_uniq='00-1', ts='2020-01-01T00:00:00')
+    assert node.info()['image_num_c'] == '3'
+    assert len([ url for url in service.urls if 'meta' in url ]) == 1
+    # a new ts is fetched again
+    other = BQImage(resource_uniq='00-1', ts='2020-01-02T00:00:00')
+    other.session = service
+    other.meta()
+    assert len([ url for url in service.urls if 'meta' in url ]) == 2
+    # documents stored on disk are read by later caches
+    cache = ImageMetaCache(str(tmpdir))
+    meta = cache.fetch(other)
+    assert ImageMetaCache(str(tmpdir)).get(cache.key(other)) == meta
+    assert len(tmpdir.listdir()) == 1
@@ -0,0 +1,61 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from bqapi.bqclass import BQFactory
+from bqapi.geometry import measure_gobjects, iter_gobjects, MEASURES
+
+pytestmark = pytest.mark.unit
+
+
+X="""
+<image uri="/is/1">
+<gobject name="group">
+<gobject type="polygon" name="p" uri="/gob/1">
+<vertex x="0" y="0" index="0"/><vertex x="4" y="0" index="1"/><vertex x="4" y="3" index="2"/><vertex x="0" y="3" index="3"/>
+</gobject>
+<polyline name="l" uri="/gob/2"><vertex x="0" y="0" index="0"/><vertex x="3" y="4" index="1"/></polyline>
+</gobject>
+<circle name="c" uri="/gob/3"><vertex x="1" y="1" index="0"/><vertex x="3" y="1" index="1"/></circle>
+<ellipse name="e" uri="/gob/4"><vertex x="0" y="0" index="0"/><vertex x="2" y="0" index="1"/><vertex x="0" y="1" index="2"/></ellipse>
+<rectangle name="r" uri="/gob/5"><vertex x="1" y="1" index="0"/><vertex x="3" y="2" index="1"/></rectangle>
+<point name="pt" uri="/gob/6"><vertex x="5" y="6" index="0"/></point>
+</image>
+"""
+
+@pytest.mark.parametrize('vertex_array', [False, True])
+def test_measure_gobjects(vertex_array):
+    'batch measures match the per gobject methods'
+    image = BQFactory(None, vertex_array=vertex_array).from_string(X)
+    columns = measure_gobjects(image)
+    gobs = list(iter_gobjects(image))
+    assert [ g.name for g in gobs ] == ['group', 'p', 'l', 'c', 'e', 'r', 'pt']
+    assert list(columns['name']) == [ g.name for g in gobs ]
+    assert list(columns['uri'])[1:] == [ '/gob/%s' % i for i in range(1, 7) ]
+    assert list(columns['vertices']) == [0, 4, 2, 2, 3, 2, 1]
+    for row, gob in enumerate(gobs[1:], 1):
+        area, perimeter = gob.area(), gob.perimeter()
+        expected = [ np.nan if area == -1 else area, np.nan if perimeter == -1 else perimeter ]
+        expected += list(gob.centroid()) + list(gob.bbox())
+        assert np.allclose([ columns[m][row] for m in MEASURES ], expected, equal_nan=True)
+    # the group has no vertices
+    assert all(np.isnan(columns[m][0]) for m in MEASURES)
+
+
+def test_spatial_index():
+    'window, point and nearest queries on the lazily built index'
+    image = BQFactory(None, vertex_array=True).from_string(X)
+    index = image.spatialIndex()
+    assert image.spatialIndex() is index
+    names = lambda gobs: [ g.name for g in gobs ]
+    assert names(index.window(0, 0, 1, 1)) == ['p', 'l', 'c', 'e', 'r']
+    assert names(index.window(4.5, 5.5, 6, 7)) == ['pt']
+    assert names(index.window(100, 100, 200, 200)) == []
+    # polygon, circle and rectangle contain the point, the polyline has no area
+    assert names(index.contains(2, 1.5)) == ['p', 'c', 'r']
+    assert names(index.contains(-1.5, 0)) == ['e']
+    distance, nearest = index.nearest(5, 7, k=1)[0]
+    assert nearest.name == 'pt' and distance == 1.0
+    # adding a gobject drops the index
+    image.addGObject(name='new', type='point')
+    assert image.spatialIndex() is not index
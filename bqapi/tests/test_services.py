@@ -0,0 +1,171 @@
+import json
+import threading
+import pytest
+
+from six.moves import urllib
+
+from bqapi.services import TableProxy
+from bqapi.cache import TableSliceCache
+
+pytestmark = pytest.mark.unit
+
+np = pytest.importorskip('numpy')
+from numpy.lib.recfunctions import repack_fields
+tables = pytest.importorskip('tables')
+
+
+class FakeTableServer(object):
+    "table service serving the arrays of a dict {path: ndarray}"
+    headers = {}
+    table_cache = None
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.urls = []
+        self.service_map = { 'table': 'http://bisque/table_service/' }
+        self.c = self
+        self.lock = threading.Lock()
+
+    def request(self, url, params=None, method='get', timeout=None, headers=None, **kw):
+        self.urls.append(url)
+        path = urllib.parse.urlsplit(url).path.split('/')[2:]
+        fmt = path.pop()
+        query = path.pop()
+        array = self.arrays['/'.join(path)]
+        names = array.dtype.names
+        if query == 'info':
+            info = { 'sizes': list(array.shape) }
+            if names:
+                info = { 'sizes': [ len(array), len(names) ], 'headers': list(names) }
+            content = json.dumps(info).encode()
+        else:
+            index = tuple(slice(int(a) if a else None, int(b)+1 if b else None)
+                          for a, b in (r.split(';') for r in query.split(',')))
+            with self.lock, tables.open_file('fake.h5', 'w', driver='H5FD_CORE', driver_core_backing_store=0) as h5file:
+                if names:
+                    # tables are sliced by rows and columns
+                    h5file.create_table(h5file.root, 'array', repack_fields(array[index[0]][list(names[index[1]])]))
+                else:
+                    h5file.create_array(h5file.root, 'array', array[index])
+                content = h5file.get_file_image()
+        return type('Response', (), {'content': content})
+
+
+def make_proxy():
+    array = np.arange(1000 * 6, dtype='float32').reshape(1000, 6)
+    server = FakeTableServer({ '00-t/measures': array })
+    return TableProxy(server, 'table'), server, array
+
+
+def test_load_array():
+    'a single request by default, concurrent row blocks on demand'
+    proxy, server, array = make_proxy()
+    assert (proxy.load_array('00-t', 'measures') == array).all()
+    assert len(server.urls) == 2
+    server.urls = []
+    data = proxy.load_array('00-t', '/measures', [slice(10, 995), slice(1, 3)], rows=100, workers=3)
+    assert (data == array[10:995, 1:3]).all()
+    assert len(server.urls) == 1 + 10
+    out = np.zeros((985, 2), dtype='float64')
+    assert proxy.load_array('00-t', 'measures', [slice(10, 995), slice(1, 3)], rows=300, out=out) is out
+    assert (out == array[10:995, 1:3]).all()
+    data = proxy.load_array('00-t', 'measures', rows=256, out='memmap')
+    assert isinstance(data, np.memmap) and (data == array).all()
+
+
+def test_iter_array():
+    'blocks are yielded in row order'
+    proxy, server, array = make_proxy()
+    blocks = list(proxy.iter_array('00-t', 'measures', [slice(None, 450)], rows=100))
+    assert [ len(b) for b in blocks ] == [100, 100, 100, 100, 50]
+    assert (np.concatenate(blocks) == array[:450]).all()
+
+
+def test_load_empty_range():
+    'an empty range of rows loads an empty array of the array type'
+    proxy, server, array = make_proxy()
+    for rows in (None, 100):
+        data = proxy.load_array('00-t', 'measures', [slice(20, 10), slice(1, 3)], rows=rows)
+        assert data.shape == (0, 2) and data.dtype == array.dtype
+    assert [ url.split('/')[-2] for url in server.urls if 'info' not in url ] == ['0;0,1;2'] * 2
+
+
+def test_iter_empty_range():
+    'an empty range of rows yields no block and fetches no rows'
+    proxy, server, array = make_proxy()
+    assert list(proxy.iter_array('00-t', 'measures', [slice(300, 300)], rows=100)) == []
+    assert list(proxy.iter_table('00-t', 'measures', start=500, stop=400, dataframe=False)) == []
+    assert [ url for url in server.urls if 'info' not in url ] == []
+
+
+class FakeImporter(object):
+    "import service keeping the uploaded files"
+    def __init__(self):
+        self.files = {}
+
+    def service(self, name):
+        return self
+
+    def transfer(self, filename, fileobj=None, xml=None):
+        self.files[filename] = fileobj.read()
+        return type('Response', (), {'content': b'<resource type="uploaded"><table name="%s"/></resource>' % filename.encode()})
+
+
+@pytest.mark.parametrize("complevel", [0, 5])
+def test_store_array(complevel):
+    'arrays are uploaded from memory'
+    importer = FakeImporter()
+    importer.service_map = { 'table': 'http://bisque/table_service/' }
+    proxy = TableProxy(importer, 'table')
+    array = np.zeros((200, 50), dtype='int32')
+    res = proxy.store_array(array, 'measures', complevel=complevel)
+    assert res.get('name') == 'measures.h5'
+    image = importer.files['measures.h5']
+    assert (len(image) < array.nbytes) == bool(complevel)
+    with tables.open_file('check.h5', driver='H5FD_CORE', driver_core_image=image, driver_core_backing_store=0) as h5file:
+        assert (h5file.root.measures.read() == array).all()
+
+
+@pytest.mark.parametrize("dataframe", [True, False])
+def test_iter_table(dataframe):
+    'only the selected columns are fetched'
+    if dataframe:
+        pytest.importorskip('pandas')
+    measures = np.zeros(500, dtype=[ ('m%d' % i, 'float64') for i in range(20) ] + [ ('label', 'int32') ])
+    for i, name in enumerate(measures.dtype.names):
+        measures[name] = np.arange(500) * 100 + i
+    server = FakeTableServer({ '00-t/measures': measures })
+    proxy = TableProxy(server, 'table')
+    blocks = list(proxy.iter_table('00-t', 'measures', ['label', 'm3', 'm4', 'm5'], start=50, rows=200, dataframe=dataframe))
+    assert [ len(b) for b in blocks ] == [200, 200, 50]
+    assert len([ url for url in server.urls if 'info' in url ]) == 1
+    assert len(server.urls) == 1 + 3 * 2
+    assert list(blocks[0].columns if dataframe else blocks[0].dtype.names) == ['label', 'm3', 'm4', 'm5']
+    for name in ('label', 'm3', 'm4', 'm5'):
+        assert (np.concatenate([ np.asarray(b[name]) for b in blocks ]) == measures[name][50:]).all()
+    assert blocks[0]['label'].dtype == np.int32
+
+
+def test_table_cache(tmpdir):
+    'sub slices of cached slices are served locally'
+    proxy, server, array = make_proxy()
+    server.table_cache = TableSliceCache(max_bytes=40000)
+    assert (proxy.load_array('00-t', 'measures', [slice(100, 900)]) == array[100:900]).all()
+    assert len(server.urls) == 2
+    data = proxy.load_array('00-t', 'measures', [slice(200, 300), slice(2, 4)])
+    assert (data == array[200:300, 2:4]).all()
+    data[...] = 0
+    assert (proxy.load_array('00-t', 'measures', [250, slice(1, 3)]) == array[250:251, 1:3]).all()
+    assert len(server.urls) == 2
+    # the first slice is evicted by bytes
+    proxy.load_array('00-t', 'measures', [slice(0, 1000)])
+    proxy.load_array('00-t', 'measures', [slice(0, 900)])
+    assert server.table_cache.nbytes <= 40000
+    assert len(server.urls) == 3
+    # slices of tables with a ts are kept on disk
+    server.table_cache = TableSliceCache(str(tmpdir))
+    proxy.load_array('00-t', 'measures', [slice(0, 10)], ts='2020')
+    server.table_cache = TableSliceCache(str(tmpdir))
+    server.urls = []
+    assert (proxy.load_array('00-t', 'measures', [slice(5, 10)], ts='2020') == array[5:10]).all()
+    assert server.urls == []
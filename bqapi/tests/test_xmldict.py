@@ -0,0 +1,56 @@
+import pytest
+
+from lxml import etree
+from bqapi.xmldict import xml2d, d2xml, xml2nv, typed_value, DictElement
+
+pytestmark = pytest.mark.unit
+
+
+X = """<T uri="boo"><a n="1"/><a n="2"/><b n="3"><c x="y"/></b></T>"""
+
+M = """<resource><tag name="image_meta"><tag name="num_x" value="512"/>
+<tag name="pixel_resolution"><tag name="x" value="0.5"/><tag><tag name="unit" value="micron"/></tag></tag>
+<tag name="signed" value="false"/></tag></resource>"""
+
+
+def test_roundtrip():
+    'xml2d and d2xml are inverse'
+    d = xml2d(etree.XML(X))
+    assert d == {'T': {'uri': 'boo', 'a': [{'n': '1'}, {'n': '2'}], 'b': [{'n': '3', 'c': [{'x': 'y'}]}]}}
+    assert etree.tostring(d2xml(d)) == X.encode()
+
+
+def test_typed():
+    'typed mode parses numbers and booleans'
+    d = xml2d(etree.XML('<a x="1" y="2.5" z="true" w="abc" v="-1e3" n="nan"/>'), typed=True)
+    assert d == {'a': {'x': 1, 'y': 2.5, 'z': True, 'w': 'abc', 'v': -1000.0, 'n': 'nan'}}
+    assert etree.tostring(d2xml(d, typed=True)) == b'<a x="1" y="2.5" z="true" w="abc" v="-1000.0" n="nan"/>'
+    assert typed_value('007') == 7
+
+
+def test_xml2nv():
+    'xml2nv records every other level: the grandchildren of a named node'
+    meta = etree.XML(M)
+    assert xml2nv(meta) == {'image_meta': None, 'image_meta/x': '0.5'}
+    assert xml2nv(meta, typed=True)['image_meta/x'] == 0.5
+
+def test_deep():
+    'conversions are not limited by the recursion limit'
+    root = node = etree.Element('tag', name='root')
+    for i in range(5000):
+        node = etree.SubElement(node, 'tag', name='t%d' % i, value=str(i))
+    d = xml2d(root)
+    assert etree.tostring(d2xml(d)) == etree.tostring(root)
+    assert len(xml2nv(root)) == 2500
+
+
+def test_dict_element():
+    'DictElement reads a dict like the element it was made from'
+    e = etree.XML('<tag name="m" n="1"><value>x</value><tag name="d" flag="true"/><value>y</value></tag>')
+    d = xml2d(e, typed=True, text=True)
+    assert d == {'tag': {'name': 'm', 'n': 1, 'value': [{'__text__': 'x'}, {'__text__': 'y'}], 'tag': [{'name': 'd', 'flag': True}]}}
+    view = DictElement.fromdict(d)
+    assert view.tag == 'tag' and view.get('n') == '1' and view.get('value') is None and len(view) == 3
+    assert [ (x.tag, x.text) for x in view ] == [('value', 'x'), ('value', 'y'), ('tag', None)]
+    assert view.findall('tag')[0].get('flag') == 'true'
+    assert view.find('tag').attrib == {'name': 'd', 'flag': 'true'}
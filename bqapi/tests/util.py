@@ -1,7 +1,6 @@
-from bq.util.mkdir import _mkdir
 import posixpath
-import urllib
 import os
+from six.moves import urllib
 
 def fetch_file(filename, url, dir):
     """
@@ -11,10 +10,11 @@ def fetch_file(filename, url, dir):
         
         @return the local path to the file
     """
+    from bq.util.mkdir import _mkdir
     _mkdir(url)
     _mkdir(dir)
     url = posixpath.join(url, filename)
     path = os.path.join(dir, filename)
     if not os.path.exists(path):
-        urllib.urlretrieve(url, path)
+        urllib.request.urlretrieve(url, path)
     return path
\ No newline at end of file
@@ -1,7 +1,25 @@
+import os
+import importlib
 
+from .exception import BQApiError
 
-USENODE = False
+# object model backend: bqclass (python objects) or bqnode (views over the lxml tree)
+BACKENDS = ('bqclass', 'bqnode')
+BACKEND = os.environ.get('BQAPI_BACKEND', 'bqclass')
+
+USENODE = BACKEND == 'bqnode'
 if USENODE:
     from .bqnode import  *
 else:
     from .bqclass import *
+
+def get_backend(name=None):
+    """Return the object model module of a backend
+
+    @param name: 'bqclass' or 'bqnode' (default from the BQAPI_BACKEND environment variable)
+    @return: the bqapi.bqclass or bqapi.bqnode module
+    """
+    name = name or BACKEND
+    if name not in BACKENDS:
+        raise BQApiError("unknown object model backend %s (expected one of %s)" % (name, ", ".join(BACKENDS)))
+    return importlib.import_module('.' + name, __package__)
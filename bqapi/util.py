@@ -1,19 +1,83 @@
 
 
 import os
+import io
 import shutil
+import tempfile
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 #import urllib
 #import urlparse
 #import time
 import logging
 from six.moves import urllib
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 #from lxml import etree as ET
 #from lxml import etree
 from .xmldict import xml2d, d2xml
+from .exception import BQApiError
 
 log = logging.getLogger('bqapi.util')
 
+#####################################################
+# misc: concurrency
+#####################################################
+
+def ordered_map(fct, items, workers=4, ahead=None):
+    """Apply fct to items in a thread pool and yield the results in order
+
+    At most ahead results (default: workers) are computed ahead of the
+    consumer, the items not started when the generator is closed are dropped.
+    """
+    ahead = workers if ahead is None else ahead
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        try:
+            for item in items:
+                pending.append(pool.submit(fct, item))
+                if len(pending) > ahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def create_output(out, shape, dtype):
+    """An array of shape and dtype to be filled
+
+    @param out: None for a new ndarray, an ndarray of shape, 'memmap' for a np.memmap
+    on a temporary file or the filename of a np.memmap
+    """
+    if out is None:
+        return np.empty(shape, dtype)
+    if isinstance(out, np.ndarray):
+        if out.shape != tuple(shape) or not np.can_cast(dtype, out.dtype):
+            raise BQApiError("output array %s %s cannot hold %s %s" % (out.shape, out.dtype, tuple(shape), np.dtype(dtype)))
+        return out
+    if out == 'memmap':
+        out = tempfile.TemporaryFile()
+    return np.memmap(out, dtype=dtype, mode='w+', shape=tuple(shape))
+
+def yx_layout(shape, height, width, channels=0):
+    """number of dimensions after the y, x dimensions of a decoded plane
+
+    A shape holding it at several axes, i.e. a 3x3 tile of 3 channels,
+    has the samples last when its last dimension is the channel count.
+    """
+    after = [ len(shape) - axis - 2 for axis in range(len(shape) - 1)
+              if tuple(shape[axis:axis+2]) == (height, width) ]
+    if not after:
+        raise BQApiError("shape %s does not hold a %dx%d plane" % (shape, height, width))
+    if len(after) > 1 and 1 in after and channels > 1 and shape[-1] == channels:
+        return 1
+    return min(after)
+
 #####################################################
 # misc: unicode
 #####################################################
@@ -182,26 +246,28 @@ def fetch_blob(session, uri, dest=None, uselocalpath=False):
     return {uri: outdest}
 
 
-def fetch_image_planes(session, uri, dest=None, uselocalpath=False):
+def fetch_image_planes(session, uri, dest=None, uselocalpath=False, out=None, workers=4):
     """
         fetch all the image planes of an image locally
         @param session: the bqsession
         @param uri: resource image uri
-        @param dest: a destination directory
+        @param dest: a destination directory for one tiff file per plane, when None
+        the planes are decoded into a (t,z,c,y,x) array (requires numpy and tifffile)
         @param uselocalpath: true when routine is run on same host as server
+        @param out: the array of the planes, an ndarray, 'memmap' or a filename
+        for a np.memmap (default: a new ndarray)
+        @param workers: number of planes fetched (and decoded) concurrently
 
+        @return the list of plane files or the array of the planes
     """
     image = session.load (uri, view='full')
     #x,y,z,t,ch = image.geometry()
-    meta = image.pixels().meta().fetch()
-    #meta = ET.XML(meta)
-    meta = session.factory.string2etree(meta)
-    t  = meta.findall('.//tag[@name="image_num_t"]')
-    t  = len(t) and t[0].get('value')
-    z  = meta.findall('.//tag[@name="image_num_z"]')
-    z  = len(z) and z[0].get('value')
-    tplanes = int(t)
-    zplanes = int(z)
+    meta = image.meta()
+    def num(n):
+        v = meta.findall('.//tag[@name="image_num_%s"]' % n)
+        return int(len(v) and v[0].get('value'))
+    tplanes = num('t')
+    zplanes = num('z')
 
     planes=[]
     for t in range(tplanes):
@@ -211,30 +277,64 @@ def fetch_image_planes(session, uri, dest=None, uselocalpath=False):
                 ip = ip.localpath()
             planes.append (ip)
 
-    files = []
-    for i, p in enumerate(planes):
-        slize = p.fetch()
-        fname = os.path.join (dest, "%.5d.TIF" % i)
-        if uselocalpath:
-            #path = ET.XML(slize).xpath('/resource/@src')[0]
-            resource = session.factory.string2etree(slize)
-            path = resource.get ('value')
-            # Strip file:/ from path
-            if path.startswith ('file:/'):
-                path = path[5:]
-            if os.path.exists(path):
-                safecopy (path, fname)
+    def localpath(slize):
+        #path = ET.XML(slize).xpath('/resource/@src')[0]
+        resource = session.factory.string2etree(slize)
+        path = resource.get ('value')
+        # Strip file:/ from path
+        if path.startswith ('file:/'):
+            path = path[5:]
+        if os.path.exists(path):
+            return path
+        log.error ("localpath did not return valid path: %s", path)
+
+    if dest is None:
+        import tifffile
+        height, width, channels = num('y'), num('x'), num('c')
+        result = []
+        layout = []
+        lock = threading.Lock()
+        def fetch_plane(i):
+            slize = planes[i].fetch()
+            data = tifffile.imread(localpath(slize) if uselocalpath else io.BytesIO(slize))
+            slize = None
+            with lock:
+                if not result:
+                    # the planes have the layout of the first one decoded
+                    layout.append(yx_layout(data.shape, height, width, channels))
+                    shape = _plane_cyx(data, height, width, layout[0]).shape
+                    result.append(create_output(out, (tplanes, zplanes) + shape, data.dtype))
+            result[0][divmod(i, zplanes)] = _plane_cyx(data, height, width, layout[0])
+    else:
+        def fetch_plane(i):
+            slize = planes[i].fetch()
+            fname = os.path.join (dest, "%.5d.TIF" % i)
+            if uselocalpath:
+                path = localpath(slize)
+                if path is not None:
+                    safecopy (path, fname)
             else:
-                log.error ("localpath did not return valid path: %s", path)
-        else:
-            f = open(fname, 'wb')
-            f.write(slize)
-            f.close()
-        files.append(fname)
-
+                f = open(fname, 'wb')
+                f.write(slize)
+                f.close()
+            return fname
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        files = list(pool.map(fetch_plane, range(len(planes))))
+    if dest is None:
+        return result[0] if result else None
     return files
 
 
+def _plane_cyx(data, height, width, after):
+    "a decoded plane with after dimensions following its y, x dimensions as a (c,y,x) array"
+    if data.shape[data.ndim-after-2:data.ndim-after] != (height, width):
+        raise BQApiError("plane shape %s does not hold a %dx%d plane" % (data.shape, height, width))
+    if after == 0:
+        return data.reshape((-1, height, width))
+    return data.reshape((height, width, -1)).transpose(2, 0, 1)
+
+
 def next_name(name):
     count = 0
     while os.path.exists("%s-%.5d.TIF" % (name, count)):
@@ -318,12 +418,15 @@ def fetchImage(session, uri, dest, uselocalpath=False):
 
         @return
     """
-    image = session.load(uri).pixels().info()
+    image = session.load(uri)
     #fileName = ET.XML(image.fetch()).xpath('//tag[@name="filename"]/@value')[0]
-    fileName = session.factory.string2etree(image.fetch()).findall('.//tag[@name="filename"]')[0]
-    fileName = fileName.get ('value')
+    fileName = image.meta().findall('.//tag[@name="filename"]')
+    if not fileName:
+        # not in the image meta of this server
+        fileName = session.factory.string2etree(image.pixels().info().fetch()).findall('.//tag[@name="filename"]')
+    fileName = fileName[0].get ('value')
 
-    ip = session.load(uri).pixels().format('tiff')
+    ip = image.pixels().format('tiff')
 
     if uselocalpath:
         ip = ip.localpath()
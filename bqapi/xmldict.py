@@ -6,29 +6,77 @@ try:
     from lxml import etree
 except ImportError:
     import xml.etree.ElementTree as etree
-from itertools import groupby
+import re
+from itertools import groupby, chain
+from operator import attrgetter
 
-def xml2d(e):
+_tag = attrgetter('tag')
+
+_number = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+_booleans = { 'true': True, 'True': True, 'false': False, 'False': False }
+
+def typed_value(v, cache=None):
+    """Parse a number or boolean string, other strings are returned as is
+
+    @param cache: optional dict of already parsed strings
+    """
+    if cache is not None:
+        try:
+            return cache[v]
+        except KeyError:
+            pass
+    if v in _booleans:
+        t = _booleans[v]
+    elif _number.match(v):
+        try:
+            t = int(v)
+        except ValueError:
+            t = float(v)
+    else:
+        t = v
+    if cache is not None:
+        cache[v] = t
+    return t
+
+def _typed_attrib(e, cache):
+    return dict([ (k, typed_value(v, cache)) for k, v in e.attrib.items() ])
+
+def xml2d(e, typed=False, text=False):
     """Convert an etree into a dict structure
 
     @type  e: etree.Element
     @param e: the root of the tree
+    @param typed: parse attribute numbers and booleans (see typed_value)
+    @param text: record element text under '__text__'
     @return: The dictionary representation of the XML tree
     """
-    def _xml2d(e):
-        kids = dict(e.attrib)
+    cache = {}
+    root = _typed_attrib(e, cache) if typed else dict(e.attrib)
+    if text and e.text is not None:
+        root['__text__'] = e.text
+    tag = e.tag
+    stack = [ (e, root) ]
+    while stack:
+        e, kids = stack.pop()
         #if e.text:
         #    kids['__text__'] = e.text
         #if e.tail:
         #    kids['__tail__'] = e.tail
-        for k, g in groupby(e, lambda x: x.tag):
-            g = [ _xml2d(x) for x in g ]
-            kids[k]=  g
-        return kids
-    return { e.tag : _xml2d(e) }
+        for k, g in groupby(e, _tag):
+            d = kids.get(k)
+            if d.__class__ is not list: # tags may be interleaved with other kids
+                kids[k] = d = []
+            for x in g:
+                dx = _typed_attrib(x, cache) if typed else dict(x.attrib)
+                if text and x.text is not None:
+                    dx['__text__'] = x.text
+                d.append(dx)
+                if len(x): # leaves are complete
+                    stack.append( (x, dx) )
+    return { tag : root }
 
 
-def d2xml(d):
+def d2xml(d, typed=False, makeelement=None):
     """convert dict to xml
 
        1. The top level d must contain a single entry i.e. the root element
@@ -53,50 +101,147 @@ def d2xml(d):
 
     @type  d: dict
     @param d: A dictionary formatted as an XML document
+    @param typed: write booleans as true/false (the inverse of xml2d typed)
+    @param makeelement: root element constructor i.e. parser.makeelement (default etree.Element)
     @return:  A etree Root element
     """
-    def _d2xml(d, p):
-        for k,v in list(d.items()):
+    k,v = next(iter(d.items()))
+    root = (makeelement or etree.Element)(k)
+    stack = [ (v, root) ]
+    while stack:
+        d, p = stack.pop()
+        for k,v in d.items():
             if v is None: continue
             if isinstance(v,dict):
-                node = etree.SubElement(p, k)
-                _d2xml(v, node)
+                stack.append( (v, etree.SubElement(p, k)) )
             elif isinstance(v,list):
                 for item in v:
                     if item is None: continue
-                    node = etree.SubElement(p, k)
-                    _d2xml(item, node)
-            #elif k == "__text__":
-            #        p.text = v
+                    stack.append( (item, etree.SubElement(p, k)) )
+            elif k == "__text__":
+                p.text = v if v.__class__ is str else str(v)
             #elif k == "__tail__":
             #        p.tail = v
+            elif v.__class__ is str:
+                p.set(k, v)
+            elif typed and isinstance(v, bool):
+                p.set(k, 'true' if v else 'false')
             else:
                 p.set(k, str(v))
+    return root
+
+def _attr_text(v):
+    "attribute text of a dict value as written by d2xml typed"
+    if v.__class__ is str:
+        return v
+    if isinstance(v, bool):
+        return 'true' if v else 'false'
+    return str(v)
+
+class DictElement(object):
+    """Read only element view of a dict in the xml2d layout
+
+    Provides the tag, get, text, len and iteration of an element without
+    building a tree, other element methods (find, iterfind ..) are served
+    by the tree d2xml makes on first use.
+    """
+    __slots__ = ('tag', 'd', '_etree')
+
+    def __init__(self, tag, d):
+        self.tag = tag
+        self.d = d
+        self._etree = None
 
-    k,v = list(d.items())[0]
-    node = etree.Element(k)
-    _d2xml(v, node)
-    return node
+    @classmethod
+    def fromdict(cls, d):
+        "the root element of a document dict {tag: {...}}"
+        tag, v = next(iter(d.items()))
+        return cls(tag, v)
+
+    def get(self, key, default=None):
+        v = self.d.get(key)
+        if v.__class__ is str:
+            return v
+        if v is None or v.__class__ in (list, dict):
+            return default
+        return _attr_text(v)
+
+    @property
+    def text(self):
+        v = self.d.get('__text__')
+        return v if v is None else _attr_text(v)
+
+    @property
+    def attrib(self):
+        return dict([ (k, _attr_text(v)) for k, v in self.d.items()
+                      if k != '__text__' and v is not None and v.__class__ not in (list, dict) ])
+
+    def __iter__(self):
+        for k, v in self.d.items():
+            if v.__class__ is list:
+                for x in v:
+                    if x is not None:
+                        yield DictElement(k, x)
+            elif v.__class__ is dict:
+                yield DictElement(k, v)
+
+    def __len__(self):
+        n = 0
+        for v in self.d.values():
+            if v.__class__ is list:
+                n += len(v)
+            elif v.__class__ is dict:
+                n += 1
+        return n
+
+    def findall(self, path):
+        if path.isalnum():
+            return [ x for x in self if x.tag == path ]
+        return self.etree().findall(path)
+
+    def etree(self):
+        "the element tree of this dict (built once)"
+        if self._etree is None:
+            self._etree = d2xml({ self.tag : self.d }, typed=True)
+        return self._etree
+
+    def __getattr__(self, name):
+        return getattr(self.etree(), name)
 
 # simple dictionary output of name-value pairs, useful for image metadata
-def xml2nv(e):
+def xml2nv(e, typed=False):
     """Convert an etree into a dict structure
 
+    Note: only every other level is recorded, the grandchildren of a named
+    node are recorded below its name (its children are skipped)
+
     @type  e: etree.Element
     @param e: the root of the tree
+    @param typed: parse numbers and booleans values (see typed_value)
     @return: The dictionary representation of the XML tree
     """
-    def _xml2nv(e, a, path):
-        for g in e:
+    a = {}
+    cache = {}
+    nodes = [ iter(e) ]
+    paths = [ '' ]
+    while nodes:
+        for g in nodes[-1]:
             n = g.get('name') or g.get('type')
             if n is None:
                 continue
-            a['%s%s'%(path, n)] = g.get('value')
-            for child in g:
-                _xml2nv(child, a, '%s%s/'%(path, n))
-        return
-    a = {}
-    _xml2nv(e, a, '')
+            path = paths[-1] + n
+            v = g.get('value')
+            if typed and v is not None:
+                v = typed_value(v, cache)
+            a[path] = v
+            if len(g):
+                # the grandchildren in document order, before the next sibling
+                nodes.append(chain.from_iterable(g))
+                paths.append(path + '/')
+                break
+        else:
+            nodes.pop()
+            paths.pop()
     return a
 
 if __name__=="__main__":